@@ -7,19 +7,30 @@ threads refer to specific callback functions from this file.
 
 The module has the following classes:
     - AreaScanThread(threading.Thread): performs general area scans.
+    - AdaptiveScanThread(AreaScanThread): performs coarse-to-fine area scans, refining only around the high values.
+    - PeakSearchThread(AreaScanThread): locates the hotspot with a model-guided search instead of a full grid.
     - ZoomScanThread(threading.Thread): performs zoom scans at the maximum value.
-                                        position found during the general area scan.
-    - CorrectionThread(threading.Thread): retakes a previous measurement from the general area scan.
+                                        position found during the general area scan (or at the highest local maxima).
+    - CorrectionThread(threading.Thread): retakes previous measurements from the general area scan in one pass.
 
 Authors:
 Chang Hwan 'Oliver' Choi, Biomedical/Software Engineering Intern (Aug. 2018) - changhwan.choi@pctest.com
 Ganesh Arvapalli, Software Engineering Intern (Jan. 2018) - ganesh.arvapalli@pctest.com
 """
 
+from concurrent.futures import ThreadPoolExecutor
 import os
 import threading
-from src.motor_driver import MotorDriver
+import traceback
+from src.motor_driver import STEP_UNIT, MotionProgram, MotorSession, MotorTimeoutError
 from src.narda_navigator import NardaNavigator
+from src.path_planner import TravelTimeModel, plan_path
+from src.positioning import exact_steps, round_steps, step_ratio
+from src.scan_mask import scan_mask
+from src.scan_estimate import SETUP_TIME, ScanEstimate, ScanProgress, calibrated_model, estimate_path, \
+    save_calibration
+from src.scan_journal import JOURNAL_NAME, ScanJournal
+from src.surrogate_search import SurrogateSearch
 import numpy as np
 import serial
 import wx
@@ -32,7 +43,8 @@ class AreaScanThread(threading.Thread):
     Thread for handling general area scans.
     """
     def __init__(self, parent, x_distance, y_distance, grid_step_dist, dwell_time, span_start,
-                 span_stop, save_dir, comment, meas_type, meas_field, meas_side, meas_rbw, meas,start_pos):
+                 span_stop, save_dir, comment, meas_type, meas_field, meas_side, meas_rbw, meas,start_pos,
+                 controller=None, roi=None, stop_policy=None, resume=False, settle=None, dry_run=False):
         """
         :param parent: Parent object (i.e. the Frame/GUI calling the thread).
         :param x_distance: Width of the scanning area.
@@ -48,6 +60,18 @@ class AreaScanThread(threading.Thread):
         :param meas_side: Side of the phone being scanned.
         :param meas_rbw: Resolution bandwidth for the FFT.
         :param start_pos: User defined starting point (grid number) if not 0.
+        :param controller: Port name or USB serial number of the C4 controller (None for the default controller).
+        :param roi: Region of interest, the points outside of it are not measured (see scan_mask()). Boolean numpy
+                    array of the grid points to measure or polygon of (x, y) vertices in cm, None to scan the whole
+                    area.
+        :param stop_policy: ScanStopPolicy ending the scan early (e.g. once the peak is located), None to measure every
+                            point. Not used by adaptive scans and peak searches, which stop on their own.
+        :param resume: Resume the interrupted scan recorded in the scan journal of the save directory, if its settings
+                       are the same. Not used by adaptive scans and peak searches.
+        :param settle: SettleDetector ending the dwell at each point once the reading is stable (dwell_time is then the
+                       longest dwell), None to always wait dwell_time.
+        :param dry_run: Only estimate the duration of the scan (see estimate_scan()), without using the positioner or
+                        the NARDA program.
         """
         self.parent = parent
         self.callback = parent.update_values
@@ -65,13 +89,22 @@ class AreaScanThread(threading.Thread):
         self.meas_rbw = meas_rbw
         self.meas = meas
         self.start_pos = start_pos
+        self.controller = controller
+        self.roi = roi
+        self.stop_policy = stop_policy
+        self.resume = resume
+        self.settle = settle
+        self.dry_run = dry_run
+        self.estimate = None  # Placeholder for the ScanEstimate of a dry run
 
         self.num_steps = None  # Placeholder for number of motor steps needed to move one grid space
+        self.mask = None  # Placeholder for the boolean array of the grid points inside the region of interest
         self.values = None  # Placeholder for the array of values
         self.grid = None  # Placeholder for the coordinate grid array
         self.curr_row = None  # Current position row
         self.curr_col = None  # Current position col
         self.max_fname = None  # The filename of the screenshot for the maximum measurement
+        self.origin = None  # Absolute motor position (in steps) of the first grid point
 
         super(AreaScanThread, self).__init__()
 
@@ -91,9 +124,35 @@ class AreaScanThread(threading.Thread):
         # Preparation
         x_points = int(np.ceil(np.around(self.x_distance / self.grid_step_dist, decimals=3))) + 1
         y_points = int(np.ceil(np.around(self.y_distance / self.grid_step_dist, decimals=3))) + 1
+        self.mask = scan_mask(self.roi, x_points, y_points, self.grid_step_dist)
+        if self.mask is not None:
+            print("Region of interest: %d of %d grid points" % (self.mask.sum(), self.mask.size))
+            self.parent.logger.info("Region of interest: %d of %d grid points" % (self.mask.sum(), self.mask.size))
+            if not self.mask.any():
+                print("Error: The region of interest does not contain any grid point")
+                self.parent.logger.info("Error: The region of interest does not contain any grid point")
+                wx.CallAfter(self.parent.enablegui)
+                return
+        if self.dry_run:
+            # Estimate only, the positioner and the NARDA program are not used
+            self.estimate = estimate_scan(x_points, y_points, float(step_ratio(self.grid_step_dist, STEP_UNIT)),
+                                          self.dwell_time, self.start_pos, self.mask)
+            print("Dry run (nothing is moved or measured):")
+            print(self.estimate.report())
+            self.parent.logger.info("Dry run (nothing is moved or measured):\n%s" % self.estimate.report())
+            if type(self) is not AreaScanThread or self.settle is not None:
+                # Adaptive scans and peak searches measure part of the grid, settle detection shortens the dwell
+                print("The estimate is an upper bound (every grid point with the full dwell time).")
+                self.parent.logger.info("The estimate is an upper bound (every grid point with the full dwell time).")
+            wx.CallAfter(self.parent.enablegui)
+            return
+        if type(self) is not AreaScanThread:
+            # Only the scan of the full grid is recorded in the scan journal (see scan())
+            print("Note: This scan is not journaled, it cannot be resumed if it is interrupted.")
+            self.parent.logger.info("Note: This scan is not journaled, it cannot be resumed if it is interrupted.")
         # Check ports and instantiate relevant objects (motors, NARDA driver)
         try:
-            m = MotorDriver()
+            m = MotorSession.borrow(self.controller)
         except serial.SerialException:
             print("Error: Connection to C4 controller was not found")
             self.parent.logger.info("Error: Connection to C4 controller was not found")
@@ -104,41 +163,179 @@ class AreaScanThread(threading.Thread):
             #raise Exception("Threw an exception")
             #exit()
             return
-        narda = NardaNavigator()
-        # Set measurement settings
-        narda.selectTab('mode')
-        narda.selectInputField(self.meas_field)
-        narda.selectTab('span')
-        narda.inputTextEntry('start', str(self.span_start))
-        narda.inputTextEntry('start', str(self.span_start))
-        narda.inputTextEntry('stop', str(self.span_stop))
-        narda.selectRBW(self.meas_rbw)
-        narda.selectTab('data')
-        narda.enableMaxHold()
-
         # Calculate number of motor steps necessary to move one grid space
-        self.num_steps = self.grid_step_dist / m.step_unit
+        self.num_steps = float(step_ratio(self.grid_step_dist, m.step_unit))
 
         # Run scan
-        self.values, self.grid, self.curr_row,\
-        self.curr_col, self.max_fname = run_scan(x_points, y_points, m, narda, self.num_steps,
-                                                 self.dwell_time, self.save_dir, self.comment,
-                                                 self.meas_type, self.meas_field, self.meas_side,
-                                                 self.meas, self.start_pos, self.parent.logger)
+        try:
+            narda = NardaNavigator()
+            # Set measurement settings
+            narda.selectTab('mode')
+            narda.selectInputField(self.meas_field)
+            narda.selectTab('span')
+            narda.inputTextEntry('start', str(self.span_start))
+            narda.inputTextEntry('start', str(self.span_start))
+            narda.inputTextEntry('stop', str(self.span_stop))
+            narda.selectRBW(self.meas_rbw)
+            narda.selectTab('data')
+            narda.enableMaxHold()
+            self.values, self.grid, self.curr_row,\
+            self.curr_col, self.max_fname, self.origin = self.scan(m, narda, x_points, y_points)
+        except MotorTimeoutError as error:
+            abort_on_timeout(self.parent, self.controller, error)
+            return
+        except Exception as error:
+            abort_on_error(self.parent, self.controller, error)
+            return
         print("General area scan complete.")
         self.parent.logger.info("General area scan complete.")
         self.callback(self)
         wx.CallAfter(self.parent.run_post_scan)
-        m.destroy()
+
+
+    def scan(self, m, narda, x_points, y_points):
+        """
+        Runs the scan of the grid. Every point measured is recorded in the scan journal of the save directory (see
+        'scan_journal.py'); if self.resume is set, an interrupted scan with the same settings continues where it
+        stopped.
+
+        :param m: Motor driver object.
+        :param narda: NARDA navigator object.
+        :param x_points: Number of grid rows.
+        :param y_points: Number of grid columns.
+        :return: Same as run_scan().
+        """
+        header = {'x_points': x_points, 'y_points': y_points, 'num_steps': round(self.num_steps, 6),
+                  'span_start': self.span_start, 'span_stop': self.span_stop, 'meas_type': self.meas_type,
+                  'meas_field': self.meas_field, 'meas_side': self.meas_side, 'meas_rbw': self.meas_rbw,
+                  'meas': self.meas, 'roi': None if self.mask is None else self.mask.tolist(),
+                  'start_pos': self.start_pos, 'created': time.time()}
+        filename = os.path.join(self.save_dir, JOURNAL_NAME)
+        journal = ScanJournal.resume(filename, header) if self.resume else None
+        if journal is not None:
+            # The grid stays where the interrupted scan put it
+            origin, start_pos = tuple(journal.header['origin']), journal.header['start_pos']
+            print("Resuming the interrupted scan (%d point(s) already measured)" % len(journal.records))
+            self.parent.logger.info("Resuming the interrupted scan (%d point(s) already measured)"
+                                    % len(journal.records))
+            if not m.position_known:
+                print("Motor position unknown, resetting the motors before resuming")
+                self.parent.logger.info("Motor position unknown, resetting the motors before resuming")
+                m.home_motors()
+        else:
+            if self.resume:
+                print("No interrupted scan with the same settings was found, starting a new scan")
+                self.parent.logger.info("No interrupted scan with the same settings was found, starting a new scan")
+            origin, start_pos = pos_one_origin(m, self.num_steps, x_points, y_points), self.start_pos
+            header['origin'] = [int(origin[0]), int(origin[1])]
+            journal = ScanJournal.create(filename, header)
+        try:
+            results = run_scan(x_points, y_points, m, narda, self.num_steps, self.dwell_time, self.save_dir,
+                               self.comment, self.meas_type, self.meas_field, self.meas_side, self.meas, start_pos,
+                               self.parent.logger, origin, self.mask, stop=self.stop_policy, journal=journal,
+                               settle=self.settle)
+            journal.finish()
+        except Exception as error:
+            journal.record_failure(error)  # The points measured so far can be resumed
+            raise
+        finally:
+            journal.close()
+        return results
+
+
+class AdaptiveScanThread(AreaScanThread):
+    """
+    Thread for handling adaptive (coarse-to-fine) area scans. A coarse pass measures every coarse_stride-th point of
+    the grid; the cells of the coarse grid whose corners are near the running maximum are then refined recursively
+    down to the grid step, and the values of the points not measured are interpolated from the cell corners.
+    """
+    def __init__(self, parent, x_distance, y_distance, grid_step_dist, dwell_time, span_start,
+                 span_stop, save_dir, comment, meas_type, meas_field, meas_side, meas_rbw, meas, start_pos,
+                 controller=None, roi=None, stop_policy=None, resume=False, settle=None, dry_run=False,
+                 coarse_stride=4, refine_ratio=0.5):
+        """
+        See AreaScanThread for the other parameters.
+
+        :param coarse_stride: Number of grid steps between the points of the coarse pass.
+        :param refine_ratio: A cell is refined if the highest value at its corners is at least this fraction of the
+                             running maximum.
+        """
+        super(AdaptiveScanThread, self).__init__(parent, x_distance, y_distance, grid_step_dist, dwell_time,
+                                                 span_start, span_stop, save_dir, comment, meas_type, meas_field,
+                                                 meas_side, meas_rbw, meas, start_pos, controller, roi, stop_policy,
+                                                 resume, settle, dry_run)
+        self.coarse_stride = coarse_stride
+        self.refine_ratio = refine_ratio
+        self.measured = None  # Placeholder for the boolean array of the points actually measured
+
+    def scan(self, m, narda, x_points, y_points):
+        """
+        Runs the adaptive scan of the grid (the user defined starting point is not used).
+
+        :param m: Motor driver object.
+        :param narda: NARDA navigator object.
+        :param x_points: Number of grid rows.
+        :param y_points: Number of grid columns.
+        :return: Same as run_scan().
+        """
+        results = run_adaptive_scan(x_points, y_points, m, narda, self.num_steps, self.dwell_time, self.save_dir,
+                                    self.comment, self.meas_type, self.meas_field, self.meas_side, self.meas,
+                                    self.parent.logger, self.coarse_stride, self.refine_ratio, self.mask, self.settle)
+        self.measured = results[-1]
+        return results[:-1]
+
+
+class PeakSearchThread(AreaScanThread):
+    """
+    Thread for handling model-guided peak searches. A surrogate model is fitted to the measurements so far and the next
+    point is chosen by expected improvement per second of probe time (see 'surrogate_search.py'), so the hotspot and its
+    value are found without measuring the whole grid. The values of the points not measured are predicted by the model.
+    """
+    def __init__(self, parent, x_distance, y_distance, grid_step_dist, dwell_time, span_start,
+                 span_stop, save_dir, comment, meas_type, meas_field, meas_side, meas_rbw, meas, start_pos,
+                 controller=None, roi=None, stop_policy=None, resume=False, settle=None, dry_run=False,
+                 max_points=None, tolerance=1e-4):
+        """
+        See AreaScanThread for the other parameters.
+
+        :param max_points: Largest number of measurements (see SurrogateSearch).
+        :param tolerance: The search stops when no point is expected to improve the maximum by more than this fraction
+                          of the measured value range.
+        """
+        super(PeakSearchThread, self).__init__(parent, x_distance, y_distance, grid_step_dist, dwell_time,
+                                               span_start, span_stop, save_dir, comment, meas_type, meas_field,
+                                               meas_side, meas_rbw, meas, start_pos, controller, roi, stop_policy,
+                                               resume, settle, dry_run)
+        self.max_points = max_points
+        self.tolerance = tolerance
+        self.measured = None  # Placeholder for the boolean array of the points actually measured
+
+    def scan(self, m, narda, x_points, y_points):
+        """
+        Runs the peak search over the grid (the user defined starting point is not used).
+
+        :param m: Motor driver object.
+        :param narda: NARDA navigator object.
+        :param x_points: Number of grid rows.
+        :param y_points: Number of grid columns.
+        :return: Same as run_scan().
+        """
+        results = run_peak_search(x_points, y_points, m, narda, self.num_steps, self.dwell_time, self.save_dir,
+                                  self.comment, self.meas_type, self.meas_field, self.meas_side, self.meas,
+                                  self.parent.logger, self.max_points, self.tolerance, self.mask, self.settle)
+        self.measured = results[-1]
+        return results[:-1]
 
 
 class ZoomScanThread(threading.Thread):
     """
-    Thread for handling zoom scans.
+    Thread for handling zoom scans. Several peaks (the highest local maxima of the area scan) can be zoomed in one job,
+    visited in the order planned by the path planner.
     """
     def __init__(self, parent, dwell_time, span_start, span_stop, save_dir, comment, meas_type,
                  meas_field, meas_side, meas_rbw, meas, num_steps, values, grid, curr_row, curr_col,
-                 zoom_checkbox, start_pos, grid_x, grid_y):
+                 zoom_checkbox, start_pos, grid_x, grid_y, origin=None, controller=None, num_peaks=1, zoom_points=5,
+                 zoom_factor=4, peak_separation=None, settle=None, dry_run=False):
 
         """
         :param parent: Parent object (i.e. the Frame/GUI calling the thread).
@@ -157,6 +354,18 @@ class ZoomScanThread(threading.Thread):
         :param grid: Numpy array of index values (1-index).
         :param curr_row: The NS probe's current row position.
         :param curr_col: The NS probe's current column position.
+        :param origin: Absolute motor position (in steps) of the first point of the area scan grid. Derived from the
+                       current motor position and (curr_row, curr_col) if not given.
+        :param controller: Port name or USB serial number of the C4 controller (None for the default controller).
+        :param num_peaks: Number of local maxima to zoom on, highest first (see find_peaks()).
+        :param zoom_points: Number of rows and columns of each zoom scan grid.
+        :param zoom_factor: Number of zoom grid steps per area scan grid step.
+        :param peak_separation: Smallest distance between two zoomed peaks (in area scan grid steps). By default, the
+                                zoom grids of two peaks do not overlap.
+        :param settle: SettleDetector ending the dwell at each point once the reading is stable, None to always wait
+                       dwell_time.
+        :param dry_run: Only estimate the duration of the zoom scans, without using the positioner or the NARDA
+                        program.
         """
         self.parent = parent
         self.callback = parent.update_values
@@ -177,12 +386,25 @@ class ZoomScanThread(threading.Thread):
         self.values = values  # original array of values
         self.zoom_values = None  # Placeholder for zoom coordinates
         self.grid = grid  # Placeholder for the coordinate grid array
+        self.num_peaks = num_peaks
+        self.zoom_points = zoom_points
+        self.zoom_factor = zoom_factor
+        if peak_separation is None:
+            peak_separation = max(2, int(np.ceil((zoom_points - 1) / float(zoom_factor))))
+        self.peak_separation = peak_separation
+        self.peaks = None  # Placeholder for the (row, col) of the zoomed peaks, highest first
+        self.zoom_results = None  # Placeholder for the zoom scan values of each peak, highest first
 
         # variables for zoom_checkbox
         self.zoom_checkbox = zoom_checkbox
         self.start_pos = start_pos
         self.grid_x = grid_x
         self.grid_y = grid_y
+        self.origin = origin
+        self.controller = controller
+        self.settle = settle
+        self.dry_run = dry_run
+        self.estimate = None  # Placeholder for the ScanEstimate of a dry run
         super(ZoomScanThread, self).__init__()
 
     def run(self):
@@ -198,29 +420,56 @@ class ZoomScanThread(threading.Thread):
         self.parent.logger.info("Type: %s | Field: %s | Side: %s" % (self.meas_type, self.meas_field, self.meas_side))
         self.parent.logger.info("Measurement: %s" % self.meas)
 
-        # Preparation
-        x_points = 5
-        y_points = 5
+        if self.dry_run:
+            self.estimate_zoom()
+            wx.CallAfter(self.parent.enablegui)
+            return
+        print("Note: Zoom scans are not journaled, an interrupted zoom scan cannot be resumed.")
+        self.parent.logger.info("Note: Zoom scans are not journaled, an interrupted zoom scan cannot be resumed.")
         # Check ports and instantiate relevant objects (motors, NARDA driver)
         try:
-            m = MotorDriver()
+            m = MotorSession.borrow(self.controller)
         except serial.SerialException:
             print("Error: Connection to C4 controller was not found")
             self.parent.logger.info("Error: Connection to C4 controller was not found")
+            wx.CallAfter(self.parent.enablegui)
+            return -1
+        try:
+            narda = NardaNavigator()
+            # Set measurement settings
+            narda.selectTab('mode')
+            narda.selectInputField(self.meas_field)
+            narda.selectTab('span')
+            narda.inputTextEntry('start', str(self.span_start))
+            narda.inputTextEntry('start', str(self.span_start))
+            narda.inputTextEntry('stop', str(self.span_stop))
+            narda.selectRBW(self.meas_rbw)
+            narda.selectTab('data')
+            if not self.zoom(m, narda):
+                wx.CallAfter(self.parent.enablegui)
+                return -1
+        except MotorTimeoutError as error:
+            abort_on_timeout(self.parent, self.controller, error)
+            return -1
+        except Exception as error:
+            abort_on_error(self.parent, self.controller, error)
             return -1
-        narda = NardaNavigator()
-        # Set measurement settings
-        narda.selectTab('mode')
-        narda.selectInputField(self.meas_field)
-        narda.selectTab('span')
-        narda.inputTextEntry('start', str(self.span_start))
-        narda.inputTextEntry('start', str(self.span_start))
-        narda.inputTextEntry('stop', str(self.span_stop))
-        narda.selectRBW(self.meas_rbw)
-        narda.selectTab('data')
 
+        print("Zoom scan complete.")
+        self.parent.logger.info("Zoom scan complete.")
+        self.callback(self)
+        wx.CallAfter(self.parent.run_post_scan)
+
+    def zoom(self, m, narda):
+        """
+        Runs the zoom scans, around the highest local maxima of the area scan or the user defined starting point.
+
+        :param m: Motor driver object.
+        :param narda: NARDA navigator object.
+        :return: True once the zoom scans are complete, False if there was no measured value to zoom on.
+        """
         # Calculate number of motor steps necessary to move one grid space
-        znum_steps = self.num_steps / 4.0  # Zoom scan steps are scaled down
+        znum_steps = float(exact_steps(self.num_steps) / self.zoom_factor)  # Zoom scan steps are scaled down
 
         if self.zoom_checkbox:
             # Move to the input starting position
@@ -228,60 +477,103 @@ class ZoomScanThread(threading.Thread):
             print("Start self defined zoom scan")
             grid = generate_grid(self.grid_x, self.grid_y)
 
-            move_to_pos_one(m, int(self.num_steps), self.grid_x, self.grid_y)
+            m.use_profile('traverse')
+            move_to_pos_one(m, self.num_steps, self.grid_x, self.grid_y)
             print("move to pos one")
             time.sleep(3)
-            move_to_user_defined(m, int(self.num_steps), grid, self.start_pos)
+            move_to_user_defined(m, self.num_steps, grid, self.start_pos)
             print("move to defined starting point")
             time.sleep(5)
             print("start zoom scan")
+            self.peaks = [None]
+            centers = [tuple(m.position)]
         else:
-            # Move to coordinate with maximum value
-            max_val = self.values.max()
-            max_row, max_col = np.where(self.values == float(max_val))
-            print("Max value: %f" % max_val)
-            print(max_row, max_col)
-            print("Max value coordinates: Row - %d / Col - %d" % (max_row, max_col))
-            self.parent.logger.info("Max value: %f" % max_val)
-            self.parent.logger.info(max_row, max_col)
-            self.parent.logger.info("Max value coordinates: Row - %d / Col - %d" % (max_row, max_col))
-            row_steps = max_row - self.curr_row
-            col_steps = max_col - self.curr_col
-            self.curr_row = max_row
-            self.curr_col = max_col
-            if row_steps > 0:
-                m.forward_motor_two(int(self.num_steps * row_steps))
-            else:
-                m.reverse_motor_two(int(-1 * self.num_steps * row_steps))
-            if col_steps > 0:
-                m.forward_motor_one(int(self.num_steps * col_steps))
-            else:
-                m.reverse_motor_one(int(-1 * self.num_steps * col_steps))
+            # Zoom on the highest local maxima (points outside the region of interest of the area scan are NaN)
+            self.peaks = find_peaks(self.values, self.num_peaks, self.peak_separation)
+            if not self.peaks:
+                print("Error: No measured value to zoom on")
+                self.parent.logger.info("Error: No measured value to zoom on")
+                return False
+            for rank, (row, col) in enumerate(self.peaks):
+                print("Peak %d: %f at Row - %d / Col - %d" % (rank + 1, self.values[row, col], row, col))
+                self.parent.logger.info("Peak %d: %f at Row - %d / Col - %d" % (rank + 1, self.values[row, col],
+                                                                                row, col))
+            if self.origin is None:
+                self.origin = grid_origin(m, self.num_steps, self.curr_row, self.curr_col)
+            centers = [grid_position(self.origin, self.num_steps, row, col) for row, col in self.peaks]
+        # Visit the peaks in the quickest order from the current position
+        order = plan_path(centers, TravelTimeModel.from_motor(m, 'traverse'), start=m.position)
 
-        # Run scan
-        self.zoom_values, _, _, _, _ = run_scan(x_points, y_points, m, narda, znum_steps,
-                                                self.dwell_time, self.save_dir, self.comment,
-                                                self.meas_type, self.meas_field, 'z', self.meas, 0, self.parent.logger)
-        # Move back to original position
-        m.reverse_motor_one(int(2 * znum_steps))
-        m.reverse_motor_two(int(2 * znum_steps))
+        # Run scans
+        self.zoom_results = [None] * len(self.peaks)
+        for rank in order:
+            m.use_profile('traverse')
+            m.move_to(*centers[rank])
+            if self.peaks[rank] is not None:
+                self.curr_row, self.curr_col = self.peaks[rank]
+            # Single zoom scans keep the 'z' side marker, the peak rank is added when there are several
+            side = 'z' if len(self.peaks) == 1 else 'z%d_' % (rank + 1)
+            self.zoom_results[rank], _, _, _, _, _ = run_scan(self.zoom_points, self.zoom_points, m, narda,
+                                                              znum_steps, self.dwell_time, self.save_dir,
+                                                              self.comment, self.meas_type, self.meas_field, side,
+                                                              self.meas, 0, self.parent.logger,
+                                                              settle=self.settle)
+            print("Peak %d zoom scan maximum: %f" % (rank + 1, np.nanmax(self.zoom_results[rank])))
+            self.parent.logger.info("Peak %d zoom scan maximum: %f" % (rank + 1, np.nanmax(self.zoom_results[rank])))
+            # Move back to the peak
+            m.use_profile('traverse')
+            m.move_to(*centers[rank])
+        self.zoom_values = self.zoom_results[0]
+        return True
 
-        print("Zoom scan complete.")
-        self.parent.logger.info("Zoom scan complete.")
-        self.callback(self)
-        wx.CallAfter(self.parent.run_post_scan)
-        m.destroy()
+    def estimate_zoom(self):
+        """
+        Estimates the duration of the zoom scans (dry run), relative to the current position of the NS probe, without
+        using the positioner or the NARDA program.
+
+        :return: Nothing.
+        """
+        znum_steps = float(exact_steps(self.num_steps) / self.zoom_factor)
+        start = (0, 0)  # Motor positions relative to the current position
+        setup = 0.0
+        if self.zoom_checkbox:
+            half_step = exact_steps(self.num_steps) / 2
+            row, col = grid_lookup(generate_grid(self.grid_x, self.grid_y))[max(self.start_pos, 1)]
+            centers = [(round_steps(self.num_steps, col) - round_steps(half_step, self.grid_y),
+                        round_steps(self.num_steps, row) - round_steps(half_step, self.grid_x))]
+            setup = 8.0  # Waits after the moves to the first grid point and to the starting point
+        else:
+            peaks = find_peaks(self.values, self.num_peaks, self.peak_separation)
+            if not peaks:
+                print("Error: No measured value to zoom on")
+                self.parent.logger.info("Error: No measured value to zoom on")
+                return
+            origin = (-round_steps(self.num_steps, self.curr_col), -round_steps(self.num_steps, self.curr_row))
+            centers = [grid_position(origin, self.num_steps, row, col) for row, col in peaks]
+        traverse = calibrated_model('traverse')
+        for rank in plan_path(centers, traverse, start=start):
+            # Move to the peak, zoom scan around it, and move back to the peak
+            move = ScanEstimate(0, np.abs(np.subtract(centers[rank], start)), float(traverse(start, centers[rank])),
+                                0.0, 0.0, setup)
+            zoom = estimate_scan(self.zoom_points, self.zoom_points, znum_steps, self.dwell_time, center=centers[rank])
+            self.estimate = move + zoom if self.estimate is None else self.estimate + move + zoom
+            start, setup = centers[rank], 0.0
+        print("Dry run (nothing is moved or measured):")
+        print(self.estimate.report())
+        self.parent.logger.info("Dry run (nothing is moved or measured):\n%s" % self.estimate.report())
 
 
 class CorrectionThread(threading.Thread):
     """
-    Thread for handling corrections of previous values from the general area scan.
+    Thread for handling corrections of previous values from the general area scan. Several points are re-measured in
+    one pass: the motors and the NARDA software are set up once and the points are visited in the quickest order.
     """
     def __init__(self, parent, target, num_steps, dwell_time, span_start, span_stop, values, grid, curr_row,
-                 curr_col, save_dir, comment, meas_type, meas_field, meas_side, meas_rbw, meas, max_fname):
+                 curr_col, save_dir, comment, meas_type, meas_field, meas_side, meas_rbw, meas, max_fname, origin=None,
+                 controller=None, settle=None):
         """
         :param parent: Parent object (i.e. the Frame/GUI calling the thread).
-        :param target: index of the target position (index by the grid).
+        :param target: Index of the target position (index by the grid), or list of indices to re-measure.
         :param num_steps: Number of motor steps per grid step.
         :param dwell_time: Wait time at each scan point before measurements are recorded.
         :param span_start: Lower-limit frequency for FFT (MHz).
@@ -297,10 +589,15 @@ class CorrectionThread(threading.Thread):
         :param meas_side: Side of the phone being scanned.
         :param meas_rbw: Resolution bandwidth for the FFT.
         :param max_fname: Filename corresponding to highest measurement.
+        :param origin: Absolute motor position (in steps) of the first point of the area scan grid. Derived from the
+                       current motor position and (curr_row, curr_col) if not given.
+        :param controller: Port name or USB serial number of the C4 controller (None for the default controller).
+        :param settle: SettleDetector ending the dwell at each point once the reading is stable, None to always wait
+                       dwell_time.
         """
         self.parent = parent
         self.callback = self.parent.update_values
-        self.target = target
+        self.targets = [int(t) for t in np.ravel(target)]
         self.num_steps = num_steps
         self.dwell_time = dwell_time
         self.span_start = span_start
@@ -317,11 +614,14 @@ class CorrectionThread(threading.Thread):
         self.meas_rbw = meas_rbw
         self.meas = meas
         self.max_fname = max_fname
+        self.origin = origin
+        self.controller = controller
+        self.settle = settle
         super(CorrectionThread, self).__init__()
 
     def run(self):
         """
-        Script run on thread start. Corrects a previous value from the general area scan results on a separate thread.
+        Script run on thread start. Corrects previous values from the general area scan results on a separate thread.
 
         :return: Nothing.
         """
@@ -334,71 +634,108 @@ class CorrectionThread(threading.Thread):
 
         # Check ports and instantiate relevant objects (motors, NARDA driver)
         try:
-            m = MotorDriver()
+            m = MotorSession.borrow(self.controller)
         except serial.SerialException:
             print("Error: Connection to C4 controller was not found.")
             self.parent.logger.info("Error: Connection to C4 controller was not found.")
+            wx.CallAfter(self.parent.enablegui)
+            return -1
+        try:
+            narda = NardaNavigator()
+            # Set measurement settings
+            narda.selectTab('mode')
+            narda.selectInputField(self.meas_field)
+            narda.selectTab('span')
+            narda.inputTextEntry('start', str(self.span_start))
+            narda.inputTextEntry('start', str(self.span_start))
+            narda.inputTextEntry('stop', str(self.span_stop))
+            narda.selectRBW(self.meas_rbw)
+            narda.selectTab('data')
+            self.correct(m, narda)
+        except MotorTimeoutError as error:
+            abort_on_timeout(self.parent, self.controller, error)
+            return -1
+        except Exception as error:
+            abort_on_error(self.parent, self.controller, error)
             return -1
-        narda = NardaNavigator()
-        # Set measurement settings
-        narda.selectTab('mode')
-        narda.selectInputField(self.meas_field)
-        narda.selectTab('span')
-        narda.inputTextEntry('start', str(self.span_start))
-        narda.inputTextEntry('start', str(self.span_start))
-        narda.inputTextEntry('stop', str(self.span_stop))
-        narda.selectRBW(self.meas_rbw)
-        narda.selectTab('data')
-
-        # Find the target location
-        target_row, target_col = np.where(self.grid == int(self.target))
-        row_steps = target_row - self.curr_row
-        col_steps = target_col - self.curr_col
-
-        # Move to target location
-        print("R steps: %d   -   C steps %d" % (row_steps, col_steps))
-        self.parent.logger.info("R steps: %d   -   C steps %d" % (row_steps, col_steps))
-        if row_steps > 0:
-            m.forward_motor_two(int(self.num_steps * row_steps))
-        else:
-            m.reverse_motor_two(int(-1 * self.num_steps * row_steps))
-        if col_steps > 0:
-            m.forward_motor_one(int(self.num_steps * col_steps))
-        else:
-            m.reverse_motor_one(int(-1 * self.num_steps * col_steps))
-        self.curr_row = target_row
-        self.curr_col = target_col
-        print(self.values)
-        print("row:", self.curr_row, "col:", self.curr_col)
-        self.parent.logger.info(self.values)
-        self.parent.logger.info("row: %s col: %s" % (self.curr_row, self.curr_col))
-        fname = build_filename(self.meas_type, self.meas_field, self.meas_side, self.target)
-        # Take measurement
-        value = narda.takeMeasurement(self.dwell_time, self.meas, fname, self.save_dir, self.comment)
-        self.values[self.curr_row, self.curr_col] = value
         print(self.values)
         self.parent.logger.info(self.values)
-        # Check if max and take screenshot of plot/UI accordingly
-        if value > self.values.max():
-            print("New max val: %f" % value)
-            self.parent.logger.info("New max val: %f" % value)
-            # Switch to Snipping Tool in front of the NARDA program
-            narda.saveBitmap(fname, self.save_dir)
-            narda.bringToFront()  # Once bitmap is saved, return focus to NARDA
-            os.rename(self.save_dir + '/' + self.max_fname + '.PNG', self.save_dir + '/' + fname + '.PNG')
-        print("Correction of previous value complete.")
-        self.parent.logger.info("Correction of previous value complete.")
+        rename_max_screenshot(self.save_dir, self.max_fname, self.parent.logger)
+        print("Correction of previous values complete.")
+        self.parent.logger.info("Correction of previous values complete.")
         self.callback(self)
         wx.CallAfter(self.parent.run_post_scan)
-        m.destroy()
+
+    def correct(self, m, narda):
+        """
+        Measures the target points again, in the quickest order from the current position.
+
+        :param m: Motor driver object.
+        :param narda: NARDA navigator object.
+        :return: Nothing.
+        """
+        # Find the target locations and visit them in the quickest order from the current position
+        if self.origin is None:
+            self.origin = grid_origin(m, self.num_steps, self.curr_row, self.curr_col)
+        cells = grid_lookup(self.grid)[self.targets]
+        positions = [grid_position(self.origin, self.num_steps, row, col) for row, col in cells]
+        order = plan_path(positions, TravelTimeModel.from_motor(m, 'traverse'), start=m.position)
+        print("Correcting %d point(s): %s" % (len(self.targets), [self.targets[k] for k in order]))
+        self.parent.logger.info("Correcting %d point(s): %s" % (len(self.targets), [self.targets[k] for k in order]))
+
+        # Values of the points being corrected do not count towards the current maximum
+        others = self.values.astype(float)
+        others[cells[:, 0], cells[:, 1]] = np.nan
+        curr_max = np.nanmax(others) if np.any(np.isfinite(others)) else -1
+        journal = correction_journal(self.save_dir, self.grid, self.origin)
+        try:
+            for k in order:
+                row, col = cells[k]
+                m.use_profile('traverse')
+                m.move_to(*positions[k])
+                started = time.time()
+                self.curr_row, self.curr_col = row, col
+                print("position: %d  row: %d col: %d" % (self.targets[k], row, col))
+                self.parent.logger.info("position: %d  row: %d col: %d" % (self.targets[k], row, col))
+                fname = build_filename(self.meas_type, self.meas_field, self.meas_side, self.targets[k])
+                # Take measurement
+                value = narda.takeMeasurement(self.dwell_time, self.meas, fname, self.save_dir, self.comment,
+                                              self.settle)
+                print("Value at (%d, %d): %f (previously %f)" % (row, col, value, self.values[row, col]))
+                self.parent.logger.info("Value at (%d, %d): %f (previously %f)" % (row, col, value,
+                                                                                  self.values[row, col]))
+                self.values[row, col] = value
+                if journal is not None:
+                    journal.record_point(self.targets[k], row, col, positions[k], value, fname, started, time.time(),
+                                         correction=True)
+                # Check if max and take screenshot of plot/UI accordingly
+                if value > curr_max:
+                    print("New max val: %f" % value)
+                    self.parent.logger.info("New max val: %f" % value)
+                    # Switch to Snipping Tool in front of the NARDA program
+                    narda.saveBitmap(fname, self.save_dir)
+                    narda.bringToFront()  # Once bitmap is saved, return focus to NARDA
+                    curr_max = value
+                    self.max_fname = fname
+        except Exception as error:
+            if journal is not None:
+                journal.record_failure(error)
+            raise
+        finally:
+            if journal is not None:
+                journal.close()
 
 
 def run_scan(x_points, y_points, m, narda, num_steps, dwell_time, savedir, comment, meas_type, meas_field, meas_side,
-             meas,start_pos, logger):
+             meas,start_pos, logger, origin=None, mask=None, values=None, max_filename='', stop=None, journal=None,
+             settle=None):
     """
     Performs an area scan according to the specified parameters.
     The scan consists of moving the NS probe to an intended coordinate, taking a measurement, saving the results,
-    and repeating this process until all coordinate points have been measured.
+    and repeating this process until all coordinate points have been measured. The points are visited in the order
+    planned by the path planner (starting with the user defined position), the moves are compiled into a
+    MotionProgram, and the move to the next point is sent as soon as the current measurement has been captured: the
+    measurement file is read and recorded by a worker thread while the probe moves.
 
     :param x_points: Number of x-coordinate points.
     :param y_points: Number of y-coordinate points.
@@ -413,24 +750,67 @@ def run_scan(x_points, y_points, m, narda, num_steps, dwell_time, savedir, comme
     :param meas_side: Side of the phone being scanned.
     :param meas: high_peak or WideBand measurement
     :param start_pos: User defined starting point if not 0.
+    :param origin: Absolute motor position (in steps) of the first grid point. By default, the grid is centered on the
+                   current position of the NS probe.
+    :param mask: Boolean numpy array of the grid points to measure (all points if not given).
+    :param values: Numpy array of the values measured so far, updated in place (e.g. by an earlier pass of an
+                   adaptive scan). A new array is created if not given, with NaN at the points outside of the mask.
+    :param max_filename: Filename of the highest measurement taken so far (with values).
+    :param stop: ScanStopPolicy checked after every measurement, None to measure every point. The points left when
+                 the scan stops are NaN.
+    :param journal: ScanJournal every point measured is recorded in. The points it already holds (interrupted scan)
+                    are restored into the values and not measured again.
+    :param settle: SettleDetector ending the dwell at each point once the reading is stable (dwell_time is then the
+                   longest dwell), None to always wait dwell_time.
     :return: Numpy array of all measurements, Numpy array of the measurement grid, current NS probe's coordinates (rows
-             and columns), and the filename corresponding to the highest measurement point.
+             and columns), the filename corresponding to the highest measurement point, and the absolute motor position
+             (in steps) of the first grid point.
     """
 
-    move_to_pos_one(m, int(num_steps), x_points, y_points)
-
     # Generate a 'traversal grid' with values starting from 1 showing the order of measurement taking
     # x_points ~ row, y_points ~ col
     grid = generate_grid(x_points, y_points)
-    values = np.zeros(grid.shape)  # Placeholder for filling in with measurement values
-
-    # Move to the user defined postion
-    time.sleep(2)
-    if start_pos > 0:
-        # move to user defined position
-        move_to_user_defined(m,int(num_steps), grid, start_pos)
-    else:
+    curr_max = -1  # Current maximum value
+    if values is None:
+        values = np.zeros(grid.shape)  # Placeholder for filling in with measurement values
+        if mask is not None:
+            values[~mask] = np.nan  # Not measured, ignored by the heat map and the maximum search
+    elif not np.isnan(values).all():
+        curr_max = np.nanmax(values)
+    measured = np.zeros(grid.shape, dtype=bool)  # Points measured (including those restored from the journal)
+    if journal is not None and journal.records:
+        # Resumed scan: values and maximum are rebuilt from the journal, only the points missing are measured
+        measured, curr_max, max_filename = journal.restore(values)
+        mask = ~measured if mask is None else mask & ~measured
+        print("Restored %d point(s) from the scan journal (max val: %f)" % (measured.sum(), curr_max))
+        logger.info("Restored %d point(s) from the scan journal (max val: %f)" % (measured.sum(), curr_max))
+    if start_pos <= 0:
         start_pos = 1
+
+    # The grid is centered on the current position of the NS probe. The remaining grid points (from the user defined
+    # position on) are ordered by travel time, starting from the serpentine order of the grid, and the moves to every
+    # point are compiled ahead of time and streamed to the controller during the scan.
+    if origin is None:
+        origin = pos_one_origin(m, num_steps, x_points, y_points)  # Absolute motor position of the first point
+    trajectory = build_trajectory(grid, origin, num_steps, start_pos, TravelTimeModel.from_motor(m, 'settle'),
+                                  m.position, mask)
+    if not len(trajectory) and measured.any():
+        print("Every point was already measured.")
+        logger.info("Every point was already measured.")
+        last = journal.records[-1]
+        return values, grid, last['row'], last['col'], max_filename, origin
+    if not len(trajectory):
+        raise ValueError("No grid point to measure (start position %d, %d point(s) in the mask)"
+                         % (start_pos, grid.size if mask is None else mask.sum()))
+    targets = trajectory[:, 2:4]
+    estimate = estimate_path(targets, dwell_time, start=m.position, setup_time=SETUP_TIME)
+    print(estimate.report())
+    logger.info(estimate.report())
+    # Fast traverse to the starting position, gentle settle profile for the grid steps followed by measurements
+    m.use_profile('traverse')
+    m.move_to(*targets[0])
+    m.use_profile('settle')
+    program = MotionProgram(m, targets)
     time.sleep(2)
     print("Scan path:")
     print(grid)
@@ -440,68 +820,419 @@ def run_scan(x_points, y_points, m, narda, num_steps, dwell_time, savedir, comme
     logger.info("Scan path:\n %s" % grid)
     logger.info("Values:\n %s" % values)
 
-    # Create an accumulator for the fraction of a step lost each time a grid space is moved
-    frac_step = num_steps - int(num_steps)
-    num_steps = int(num_steps)
-    x_error, y_error = 0, 0  # Accumulator for x and y directions
-    curr_row, curr_col = 0, 0  # Current coordinates of the NS testing probe
-    curr_max = -1  # Current maximum value
-    max_filename = ''  # Filename of the maximum measurement point
+    curr_row, curr_col = trajectory[0, :2]  # Current coordinates of the NS testing probe
+    best = {'value': curr_max, 'fname': max_filename}
+    progress = ScanProgress(estimate.point_times)
+    overheads = []  # UI automation time of each point (capture time beyond the dwell), saved for later estimates
+    if stop is not None:
+        stop.start()
+
+    def record(k, fname, image, started):
+        """
+        Reads, records and logs the measurement of the k-th point of the trajectory (run on the worker thread while
+        the probe moves to the next point).
+
+        :return: True if the scan should stop after this point.
+        """
+        row, col = trajectory[k, :2]
+        value = narda.readMeasurement(fname, savedir, meas)
+        values[row, col] = value
+        measured[row, col] = True
+        if journal is not None:
+            journal.record_point(grid[row, col], row, col, targets[k], value, fname, started, time.time())
+        # If new maximum value found, save the image of the NARDA window taken at the point
+        if value > best['value']:
+            print("New max val: %f" % value)
+            logger.info("New max val: %f" % value)
+            image.save(os.path.join(savedir, 'tmp.PNG'))
+            best['value'], best['fname'] = value, fname
+        print("Value at (%d, %d): %f" % (row, col, value))
+        logger.info("Value at (%d, %d): %f" % (row, col, value))
+        print(progress.report(k + 1))
+        logger.info(progress.report(k + 1))
+        return stop is not None and stop.should_stop(values, measured, trajectory[k + 1:, :2])
 
     # General Area Scan
-    for i in range(start_pos, grid.size + 1):
-        # Find the position of the next
-        next_row, next_col = np.where(grid == i)
-        print("position: ", i)
-        logger.info("position: %s" % i)
-        next_row = next_row[0]
-        next_col = next_col[0]
-        if i == start_pos:
-            curr_row, curr_col = next_row, next_col
-        # Move the NS probe to the next position
-        if next_row > curr_row:  # Move downwards
-            y_error += frac_step
-            m.forward_motor_two(num_steps + int(y_error))
-            y_error -= int(y_error)
-            curr_row = next_row
-        elif next_col > curr_col:  # Move rightwards
-            x_error += frac_step
-            m.forward_motor_one(num_steps + int(x_error))  # Adjust distance by error
-            x_error -= int(x_error)  # Subtract integer number of steps that were moved
-            curr_col = next_col
-        elif next_col < curr_col:  # Move leftwards
-            x_error -= frac_step
-            m.reverse_motor_one(num_steps + int(x_error))
-            x_error -= int(x_error)
-            curr_col = next_col
-        # Build the filename for the measurements at this point
-        fname = build_filename(meas_type, meas_field, meas_side, i)
-        # Take the measurement and save relevant files
-        value = narda.takeMeasurement(dwell_time, meas, fname, savedir, comment)
-        values[curr_row, curr_col] = value
-        # If new maximum value found, save take a screenshot of the GUI interface
-        if value > curr_max:
+    # The probe leaves for the next point as soon as the measurement has been captured: reading the measurement file,
+    # the new max screenshot, the journal and the log are handled by a worker thread during the move.
+    worker = ThreadPoolExecutor(max_workers=1)
+    pending = None  # Recording of the previous point
+    try:
+        for k, (curr_row, curr_col) in enumerate(trajectory[:, :2]):
+            i = grid[curr_row, curr_col]  # Point number, used in the output filenames
+            print("position: ", i)
+            logger.info("position: %s" % i)
+            # Wait for the NS probe to reach the next position
+            program.wait_for(k)
+            # The recording of the previous point is checked before the next move is sent: if it failed, its error
+            # ends the scan here, with the probe at rest and the journal holding every point recorded so far
+            if pending is not None and pending.result():
+                # The points left are not measured
+                values[trajectory[k:, 0], trajectory[k:, 1]] = np.nan
+                print("Scan stopped early: %s" % stop.reason)
+                logger.info("Scan stopped early: %s" % stop.reason)
+                pending = None
+                break
+            started = time.time()
+            # Build the filename for the measurements at this point
+            fname = build_filename(meas_type, meas_field, meas_side, i)
+            # Take the measurement and capture the NARDA window while the probe is still at the point
+            narda.captureMeasurement(dwell_time, fname, savedir, comment, settle)
+            overheads.append(time.time() - started - (settle.dwell_times[-1] if settle is not None else dwell_time))
+            image = narda.grabWindow()
+            # Start moving to the next position, the measurement is recorded during the move
+            program.send_upto(k + 1)
+            pending = worker.submit(record, k, fname, image, started)
+        if pending is not None:
+            pending.result()
+    except Exception as error:
+        if not isinstance(error, MotorTimeoutError) and program.sent > program.completed:
+            # Let the move already sent complete, so the tracked motor position matches the probe
+            try:
+                program.wait_for(program.sent - 1)
+            except MotorTimeoutError:
+                pass  # The position is marked as unknown, the error that stopped the scan is raised below
+        raise
+    finally:
+        worker.shutdown(wait=True)  # The recording in progress completes before the journal is closed
+        program.abort()  # Releases the motor lock if the scan stopped with a move outstanding
+    max_filename = best['fname']
+    print("Values:")
+    print(values)
+    logger.info("Values:\n %s" % values)
+    if settle is not None:
+        print(settle.summary())
+        logger.info(settle.summary())
+    # Serial timing since the connection was opened (effective steps/s, command overhead)
+    print(m.trace.report())
+    logger.info(m.trace.report())
+    # Timing of this PC and positioner, used by the estimates of later scans
+    save_calibration(np.median(overheads) if overheads else None, m.trace.summary().get('mean_overhead'))
+    # End of scan - rename screenshot file with the correct name (if a new maximum was found)
+    rename_max_screenshot(savedir, max_filename, logger)
+    return values, grid, curr_row, curr_col, max_filename, origin
+
+
+def run_peak_search(x_points, y_points, m, narda, num_steps, dwell_time, savedir, comment, meas_type, meas_field,
+                    meas_side, meas, logger, max_points=None, tolerance=1e-4, roi=None, settle=None):
+    """
+    Locates the hotspot of the grid with a model-guided search (see SurrogateSearch). Every move is chosen after the
+    previous measurement, so the moves are sent one at a time; the travel times of the candidate points are computed
+    with the motor's settle profile.
+
+    :param x_points: Number of x-coordinate points.
+    :param y_points: Number of y-coordinate points.
+    :param m: Motor driver object.
+    :param narda: NARDA navigator object.
+    :param num_steps: Number of motor steps per grid step.
+    :param dwell_time: Wait time at each scan point before measurements are recorded.
+    :param savedir: Directory for output files (.txt, .png).
+    :param comment: Comment saved in the output file (.txt).
+    :param meas_type: Measurement type (limb or body).
+    :param meas_field: Measurement field (Electric or magnetic (mode A or B)).
+    :param meas_side: Side of the phone being scanned.
+    :param meas: high_peak or WideBand measurement
+    :param logger: Logger of the scan.
+    :param max_points: Largest number of measurements (see SurrogateSearch).
+    :param tolerance: Stopping threshold on the expected improvement, as a fraction of the measured value range.
+    :param roi: Boolean numpy array of the grid points inside the region of interest (all points if not given).
+    :param settle: SettleDetector ending the dwell at each point once the reading is stable, None to always wait
+                   dwell_time.
+    :return: Same as run_scan() (the values of the points not measured are predicted, NaN outside the region of
+             interest), followed by the boolean numpy array of the points actually measured.
+    """
+    grid = generate_grid(x_points, y_points)
+    origin = pos_one_origin(m, num_steps, x_points, y_points)
+    model = TravelTimeModel.from_motor(m, 'settle')
+
+    def travel_time(point, candidates):
+        return model(grid_position(origin, num_steps, *point),
+                     np.column_stack((origin[0] + round_steps(num_steps, candidates[:, 1]),
+                                      origin[1] + round_steps(num_steps, candidates[:, 0]))))
+
+    search = SurrogateSearch(grid.shape, roi, travel_time, dwell_time, max_points=max_points, tolerance=tolerance)
+    best = {'value': -1, 'fname': ''}  # Highest measurement so far and its filename
+
+    def measure(row, col):
+        m.move_to(*grid_position(origin, num_steps, row, col))
+        print("position: ", grid[row, col])
+        logger.info("position: %s" % grid[row, col])
+        fname = build_filename(meas_type, meas_field, meas_side, grid[row, col])
+        value = narda.takeMeasurement(dwell_time, meas, fname, savedir, comment, settle)
+        if value > best['value']:
             print("New max val: %f" % value)
             logger.info("New max val: %f" % value)
-            # Switch to Snipping Tool in front of the NARDA program
             narda.saveBitmap(fname, savedir)
             narda.bringToFront()  # Once bitmap is saved, return focus to NARDA
-            curr_max = value
-            max_filename = fname
-        print("---------")
-        print(values)
-        logger.info("------------------")
-        logger.info(values)
-    print("Renaming tmp.PNG to %s.PNG" % max_filename)
-    logger.info("Renaming tmp.PNG to %s.PNG" % max_filename)
-    # End of scan - rename screenshot file with the correct name
-    try:
-        os.rename(savedir + '/tmp.PNG', savedir + '/' + max_filename + '.PNG')
-    except FileExistsError:
-        print("File " + max_filename + ".PNG already exists. Overwriting file with new image file.")
-        os.remove(savedir + '/' + max_filename + '.PNG')
-        os.rename(savedir + '/tmp.PNG', savedir + '/' + max_filename + '.PNG')
-    return values, grid, curr_row, curr_col, max_filename
+            best['value'], best['fname'] = value, fname
+        print("Value at (%d, %d): %f" % (row, col, value))
+        logger.info("Value at (%d, %d): %f" % (row, col, value))
+        return value
+
+    # Fast traverse to the first point, gentle settle profile for the moves between measurements
+    first = search.initial_design()[0]
+    m.use_profile('traverse')
+    m.move_to(*grid_position(origin, num_steps, *first))
+    m.use_profile('settle')
+    search.run(measure, logger)
+    values = search.estimate()
+    peak_row, peak_col, peak_value = search.peak()
+    print("Peak: %f at Row - %d / Col - %d (%d of %d points measured)" % (peak_value, peak_row, peak_col,
+                                                                         len(search.path), search.mask.sum()))
+    logger.info("Peak: %f at Row - %d / Col - %d (%d of %d points measured)" % (peak_value, peak_row, peak_col,
+                                                                               len(search.path), search.mask.sum()))
+    print("Values:")
+    print(values)
+    logger.info("Values:\n %s" % values)
+    if settle is not None:
+        print(settle.summary())
+        logger.info(settle.summary())
+    print(m.trace.report())
+    logger.info(m.trace.report())
+    rename_max_screenshot(savedir, best['fname'], logger)
+    curr_row, curr_col = search.path[-1]
+    return values, grid, curr_row, curr_col, best['fname'], origin, search.measured
+
+
+def abort_on_timeout(parent, controller, error):
+    """
+    Reports a motor timeout that ended a scan: the connection to the controller is dropped (the motor position is no
+    longer trusted, so the next reset runs a full homing cycle) and the GUI is re-enabled.
+
+    :param parent: Parent object (i.e. the Frame/GUI calling the thread).
+    :param controller: Port name or USB serial number of the C4 controller (None for the default controller).
+    :param error: MotorTimeoutError raised by the motor driver.
+    :return: Nothing.
+    """
+    print("Error: %s. Check the positioner, then reset the motors before scanning again." % error)
+    parent.logger.info("Error: %s. Check the positioner, then reset the motors before scanning again." % error)
+    MotorSession.invalidate(controller)
+    wx.CallAfter(parent.enablegui)
+
+
+def abort_on_error(parent, controller, error):
+    """
+    Reports an unexpected error that ended a scan (e.g. the NARDA measurement file could not be read, or the mouse was
+    moved to a screen corner, which stops pyautogui) and re-enables the GUI. The traceback is written to the log. The
+    connection to the controller is dropped if the error came from the serial port.
+
+    :param parent: Parent object (i.e. the Frame/GUI calling the thread).
+    :param controller: Port name or USB serial number of the C4 controller (None for the default controller).
+    :param error: Exception raised during the scan.
+    :return: Nothing.
+    """
+    print("Error: The scan stopped on %s: %s" % (type(error).__name__, error))
+    parent.logger.info("Error: The scan stopped on %s: %s\n%s" % (type(error).__name__, error, traceback.format_exc()))
+    if isinstance(error, serial.SerialException):
+        MotorSession.invalidate(controller)
+    wx.CallAfter(parent.enablegui)
+
+
+def rename_max_screenshot(savedir, max_filename, logger):
+    """
+    Renames the screenshot of the highest measurement (saved as tmp.PNG) after the measurement, if a new maximum was
+    found during the scan.
+
+    :param savedir: Directory for output files (.txt, .png).
+    :param max_filename: Filename of the highest measurement.
+    :param logger: Logger of the scan.
+    :return: Nothing.
+    """
+    if os.path.exists(savedir + '/tmp.PNG'):
+        print("Renaming tmp.PNG to %s.PNG" % max_filename)
+        logger.info("Renaming tmp.PNG to %s.PNG" % max_filename)
+        try:
+            os.rename(savedir + '/tmp.PNG', savedir + '/' + max_filename + '.PNG')
+        except FileExistsError:
+            print("File " + max_filename + ".PNG already exists. Overwriting file with new image file.")
+            os.remove(savedir + '/' + max_filename + '.PNG')
+            os.rename(savedir + '/tmp.PNG', savedir + '/' + max_filename + '.PNG')
+
+
+def run_adaptive_scan(x_points, y_points, m, narda, num_steps, dwell_time, savedir, comment, meas_type, meas_field,
+                      meas_side, meas, logger, coarse_stride=4, refine_ratio=0.5, roi=None, settle=None):
+    """
+    Performs a coarse-to-fine area scan. The coarse pass measures every coarse_stride-th row and column (and the last
+    ones). The grid is divided into cells with a measured point at each corner; at every level, the cells whose highest
+    corner value is at least refine_ratio times the running maximum are split in half along each axis and the new
+    corners are measured (one run_scan() per level, with a travel-time planned path). Cells that are not refined keep
+    bilinear estimates from their corners. Cells with corners outside the region of interest cannot be interpolated,
+    they are refined down to the grid step wherever they contain points of the region.
+
+    :param x_points: Number of x-coordinate points.
+    :param y_points: Number of y-coordinate points.
+    :param m: Motor driver object.
+    :param narda: NARDA navigator object.
+    :param num_steps: Number of motor steps per grid step.
+    :param dwell_time: Wait time at each scan point before measurements are recorded.
+    :param savedir: Directory for output files (.txt, .png).
+    :param comment: Comment saved in the output file (.txt).
+    :param meas_type: Measurement type (limb or body).
+    :param meas_field: Measurement field (Electric or magnetic (mode A or B)).
+    :param meas_side: Side of the phone being scanned.
+    :param meas: high_peak or WideBand measurement
+    :param logger: Logger of the scan.
+    :param coarse_stride: Number of grid steps between the points of the coarse pass.
+    :param refine_ratio: Fraction of the running maximum above which a cell is refined.
+    :param roi: Boolean numpy array of the grid points inside the region of interest (all points if not given). The
+                values of the points outside of it are NaN.
+    :param settle: SettleDetector ending the dwell at each point once the reading is stable, None to always wait
+                   dwell_time.
+    :return: Same as run_scan(), followed by the boolean numpy array of the points actually measured.
+    """
+    grid = generate_grid(x_points, y_points)
+    origin = pos_one_origin(m, num_steps, x_points, y_points)
+    if roi is None:
+        roi = np.ones(grid.shape, dtype=bool)
+    values = np.where(roi, 0.0, np.nan)
+    measured = np.zeros(grid.shape, dtype=bool)
+    row_cuts, col_cuts = coarse_cuts(x_points, coarse_stride), coarse_cuts(y_points, coarse_stride)
+    cells = [(r0, r1, c0, c1) for r0, r1 in cut_pairs(row_cuts) for c0, c1 in cut_pairs(col_cuts)]
+    mask = np.zeros(grid.shape, dtype=bool)
+    mask[np.ix_(row_cuts, col_cuts)] = True
+    mask &= roi
+    if not mask.any():
+        mask = roi.copy()  # Region of interest narrower than the coarse grid
+    leaves = []  # Cells that are not refined further
+    max_filename = ''
+    level = 0
+    while mask.any():
+        print("Adaptive scan level %d: %d point(s)" % (level, mask.sum()))
+        logger.info("Adaptive scan level %d: %d point(s)" % (level, mask.sum()))
+        values, grid, curr_row, curr_col, max_filename, origin = run_scan(x_points, y_points, m, narda, num_steps,
+                                                                          dwell_time, savedir, comment, meas_type,
+                                                                          meas_field, meas_side, meas, 1, logger,
+                                                                          origin, mask, values, max_filename,
+                                                                          settle=settle)
+        measured |= mask
+        threshold = refine_ratio * values[measured].max()
+        # Rank the cells by their highest corner value, refine those near the running maximum
+        mask = np.zeros(grid.shape, dtype=bool)
+        refined = []
+        for r0, r1, c0, c1 in sorted(cells, key=lambda cell: -corner_max(values, cell)):
+            if np.isnan(values[[r0, r0, r1, r1], [c0, c1, c0, c1]]).any():
+                refine = (roi & ~measured)[r0:r1 + 1, c0:c1 + 1].any()
+            else:
+                refine = corner_max(values, (r0, r1, c0, c1)) >= threshold
+            if not refine or (r1 - r0 <= 1 and c1 - c0 <= 1):
+                leaves.append((r0, r1, c0, c1))
+                continue
+            sub_rows = [r0, (r0 + r1) // 2, r1] if r1 - r0 > 1 else [r0, r1]
+            sub_cols = [c0, (c0 + c1) // 2, c1] if c1 - c0 > 1 else [c0, c1]
+            mask[np.ix_(sub_rows, sub_cols)] = True
+            refined += [(a, b, c, d) for a, b in cut_pairs(sub_rows) for c, d in cut_pairs(sub_cols)]
+        mask &= roi & ~measured
+        cells = refined
+        level += 1
+    fill_unmeasured(values, measured | ~roi, leaves + cells)
+    print("Adaptive scan complete: %d of %d points measured." % (measured.sum(), roi.sum()))
+    logger.info("Adaptive scan complete: %d of %d points measured." % (measured.sum(), roi.sum()))
+    return values, grid, curr_row, curr_col, max_filename, origin, measured
+
+
+def coarse_cuts(points, stride):
+    """
+    Lists the indices of the rows (or columns) measured by the coarse pass of an adaptive scan.
+
+    :param points: Number of rows (or columns).
+    :param stride: Number of grid steps between coarse points.
+    :return: Sorted list of indices, including the last row (or column).
+    """
+    return sorted(set(range(0, points, max(1, stride))) | {points - 1})
+
+
+def cut_pairs(cuts):
+    """
+    Pairs consecutive cut indices into the (start, end) bounds of cells. A single cut gives a degenerate cell.
+
+    :param cuts: Sorted list of indices.
+    :return: List of (start, end) tuples.
+    """
+    return list(zip(cuts[:-1], cuts[1:])) or [(cuts[0], cuts[0])]
+
+
+def corner_max(values, cell):
+    """
+    :param values: Numpy array of values.
+    :param cell: Cell bounds (first row, last row, first col, last col).
+    :return: Highest value at the corners of the cell, ignoring NaN (-inf if every corner is NaN).
+    """
+    r0, r1, c0, c1 = cell
+    corners = values[[r0, r0, r1, r1], [c0, c1, c0, c1]]
+    corners = corners[~np.isnan(corners)]
+    return corners.max() if corners.size else -np.inf
+
+
+def fill_unmeasured(values, measured, cells):
+    """
+    Fills the points that were not measured with bilinear estimates from the corners of their cell.
+
+    :param values: Numpy array of values, updated in place.
+    :param measured: Boolean numpy array of the points measured (or left as they are).
+    :param cells: List of cell bounds (first row, last row, first col, last col) covering the grid.
+    :return: Nothing.
+    """
+    for r0, r1, c0, c1 in cells:
+        rows, cols = np.mgrid[r0:r1 + 1, c0:c1 + 1]
+        fr = (rows - r0) / float(max(r1 - r0, 1))
+        fc = (cols - c0) / float(max(c1 - c0, 1))
+        estimate = (values[r0, c0] * (1 - fr) * (1 - fc) + values[r0, c1] * (1 - fr) * fc +
+                    values[r1, c0] * fr * (1 - fc) + values[r1, c1] * fr * fc)
+        block = values[r0:r1 + 1, c0:c1 + 1]
+        unknown = ~measured[r0:r1 + 1, c0:c1 + 1]
+        block[unknown] = estimate[unknown]
+
+
+def find_peaks(values, num_peaks=1, min_separation=2):
+    """
+    Finds the highest local maxima of the scan values (points at least as high as their 8 neighbours, and higher than
+    one of them). NaN values are ignored, and equal values are ranked in grid order.
+
+    :param values: Numpy array of values.
+    :param num_peaks: Largest number of peaks returned.
+    :param min_separation: Smallest distance between two peaks (in grid steps, along rows or columns). Lower peaks
+                           closer than this to a higher one are skipped (e.g. ties between neighbouring points).
+    :return: List of (row, col) tuples, highest peak first (empty if every value is NaN).
+    """
+    rows, cols = values.shape
+    filled = np.where(np.isnan(values), -np.inf, values)
+    padded = np.pad(filled, 1, mode='constant', constant_values=-np.inf)
+    local = ~np.isnan(values)
+    higher = np.zeros(values.shape, dtype=bool)  # Flat regions are not peaks
+    for dr in (-1, 0, 1):
+        for dc in (-1, 0, 1):
+            if dr or dc:
+                neighbour = padded[1 + dr:1 + dr + rows, 1 + dc:1 + dc + cols]
+                local &= filled >= neighbour
+                higher |= (filled > neighbour) & np.isfinite(neighbour)
+    local &= higher
+    candidates = np.column_stack(np.nonzero(local))
+    peaks = []
+    for row, col in candidates[np.argsort(-filled[local], kind='stable')]:
+        if all(max(abs(row - r), abs(col - c)) >= min_separation for r, c in peaks):
+            peaks.append((int(row), int(col)))
+            if len(peaks) == num_peaks:
+                break
+    if not peaks and not np.isnan(values).all():
+        # Uniform values: the highest value is the only peak
+        peaks.append(tuple(int(i) for i in np.unravel_index(np.nanargmax(values), values.shape)))
+    return peaks
+
+
+def correction_journal(savedir, grid, origin):
+    """
+    Opens the journal of the area scan whose values are being corrected, to record the corrected values.
+
+    :param savedir: Directory for output files (.txt, .png).
+    :param grid: Numpy array of index values (1-index) of the area scan.
+    :param origin: Absolute motor position (in steps) of the first point of the area scan grid.
+    :return: ScanJournal, None if the save directory has no journal of this scan.
+    """
+    journal = ScanJournal.load(os.path.join(savedir, JOURNAL_NAME))
+    if journal is None or list(journal.header.get('origin') or []) != [int(origin[0]), int(origin[1])] or \
+            (journal.header.get('x_points'), journal.header.get('y_points')) != grid.shape:
+        return None
+    return journal
 
 
 def build_filename(meas_type, meas_field, meas_side, number):
@@ -535,6 +1266,116 @@ def build_filename(meas_type, meas_field, meas_side, number):
     return filename
 
 
+def estimate_scan(x_points, y_points, num_steps, dwell_time, start_pos=0, mask=None, center=(0, 0)):
+    """
+    Estimates the duration of an area scan (see run_scan()) without using the positioner: the scan path is planned as
+    the scan would plan it, for a grid centered on the current position of the NS probe.
+
+    :param x_points: Number of x-coordinate points.
+    :param y_points: Number of y-coordinate points.
+    :param num_steps: Number of motor steps per grid step.
+    :param dwell_time: Wait time at each scan point before measurements are recorded.
+    :param start_pos: User defined starting point if not 0.
+    :param mask: Boolean numpy array of the grid points to measure (all points if not given).
+    :param center: Motor position (in steps) the grid is centered on, relative to the current position.
+    :return: ScanEstimate.
+    """
+    grid = generate_grid(x_points, y_points)
+    half_step = exact_steps(num_steps) / 2
+    origin = (center[0] - round_steps(half_step, y_points), center[1] - round_steps(half_step, x_points))
+    trajectory = build_trajectory(grid, origin, num_steps, max(start_pos, 1), calibrated_model('settle'), center,
+                                  mask)
+    return estimate_path(trajectory[:, 2:4], dwell_time, start=center, setup_time=SETUP_TIME)
+
+
+def build_trajectory(grid, origin, num_steps, start_pos, model, start=None, mask=None):
+    """
+    Plans the scan of the grid points numbered start_pos and above: their motor positions are computed at once and
+    ordered by the path planner, starting with the point numbered start_pos. If only some of the points are measured
+    (mask), the path starts with whichever point is quickest to reach from the start position.
+
+    :param grid: Numpy array of point numbers (1-index).
+    :param origin: Absolute motor position (in steps) of the first grid point.
+    :param num_steps: Number of motor steps per grid step.
+    :param start_pos: Number of the first point to scan.
+    :param model: TravelTimeModel of the moves between points.
+    :param start: Motor position before the scan (the first move is relative to it), None for a zero first move.
+    :param mask: Boolean numpy array of the grid points to measure (all points if not given).
+    :return: Integer numpy array with one row per point, in scan order: grid row, grid column, absolute motor 1 and
+             motor 2 positions, and motor 1 and motor 2 steps from the previous point.
+    """
+    selected = grid >= start_pos
+    if mask is not None:
+        selected &= mask
+    rows, cols = np.nonzero(selected)
+    targets = np.column_stack((origin[0] + round_steps(num_steps, cols),
+                               origin[1] + round_steps(num_steps, rows))).astype(int)
+    if mask is None:
+        order = plan_path(targets, model, order=np.argsort(grid[rows, cols]), fixed_first=True)
+    else:
+        order = plan_path(targets, model, start=start, order=np.argsort(grid[rows, cols]))
+    targets = targets[order]
+    previous = targets[:1] if start is None else np.reshape(start, (1, 2))
+    deltas = np.diff(np.vstack((previous, targets)), axis=0)
+    return np.column_stack((rows[order], cols[order], targets, deltas))
+
+
+def grid_lookup(grid):
+    """
+    Builds a lookup table from point numbers to grid coordinates, replacing a search of the grid for every point.
+
+    :param grid: Numpy array of point numbers (1-index).
+    :return: Integer numpy array whose row n is the (row, col) of point n.
+    """
+    lookup = np.zeros((grid.max() + 1, 2), dtype=int)
+    lookup[grid.ravel()] = np.column_stack(np.unravel_index(np.arange(grid.size), grid.shape))
+    return lookup
+
+
+def grid_position(origin, num_steps, row, col):
+    """
+    Computes the absolute motor position of a grid point (within half a step of its exact position). Columns are
+    traversed by motor 1, rows by motor 2.
+
+    :param origin: Absolute motor position (in steps) of the first grid point.
+    :param num_steps: Number of motor steps per grid step.
+    :param row: Row of the grid point.
+    :param col: Column of the grid point.
+    :return: Tuple of the motor 1 and motor 2 positions (in steps).
+    """
+    return origin[0] + round_steps(num_steps, col), origin[1] + round_steps(num_steps, row)
+
+
+def grid_origin(moto, num_steps, row, col):
+    """
+    Computes the absolute motor position of the first grid point from the motor's current position, given the grid
+    point the NS probe is currently at.
+
+    :param moto: MotorDriver to control motion.
+    :param num_steps: Number of motor steps per grid step.
+    :param row: Current row of the NS probe.
+    :param col: Current column of the NS probe.
+    :return: Tuple of the motor 1 and motor 2 positions (in steps).
+    """
+    row, col = int(np.ravel(row)[0]), int(np.ravel(col)[0])
+    return moto.position[0] - round_steps(num_steps, col), moto.position[1] - round_steps(num_steps, row)
+
+
+def pos_one_origin(moto, num_steps, rows, cols):
+    """
+    Computes the absolute motor position of the first grid point of a grid centered on the current position (i.e. the
+    position move_to_pos_one() moves to).
+
+    :param moto: MotorDriver to control motion.
+    :param num_steps: Number of motor steps between grid points.
+    :param rows: Number of grid rows.
+    :param cols: Number of grid cols.
+    :return: Tuple of the motor 1 and motor 2 positions (in steps).
+    """
+    half_step = exact_steps(num_steps) / 2
+    return moto.position[0] - round_steps(half_step, cols), moto.position[1] - round_steps(half_step, rows)
+
+
 def move_to_pos_one(moto, num_steps, rows, cols):
     """Move motor to first position in grid.
 
@@ -544,8 +1385,8 @@ def move_to_pos_one(moto, num_steps, rows, cols):
     :param cols: Number of grid cols.
     :return: None
     """
-    moto.reverse_motor_two(int(num_steps * rows / 2.0))
-    moto.reverse_motor_one(int(num_steps * cols / 2.0))
+    half_step = exact_steps(num_steps) / 2
+    moto.move(-round_steps(half_step, cols), -round_steps(half_step, rows))
 
 
 def move_to_user_defined(moto, num_steps, grid, start_pos):
@@ -558,9 +1399,8 @@ def move_to_user_defined(moto, num_steps, grid, start_pos):
         :return: None
     """
     # move to user defined position
-    row, col = np.where(grid == start_pos)
-    moto.forward_motor_two(int(num_steps * row))
-    moto.forward_motor_one(int(num_steps * col))
+    row, col = grid_lookup(grid)[start_pos]
+    moto.move(round_steps(num_steps, col), round_steps(num_steps, row))
     print("start position: (", row, ", ", col, ")")
 
 
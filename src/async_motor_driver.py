@@ -0,0 +1,330 @@
+"""
+Asynchronous Motor Driver
+
+This module contains an asyncio counterpart of the MotorDriver. Moves, homing cycles and position queries are
+coroutines, so a scan coroutine can overlap motion with other work (parsing output files, encoding screenshots,
+reporting progress) on a single event loop instead of running one OS thread per job.
+
+The serial port is opened in non-blocking mode. On POSIX systems the event loop is notified when the port becomes
+readable; elsewhere the port is polled at a short interval. Commands are built with the formatting functions of
+'motor_driver.py', so both drivers always send the same commands.
+
+The module contains a single class:
+    - AsyncMotorDriver(): asyncio driver for the C4 controller.
+
+Example:
+    motor = await AsyncMotorDriver.open()
+    if not motor.position_known:
+        await motor.home_motors()
+    await motor.use_profile('traverse')
+    await motor.move_to(1000, 500)
+    print(await motor.get_position())
+    motor.close()
+"""
+
+import asyncio
+import serial
+from src.positioning import round_steps, step_ratio
+from src.motor_driver import COMPLETION_TOKEN, HOME_COMMAND, PROFILES, STEP_UNIT, MotionProfile, MotorTimeoutError, \
+    find_c4_port, format_home_offset, format_move, format_setting, load_controller_state, move_timeout, probe_port, \
+    profiles_enabled, save_controller_state
+
+
+class AsyncMotorDriver:
+    """
+    Asyncio driver for the C4 controller. Mirrors the MotorDriver interface with awaitable methods.
+
+        Attributes:
+            port: Non-blocking serial port through which motors are controlled
+            step_unit: Size of individual motor step in cm (consult manual)
+            position: Absolute position of motor 1 (X) and motor 2 (Y), in steps from the home position.
+            position_known: False if the position cannot be trusted (no saved position, unclean shutdown, lost
+                            acknowledgment), absolute moves are refused until the motors are homed.
+            velocity: Velocity configured on each motor (steps per second), None until set.
+            acceleration: Acceleration configured on each motor (steps per second squared), None until set.
+            profiles: Named MotionProfiles selectable with use_profile().
+            use_profiles: False if use_profile() leaves the controller's settings unchanged (see PROFILES_ENV).
+    """
+    def __init__(self, port, step_unit_=STEP_UNIT, home=(3788, 4300), step_rate=250.0, timeout_margin=5.0,
+                 home_timeout=180.0, profiles=None, poll_interval=0.01, port_name=None, use_profiles=None):
+        """
+        Use AsyncMotorDriver.open() to find the controller and open the port.
+
+        :param port: Serial port opened with timeout=0 (non-blocking reads).
+        :param step_unit_: Size of individual motor step (consult C4 controller manual for more details).
+        :param home: Home/Reset coordinates for the motors. NS probe returns to these coordinates.
+        :param step_rate: Slowest expected motor speed (in steps per second), used for move deadlines until the
+                          velocities have been set.
+        :param timeout_margin: Fixed allowance added to every move deadline (in seconds).
+        :param home_timeout: Deadline for a full homing cycle of both motors (in seconds).
+        :param profiles: Dictionary of named MotionProfiles (defaults to PROFILES).
+        :param poll_interval: Polling interval of the port where readiness notifications are unavailable (in seconds).
+        :param port_name: Port name of the controller, used to load and save its position like the MotorDriver. The
+                          position is unknown until the first homing cycle if not given.
+        :param use_profiles: Send the settings of the motion profiles in use_profile(), None to follow the C4_PROFILES
+                             environment variable.
+        """
+        self.port = port
+        self.port_name = port_name
+        self.step_unit = step_unit_
+        self.home = home
+        self.step_rate = step_rate
+        self.timeout_margin = timeout_margin
+        self.home_timeout = home_timeout
+        self.profiles = dict(PROFILES if profiles is None else profiles)
+        self.use_profiles = profiles_enabled() if use_profiles is None else use_profiles
+        self.poll_interval = poll_interval
+        # Position saved at the last clean shutdown, it is marked invalid on disk until this connection is closed
+        state = load_controller_state(port_name) if port_name is not None else {}
+        self.position_known = bool(state.get('position_valid')) and state.get('home') == list(home)
+        self.position = list(state['position']) if self.position_known else [0, 0]
+        if port_name is not None:
+            save_controller_state(port_name, position_valid=False)
+        self.velocity = [None, None]
+        self.acceleration = [None, None]
+        self.lock = asyncio.Lock()  # Serializes commands from concurrent coroutines
+        self._rx_buffer = b''
+
+    @classmethod
+    async def open(cls, port_name=None, **kwargs):
+        """
+        Finds the C4 controller (see find_c4_port()) and opens a non-blocking connection to it. The port discovery
+        runs in the default executor so the event loop is not blocked.
+
+        :param port_name: Serial port of the C4 controller. Found automatically if not given.
+        :param kwargs: Keyword arguments passed to the constructor.
+        :return: Connected AsyncMotorDriver.
+        :raises serial.SerialException: If no C4 controller was found.
+        """
+        loop = asyncio.get_event_loop()
+        if port_name is None:
+            port_name = await loop.run_in_executor(None, find_c4_port)
+        elif not await loop.run_in_executor(None, probe_port, port_name):
+            raise serial.SerialException("No C4 controller answering on port %s" % port_name)
+        port = serial.Serial(port_name, timeout=0)
+        port.flushInput()
+        print("Established connection with motor controller (PORT %s)" % port_name)
+        return cls(port, port_name=port_name, **kwargs)
+
+    async def move(self, x_steps, y_steps):
+        """
+        Moves both motors simultaneously (motor 1 along X, motor 2 along Y) and waits for every motor to complete.
+
+        :param x_steps: Number of steps to move motor 1 by (negative to move backward).
+        :param y_steps: Number of steps to move motor 2 by (negative to move backward).
+        :return: Nothing.
+        :raises MotorTimeoutError: If a completion was not received before the deadline.
+        """
+        async with self.lock:
+            await self._move(x_steps, y_steps)
+
+    async def move_to(self, x_steps, y_steps):
+        """
+        Moves both motors to an absolute position. The relative move is computed from the tracked position under the
+        lock, so concurrent absolute moves each end at their own target.
+
+        :param x_steps: Target position of motor 1 (in steps from the home position).
+        :param y_steps: Target position of motor 2 (in steps from the home position).
+        :return: Nothing.
+        :raises RuntimeError: If the position is unknown (the motors must be homed first).
+        """
+        async with self.lock:
+            if not self.position_known:
+                raise RuntimeError("Motor position unknown, home the motors before moving to an absolute position")
+            await self._move(int(x_steps) - self.position[0], int(y_steps) - self.position[1])
+
+    async def move_to_mm(self, x, y):
+        """
+        Moves both motors to an absolute position given in millimeters, rounded to the nearest step.
+
+        :param x: Target X coordinate (in mm from the home position).
+        :param y: Target Y coordinate (in mm from the home position).
+        :return: Nothing.
+        """
+        await self.move_to(round_steps(step_ratio(x, self.step_unit) / 10, 1),
+                           round_steps(step_ratio(y, self.step_unit) / 10, 1))
+
+    async def get_position(self):
+        """
+        Returns the absolute position once the commands already issued have completed.
+
+        :return: Tuple of the motor 1 and motor 2 positions (in steps from the home position).
+        """
+        async with self.lock:
+            return tuple(self.position)
+
+    async def home_motors(self):
+        """
+        Resets the NS probe position to its home coordinates.
+
+        :return: Nothing.
+        """
+        await self._home(self.home)
+        print("Motors reset successfully.")
+
+    async def set_start_point(self, offset=(3788, 4300)):
+        """
+        Set the NS probe position to a starting point.
+
+        :param offset: number of steps from the home coordinates.
+        :return: Nothing.
+        """
+        await self._home(offset)
+        print("Motors set to the start point successfully.")
+
+    async def use_profile(self, profile):
+        """
+        Applies a motion profile to both motors, sending only the settings that differ from the current ones. Nothing
+        is sent unless the profiles are enabled (see PROFILES_ENV).
+
+        :param profile: Name of a profile in self.profiles (e.g. 'traverse' or 'settle'), or a MotionProfile.
+        :return: Nothing.
+        """
+        if not self.use_profiles:
+            return
+        if not isinstance(profile, MotionProfile):
+            profile = self.profiles[profile]
+        async with self.lock:
+            for motor in (1, 2):
+                if self.velocity[motor - 1] != profile.velocity:
+                    await self._write_setting(format_setting('v', motor, profile.velocity))
+                    self.velocity[motor - 1] = profile.velocity
+                if self.acceleration[motor - 1] != profile.acceleration:
+                    await self._write_setting(format_setting('a', motor, profile.acceleration))
+                    self.acceleration[motor - 1] = profile.acceleration
+
+    def move_timeout(self, steps):
+        """
+        Computes the deadline for the completion of a move (see motor_driver.move_timeout()).
+
+        :param steps: Number of steps of the move.
+        :return: Maximum time to wait for the completion acknowledgment (in seconds).
+        """
+        return move_timeout(steps, self.velocity, self.acceleration, self.step_rate, self.timeout_margin)
+
+    def close(self):
+        """
+        Closes the port. The position is saved so the next session can skip the homing cycle.
+
+        :return: Nothing.
+        """
+        if self.port_name is not None:
+            save_controller_state(self.port_name, position=self.position, position_valid=self.position_known,
+                                  home=list(self.home))
+        self.port.close()
+
+    async def _move(self, x_steps, y_steps):
+        """
+        Sends a relative move and waits for every motor to complete. The lock must be held by the caller.
+
+        :param x_steps: Number of steps to move motor 1 by (negative to move backward).
+        :param y_steps: Number of steps to move motor 2 by (negative to move backward).
+        :return: Nothing.
+        :raises MotorTimeoutError: If a completion was not received before the deadline.
+        """
+        command, num_motors = format_move(x_steps, y_steps)
+        if not num_motors:
+            return
+        self._send(command)
+        try:
+            await self._expect(COMPLETION_TOKEN, num_motors, command, self.move_timeout(max(abs(x_steps),
+                                                                                            abs(y_steps))))
+        except MotorTimeoutError:
+            self.position_known = False  # The motors may have stopped anywhere
+            raise
+        self.position[0] += int(x_steps)
+        self.position[1] += int(y_steps)
+
+    async def _home(self, offset):
+        """
+        Writes the home offsets of both motors and runs a homing cycle.
+
+        :param offset: Number of steps between the home switches and the home position of each motor.
+        :return: Nothing.
+        :raises MotorTimeoutError: If the homing cycle did not complete before the deadline.
+        """
+        async with self.lock:
+            for motor in (1, 2):
+                await self._write_setting(format_home_offset(motor, offset[motor - 1]))
+            self._send(HOME_COMMAND)
+            await self._expect(COMPLETION_TOKEN, 2, HOME_COMMAND, self.home_timeout)
+            self.position = [offset[0] - self.home[0], offset[1] - self.home[1]]
+            self.position_known = True
+
+    async def _write_setting(self, command):
+        """
+        Sends a setting command and waits for its acknowledgment line. Like the synchronous driver, a missing
+        acknowledgment is not treated as an error.
+
+        :param command: Command string without the terminating carriage return.
+        :return: Nothing.
+        """
+        self._send(command)
+        try:
+            await self._expect(b'\n', 1, command, 1.5)
+        except MotorTimeoutError:
+            pass
+
+    def _send(self, command):
+        """
+        Discards any stale input and sends a command to the controller.
+
+        :param command: Command string without the terminating carriage return.
+        :return: Nothing.
+        """
+        self.port.flushInput()
+        self._rx_buffer = b''
+        self.port.write((command + '\r').encode())
+
+    async def _expect(self, token, count, command, timeout):
+        """
+        Reads the controller's replies until the token has been received 'count' times, without blocking the event
+        loop. Bytes received after the last expected token are kept for the next read.
+
+        :param token: Byte string to wait for (e.g. COMPLETION_TOKEN).
+        :param count: Number of tokens to wait for.
+        :param command: Command being waited on (used in the error message).
+        :param timeout: Maximum time to wait (in seconds).
+        :return: Nothing.
+        :raises MotorTimeoutError: If fewer than 'count' tokens were received before the deadline.
+        """
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        received = 0
+        while True:
+            while received < count and token in self._rx_buffer:
+                self._rx_buffer = self._rx_buffer.split(token, 1)[1]
+                received += 1
+            if received == count:
+                return
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise MotorTimeoutError(command, count - received, timeout)
+            data = self.port.read(self.port.in_waiting)
+            if data:
+                self._rx_buffer += data
+            else:
+                await self._wait_readable(remaining)
+
+    async def _wait_readable(self, timeout):
+        """
+        Waits until the port has data to read or the timeout has elapsed.
+
+        :param timeout: Maximum time to wait (in seconds).
+        :return: Nothing.
+        """
+        loop = asyncio.get_event_loop()
+        try:
+            fd = self.port.fileno()
+            readable = loop.create_future()
+            loop.add_reader(fd, lambda: readable.done() or readable.set_result(None))
+        except (AttributeError, NotImplementedError, OSError, ValueError):
+            # No file descriptor (Windows) or no reader support in this event loop: poll instead
+            await asyncio.sleep(min(self.poll_interval, timeout))
+            return
+        try:
+            await asyncio.wait_for(readable, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            loop.remove_reader(fd)
@@ -0,0 +1,227 @@
+"""
+C4 Controller Emulator
+
+This module contains a software emulator of the Arrick Robotics C4 motor controller. The emulator serves the C4
+command set used by the MotorDriver over a Linux pseudo-terminal (pty), so the motor driver and the scan threads can
+be run (and timed) without the XY positioner bench.
+
+The emulator answers the following commands:
+    - '!1fp': identification, answered with 'C4'.
+    - '!1m<motor><dir><steps>[,<motor><dir><steps>]n': relative move of motor 1 and/or 2 ('r' forward, 'f' reverse).
+      Both motors move simultaneously and an 'o' is sent for each motor once its move has completed.
+    - '!1wh<motor>,r,<steps>': writes the home offset of a motor, answered with 'A'.
+    - '!1wv<motor>,<steps/s>' and '!1wa<motor>,<steps/s^2>': write the velocity and acceleration of a motor, answered
+      with 'A'. Moves follow a trapezoidal velocity profile once an acceleration has been set.
+    - '!1h12': homes both motors, an 'o' is sent for each motor once it has reached its home offset.
+
+Move and homing times are computed from the motor velocities (the step rate until a velocity is written), so scan
+throughput measured against the emulator scales with the number of motor steps like it does on the real controller.
+
+The module contains a single class:
+    - C4Emulator(threading.Thread): emulated C4 controller served on a pty.
+
+To run a scan against the emulator, start it and point the MotorDriver to the pty through the C4_PORT environment
+variable:
+    python -m src.c4_emulator --step-rate 1000
+"""
+
+import argparse
+import os
+import random
+import re
+import select
+import threading
+import time
+import tty
+
+
+class C4Emulator(threading.Thread):
+    """
+    Emulated C4 motor controller. Commands are read from the master side of a pty, the slave side (port_name) is
+    opened by the MotorDriver like a regular serial port.
+
+        Attributes:
+            port_name: Path of the pty device to connect to (e.g. '/dev/pts/3').
+            position: Current position of each motor (in steps from the home switch).
+            step_rate: Default speed of the motors during moves (in steps per second).
+            velocity: Velocity of each motor (in steps per second).
+            acceleration: Acceleration of each motor (in steps per second squared), None for instantaneous starts.
+            log: List of (timestamp, command) tuples of every command received.
+    """
+    def __init__(self, step_rate=1000.0, home_rate=None, baudrate=9600, command_latency=0.002,
+                 position=(0, 0), drop_completions=0.0, verbose=False):
+        """
+        :param step_rate: Default speed of the motors during moves (in steps per second).
+        :param home_rate: Speed of the motors during homing cycles (defaults to the step rate).
+        :param baudrate: Emulated baud rate of the serial link, used to delay commands and replies by their
+                         transmission time. Set to 0 to disable.
+        :param command_latency: Time taken by the controller to parse a command (in seconds).
+        :param position: Starting position of the motors (in steps from the home switch).
+        :param drop_completions: Probability of a completion acknowledgment ('o') being lost, to test how the driver
+                                 handles a lost acknowledgment.
+        :param verbose: Print every command received.
+        """
+        super(C4Emulator, self).__init__()
+        self.daemon = True
+        self.step_rate = float(step_rate)
+        self.home_rate = float(home_rate) if home_rate else self.step_rate
+        self.baudrate = baudrate
+        self.command_latency = command_latency
+        self.position = list(position)
+        self.home = [0, 0]
+        self.velocity = [self.step_rate, self.step_rate]
+        self.acceleration = [None, None]
+        self.drop_completions = drop_completions
+        self.verbose = verbose
+        self.log = []
+
+        self.master_fd, self.slave_fd = os.openpty()
+        tty.setraw(self.master_fd)
+        tty.setraw(self.slave_fd)
+        self.port_name = os.ttyname(self.slave_fd)
+        self._stop_event = threading.Event()
+        self._buffer = b''
+
+    def run(self):
+        """
+        Serves commands until stop() is called. Commands are executed one at a time, in the order they are received.
+
+        :return: Nothing.
+        """
+        while not self._stop_event.is_set():
+            readable, _, _ = select.select([self.master_fd], [], [], 0.1)
+            if not readable:
+                continue
+            try:
+                self._buffer += os.read(self.master_fd, 1024)
+            except OSError:
+                continue
+            while b'\r' in self._buffer:
+                command, self._buffer = self._buffer.split(b'\r', 1)
+                self.handle_command(command.decode(errors='replace').strip())
+
+    def stop(self):
+        """
+        Stops serving commands and closes the pty.
+
+        :return: Nothing.
+        """
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        os.close(self.master_fd)
+        os.close(self.slave_fd)
+
+    def handle_command(self, command):
+        """
+        Executes a single command and sends its reply. Blocks for as long as the controller would be busy.
+
+        :param command: Command string without the terminating carriage return (e.g. '!1m1r100n').
+        :return: Nothing.
+        """
+        self.log.append((time.time(), command))
+        if self.verbose:
+            print("C4 emulator received: %s" % command)
+        self._transmission_delay(len(command) + 1)
+        time.sleep(self.command_latency)
+
+        if command == '!1fp':
+            self.reply('C4\r\n')
+            return
+        move = re.match(r'^!1m([12][rf]\d+(?:,[12][rf]\d+)?)(n?)$', command)
+        if move:
+            axes = [re.match(r'([12])([rf])(\d+)', axis).groups() for axis in move.group(1).split(',')]
+            durations = [(int(motor) - 1, self.move_duration(int(motor) - 1, int(steps)),
+                          int(steps) if direction == 'r' else -int(steps)) for motor, direction, steps in axes]
+            start = time.time()
+            for motor, duration, steps in sorted(durations, key=lambda axis: axis[1]):
+                time.sleep(max(0.0, start + duration - time.time()))
+                self.position[motor] += steps
+                if move.group(2):
+                    self.complete()
+            return
+        home_offset = re.match(r'^!1wh([12]),r,(\d+)$', command)
+        if home_offset:
+            self.home[int(home_offset.group(1)) - 1] = int(home_offset.group(2))
+            self.reply('A\r\n')
+            return
+        setting = re.match(r'^!1w([va])([12]),(\d+)$', command)
+        if setting:
+            values = self.velocity if setting.group(1) == 'v' else self.acceleration
+            values[int(setting.group(2)) - 1] = float(setting.group(3))
+            self.reply('A\r\n')
+            return
+        if command == '!1h12':
+            # Both motors travel back to their home switch, then out to their home offset
+            durations = [(abs(self.position[i]) + self.home[i]) / self.home_rate for i in range(2)]
+            start = time.time()
+            for motor in sorted(range(2), key=lambda i: durations[i]):
+                time.sleep(max(0.0, start + durations[motor] - time.time()))
+                self.position[motor] = self.home[motor]
+                self.complete()
+            return
+        self.reply('E\r\n')
+
+    def move_duration(self, motor, steps):
+        """
+        Computes the duration of a move from the motor's velocity and acceleration (trapezoidal velocity profile).
+
+        :param motor: Motor index (0 or 1).
+        :param steps: Number of steps of the move.
+        :return: Duration of the move (in seconds).
+        """
+        velocity, acceleration = self.velocity[motor], self.acceleration[motor]
+        if not acceleration:
+            return steps / velocity
+        if steps >= velocity ** 2 / acceleration:
+            return steps / velocity + velocity / acceleration
+        return 2 * (steps / acceleration) ** 0.5
+
+    def reply(self, text):
+        """
+        Sends a reply to the connected driver.
+
+        :param text: Reply string.
+        :return: Nothing.
+        """
+        self._transmission_delay(len(text))
+        os.write(self.master_fd, text.encode())
+
+    def complete(self):
+        """
+        Sends a completion acknowledgment, unless it is dropped to emulate a lost acknowledgment.
+
+        :return: Nothing.
+        """
+        if random.random() >= self.drop_completions:
+            self.reply('o')
+
+    def _transmission_delay(self, num_bytes):
+        """
+        Sleeps for the time needed to transfer the given number of bytes at the emulated baud rate (10 bits per byte).
+
+        :param num_bytes: Number of bytes transferred.
+        :return: Nothing.
+        """
+        if self.baudrate:
+            time.sleep(num_bytes * 10.0 / self.baudrate)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Emulated C4 motor controller served on a pty.")
+    parser.add_argument('--step-rate', type=float, default=1000.0, help="Motor speed (steps per second).")
+    parser.add_argument('--home-rate', type=float, default=None, help="Motor speed while homing (steps per second).")
+    parser.add_argument('--baudrate', type=int, default=9600, help="Emulated baud rate (0 to disable).")
+    parser.add_argument('--verbose', action='store_true', help="Print every command received.")
+    args = parser.parse_args()
+
+    emulator = C4Emulator(step_rate=args.step_rate, home_rate=args.home_rate, baudrate=args.baudrate,
+                          verbose=args.verbose)
+    emulator.start()
+    print("C4 emulator listening on %s" % emulator.port_name)
+    print("Run the NS testing program with: export C4_PORT=%s" % emulator.port_name)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        emulator.stop()
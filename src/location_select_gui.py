@@ -1,12 +1,13 @@
 """
 Location Selection GUI
 
-This is the GUI module for selecting a coordinate post area scan for correcting a previous measurement.
+This is the GUI module for selecting coordinates post area scan for correcting previous measurements. Several
+coordinates can be selected, they are all re-measured in one pass.
 This GUI is intended to be run in conjunction with the 'xy_positioner_gui.py' only. The GUI is currently only used
 for the post-scan function 'Correct Previous Value'.
 
 This module contains a single class:
-    - LocationSelectionGUI(wx.Dialog): provides a grid of buttons to allow user to select area scan coordinate.
+    - LocationSelectionGUI(wx.Dialog): provides a grid of buttons to allow user to select area scan coordinates.
 
 Authors:
 Chang Hwan 'Oliver' Choi, Biomedical/Software Engineering Intern (Aug. 2018) - changhwan.choi@pctest.com
@@ -18,7 +19,7 @@ import wx
 
 class LocationSelectGUI(wx.Dialog):
     """
-    Location Selection GUI. Allows the user to select a position in the area scan grid for the 'Correct Previous
+    Location Selection GUI. Allows the user to select positions in the area scan grid for the 'Correct Previous
     Value' function.
     """
     def __init__(self, parent, title, grid):
@@ -30,6 +31,7 @@ class LocationSelectGUI(wx.Dialog):
         wx.Dialog.__init__(self, parent, title=title)
         self.parent = parent
         self.grid = grid
+        self.selection = []  # Point numbers selected, in click order
 
         numrows = self.grid.shape[0]
         numcols = self.grid.shape[1]
@@ -40,25 +42,45 @@ class LocationSelectGUI(wx.Dialog):
         # Sizers
         self.coord_sizer = wx.GridSizer(rows=numrows, cols=numcols, hgap=0, vgap=0)
         for val in np.nditer(self.grid):
-            btn = wx.Button(self, val, str(val), size=(50, 50))
-            self.Bind(wx.EVT_BUTTON, lambda e, x=btn.Id: self.selected(x), btn)
+            btn = wx.ToggleButton(self, val, str(val), size=(50, 50))
+            self.Bind(wx.EVT_TOGGLEBUTTON, lambda e, x=btn.Id: self.selected(x, e.IsChecked()), btn)
             self.coord_sizer.Add(btn, proportion=1)
             self.coord_sizer.Layout()
-
-        self.SetSizer(self.coord_sizer)
+        self.correct_btn = wx.Button(self, wx.ID_ANY, "Correct Selected")
+        self.correct_btn.Disable()  # Enabled once a position is selected
+        self.Bind(wx.EVT_BUTTON, self.correct, self.correct_btn)
+
+        self.main_sizer = wx.BoxSizer(wx.VERTICAL)
+        self.main_sizer.Add(self.coord_sizer, proportion=1)
+        self.main_sizer.Add(self.correct_btn, proportion=0, flag=wx.ALL | wx.EXPAND, border=5)
+        self.SetSizer(self.main_sizer)
         self.SetAutoLayout(True)
-        self.coord_sizer.Fit(self)
+        self.main_sizer.Fit(self)
         self.Show(True)
 
-    def selected(self, value):
+    def selected(self, value, checked):
         """
-        Runs the parent Frame's 'run_currection()' function using the clicked button's number as the argument.
-        Destroys the GUI on button click.
+        Adds the clicked button's number to the selection, or removes it when the button is clicked again.
 
         :param value: Button value/position selected on the grid.
+        :param checked: True if the button was selected, False if it was deselected.
+        :return: Nothing.
+        """
+        if checked and value not in self.selection:
+            self.selection.append(value)
+        elif not checked and value in self.selection:
+            self.selection.remove(value)
+        self.correct_btn.Enable(bool(self.selection))
+
+    def correct(self, e):
+        """
+        Runs the parent Frame's 'run_correction()' function with the selected positions as the argument.
+        Destroys the GUI on button click.
+
+        :param e: Event handler.
         :return: Nothing.
         """
-        self.parent.run_correction(value)
+        self.parent.run_correction(list(self.selection))
         self.Destroy()
 
     def OnQuit(self, e):
@@ -8,11 +8,17 @@ The GUI handles motor movements and step distance settings.
 This module contains a single class:
     - ManualMoveGUI(wx.Frame): GUI interfaced with the MotorDriver class, provides manual control for users.
 
+And the following functions:
+    - move_probe(): moves the NS probe to an absolute position, run on the controller's motion queue.
+    - report_move(): reports a manual move that failed.
+
 Authors:
 Chang Hwan 'Oliver' Choi, Biomedical/Software Engineering Intern (Aug. 2018) - changhwan.choi@pctest.com
 """
 
-from src.motor_driver import MotorDriver
+from fractions import Fraction
+from src.motor_driver import MotorSession
+from src.positioning import distance_to_steps
 import serial
 import wx
 
@@ -21,33 +27,31 @@ class ManualMoveGUI(wx.Frame):
     """
     GUI interfaced with the MotorDriver class that allows manual control over the motors.
     """
-    def __init__(self, parent, title, grid_step):
+    def __init__(self, parent, title, grid_step, controller=None):
         """
         :param parent: Parent frame invoking the LocationSelectGUI.
         :param title: Title for the GUI window.
         :param grid_step: The grid step size.
+        :param controller: Port name or USB serial number of the C4 controller (None for the default controller).
         """
         wx.Frame.__init__(self, parent, title=title, size=(400, 400))
 
         # Variables
+        self.controller = controller
         try:
-            self.motor = MotorDriver()
+            self.motor = MotorSession.borrow(controller)
         except serial.SerialException:
             print("Error: Connection to C4 controller was not found")
             self.Close()
             return
 
         # self.narda = NardaNavigator()
-        self.currx = 0.0
-        self.curry = 0.0
+        self.currx = Fraction(0)  # Exact coordinates (in cm), so repeated moves do not accumulate rounding errors
+        self.curry = Fraction(0)
         self.distx = grid_step
         self.disty = grid_step
-        self.errx = 0.0
-        self.erry = 0.0
-        self.stepx = int(self.distx / self.motor.step_unit)
-        self.stepy = int(self.disty / self.motor.step_unit)
-        self.fracx = self.distx / self.motor.step_unit - self.stepx
-        self.fracy = self.disty / self.motor.step_unit - self.stepy
+        # Coordinates are relative to the position of the probe when the GUI was opened
+        self.originx, self.originy = self.motor.position
 
         # UI Elements
         up_id = 301
@@ -116,10 +120,10 @@ class ManualMoveGUI(wx.Frame):
         :param e: Event handler.
         :return: Nothing.
         """
-        self.curry -= self.disty
-        self.erry -= self.fracy
-        self.motor.reverse_motor_two(self.stepy + int(self.erry))
-        self.erry -= int(self.erry)
+        if not self.can_move():
+            return
+        self.curry -= Fraction(str(self.disty))
+        self.move_to_curr()
         self.coord_box.SetLabel("Coordinates:\n[%.3f, %.3f]" % (self.currx, self.curry))
 
     def move_down(self, e):
@@ -129,10 +133,10 @@ class ManualMoveGUI(wx.Frame):
         :param e: Event handler.
         :return: Nothing.
         """
-        self.curry += self.disty
-        self.erry += self.fracy
-        self.motor.forward_motor_two(self.stepy + int(self.erry))
-        self.erry -= int(self.erry)
+        if not self.can_move():
+            return
+        self.curry += Fraction(str(self.disty))
+        self.move_to_curr()
         self.coord_box.SetLabel("Coordinates:\n[%.3f, %.3f]" % (self.currx, self.curry))
 
     def move_left(self, e):
@@ -142,10 +146,10 @@ class ManualMoveGUI(wx.Frame):
         :param e: Event handler.
         :return: Nothing.
         """
-        self.currx -= self.distx
-        self.errx -= self.fracx
-        self.motor.reverse_motor_one(self.stepx + int(self.errx))
-        self.errx -= int(self.errx)
+        if not self.can_move():
+            return
+        self.currx -= Fraction(str(self.distx))
+        self.move_to_curr()
         self.coord_box.SetLabel("Coordinates:\n[%.3f, %.3f]" % (self.currx, self.curry))
 
     def move_right(self, e):
@@ -155,12 +159,40 @@ class ManualMoveGUI(wx.Frame):
         :param e: Event handler.
         :return: Nothing.
         """
-        self.currx += self.distx
-        self.errx += self.fracx
-        self.motor.forward_motor_one(self.stepx + int(self.errx))
-        self.errx -= int(self.errx)
+        if not self.can_move():
+            return
+        self.currx += Fraction(str(self.distx))
+        self.move_to_curr()
         self.coord_box.SetLabel("Coordinates:\n[%.3f, %.3f]" % (self.currx, self.curry))
 
+    def can_move(self):
+        """
+        Checks that no scan or reset is running on the controller, since manual moves would be interleaved with its
+        moves.
+
+        :return: True if the probe can be moved.
+        """
+        parent = self.GetParent()
+        if parent is not None and parent.job_running(self.controller):
+            print("A job is running on this controller, wait for it to finish before moving the probe.")
+            return False
+        return True
+
+    def move_to_curr(self):
+        """
+        Moves the NS probe to the current coordinates, rounded to the nearest motor step. Positions are absolute, so
+        rounding to whole motor steps does not accumulate over repeated moves. The move is queued on the controller's
+        motion queue (see MotorSession.submit()), so the GUI does not wait for it.
+
+        :return: Nothing.
+        """
+        x_steps = self.originx + distance_to_steps(self.currx, self.motor.step_unit)
+        y_steps = self.originy + distance_to_steps(self.curry, self.motor.step_unit)
+        try:
+            MotorSession.submit(self.controller, move_probe, x_steps, y_steps).add_done_callback(report_move)
+        except serial.SerialException:
+            print("Error: Connection to C4 controller was not found")
+
     def OnKey(self, e):
         """
         Handles wx.EVT_KEY_UP events (releasing a pressed key) to allow keyboard controlled movement.
@@ -200,26 +232,44 @@ class ManualMoveGUI(wx.Frame):
             self.x_tctrl = float(self.distx)
             self.y_tctrl = float(self.disty)
             return
-        self.stepx = int(self.distx / self.motor.step_unit)
-        self.stepy = int(self.disty / self.motor.step_unit)
-        self.fracx = self.distx / self.motor.step_unit - self.stepx
-        self.fracy = self.disty / self.motor.step_unit - self.stepy
-
         print("New step distances: X =", self.distx, "Y =", self.disty)
 
     def OnClose(self, e):
         """
         Exit script for the GUI, called when the window is closed. Notifies the user about exiting the manual movement
-        module, destorys the motor object, and destroys the GUI object.
+        module and destroys the GUI object. The motor connection stays open for the other modules (see MotorSession).
 
         :param e: Event handler.
         :return: Nothing.
         """
         print("Exiting Manual Movement module.")
-        self.motor.destroy()
         self.Destroy()
 
 
+def move_probe(motor, x_steps, y_steps):
+    """
+    Moves the NS probe to an absolute position with the settle profile (run on the controller's motion queue).
+
+    :param motor: Motor driver object.
+    :param x_steps: Target position of motor 1 (in steps from the home position).
+    :param y_steps: Target position of motor 2 (in steps from the home position).
+    :return: Nothing.
+    """
+    motor.use_profile('settle')
+    motor.move_to(x_steps, y_steps)
+
+
+def report_move(future):
+    """
+    Reports a manual move that failed (called once the queued move is done).
+
+    :param future: concurrent.futures.Future of the move.
+    :return: Nothing.
+    """
+    if not future.cancelled() and future.exception() is not None:
+        print("Error: Manual move failed (%s)" % future.exception())
+
+
 if __name__ == "__main__":
     manual_move_gui = wx.App()
     fr = ManualMoveGUI(None, title="Manual Movement GUI")
@@ -5,8 +5,28 @@ This module contains scripts for initializing, communicating with, and controlli
 Arrick Robotics.
 
 The module contains the following classes:
+    - MotorTimeoutError(serial.SerialException): raised when a move or homing completion is not received in time.
+    - TraceRecord(): timing of a single command exchanged with the C4 controller.
+    - SerialTrace(): records the timing of every command, as histograms in memory and optionally as a CSV trace file.
     - ResetThread(threading.Thread): performs motor resets.
     - MotorDriver(): establishes connection with the C4 controller and contains all motor movement functions.
+    - MotionProgram(): sequence of moves compiled into C4 commands and streamed to the controller.
+    - MotorSession(): process-wide registry of the MotorDriver connections (one per C4 controller), shared by all
+                      threads and GUIs.
+
+The C4 controller is found by find_c4_port(): the port that answered last time (saved in 'motor_state.txt') is tried
+first, and all other serial ports reported by the OS are probed concurrently only if it does not answer.
+
+Several controllers (one per positioner bench) can be driven from one process: each is addressed by its port name or
+the serial number of its USB adapter, see MotorSession.
+
+The absolute position of each controller's motors is also saved to 'motor_state.txt' when its connection is closed
+cleanly. It is marked invalid while the connection is open, so a crash, a lost acknowledgment or a communication error
+forces the next reset to run a full homing cycle; otherwise resets are a direct move to the home position.
+
+The named motion profiles (see PROFILES and MotorDriver.use_profile()) write the velocity and acceleration of the
+motors with the '!1wv' and '!1wa' commands, which have only been tested against the emulator. They are off unless the
+C4_PROFILES environment variable is set to 1; the motors then keep the controller's own settings.
 
 Authors:
 Ganesh Arvapalli, Software Engineering Intern (Jan. 2018) - ganesh.arvapalli@pctest.com
@@ -14,20 +34,289 @@ Chang Hwan 'Oliver' Choi, Biomedical/Software Engineering Intern (Aug. 2018) - c
 
 """
 
+import atexit
+import bisect
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import json
+import math
+import os
 import serial
+import serial.tools.list_ports
+from src.positioning import round_steps, step_ratio
 import threading
-import wx
+import time
+
+COMPLETION_TOKEN = b'o'  # Sent by the C4 controller when a move (or a motor's homing) has completed
+IDENTIFY_COMMAND = '!1fp'  # Answered with 'C4' by the controller
+HOME_COMMAND = '!1h12'  # Homes both motors, one completion token is sent per motor
+STEP_UNIT = 0.00508  # Size of a motor step (in cm)
+PROFILES_ENV = 'C4_PROFILES'  # Environment variable enabling the motion profiles (set to 1)
+STATE_FILE = 'motor_state.txt'  # Persisted motor controller state (last port that answered, etc.)
+_state_lock = threading.RLock()  # Serializes updates of the state file from several controllers
+# Upper bounds (in seconds) of the latency histogram bins, the last bin collects everything above. An extra first bin
+# collects negative values (moves faster than expected, i.e. the motor settings are not what the driver assumes).
+LATENCY_BINS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+
+# Motor speed settings: velocity in steps per second, acceleration in steps per second squared
+MotionProfile = namedtuple('MotionProfile', ['velocity', 'acceleration'])
+PROFILES = {
+    'traverse': MotionProfile(velocity=2000, acceleration=4000),  # Long repositioning moves (no measurement follows)
+    'settle': MotionProfile(velocity=800, acceleration=1500),  # Grid steps, gentle ramps right before a measurement
+}
+
+
+class MotorTimeoutError(serial.SerialException):
+    """
+    Raised when the C4 controller does not acknowledge the completion of a command before its deadline (e.g. lost
+    acknowledgment, disconnected cable or stalled motor). The command can be retried once the cause has been checked.
+
+        Attributes:
+            command: Command that timed out.
+            missing: Number of completion acknowledgments that were not received.
+            timeout: Time waited (in seconds).
+    """
+    def __init__(self, command, missing, timeout):
+        """
+        :param command: Command that timed out.
+        :param missing: Number of completion acknowledgments that were not received.
+        :param timeout: Time waited (in seconds).
+        """
+        super(MotorTimeoutError, self).__init__("No completion received for command '%s' after %.1f s "
+                                                "(%d acknowledgment(s) missing)" % (command, timeout, missing))
+        self.command = command
+        self.missing = missing
+        self.timeout = timeout
+
+
+class TraceRecord:
+    """
+    Timing of a single command exchanged with the C4 controller. Times are taken with time.time().
+
+        Attributes:
+            command: Command string sent (without the terminating carriage return).
+            num_bytes: Number of bytes sent.
+            steps: Number of steps of the longest axis (0 for commands that do not move the motors).
+            expected: Expected duration of the move computed from the motor settings (in seconds, 0 if not a move, None
+                      if the motor velocities are unknown).
+            sent: Time the command was written to the port.
+            first_byte: Time the first byte of the reply was received (None until received).
+            completed: Time the reply (or last completion acknowledgment) was received (None until received).
+            timed_out: True if the command did not complete before its deadline.
+    """
+    def __init__(self, command, steps=0, expected=0.0):
+        """
+        :param command: Command string sent (without the terminating carriage return).
+        :param steps: Number of steps of the longest axis.
+        :param expected: Expected duration of the move (in seconds, None if unknown).
+        """
+        self.command = command
+        self.num_bytes = len(command) + 1
+        self.steps = steps
+        self.expected = expected
+        self.sent = time.time()
+        self.first_byte = None
+        self.completed = None
+        self.timed_out = False
+
+    def first_byte_latency(self):
+        """
+        :return: Time between sending the command and receiving the first reply byte (in seconds, None if no reply).
+        """
+        return None if self.first_byte is None else self.first_byte - self.sent
+
+    def duration(self):
+        """
+        :return: Time between sending the command and its completion (in seconds, None if not completed).
+        """
+        return None if self.completed is None else self.completed - self.sent
+
+    def overhead(self):
+        """
+        :return: Part of the command's duration not spent moving the motors (in seconds, None if not completed or if the
+                 expected duration is unknown).
+        """
+        if self.completed is None or self.expected is None:
+            return None
+        return self.duration() - self.expected
+
+
+class SerialTrace:
+    """
+    Records the timing of every command exchanged with the C4 controller. The latencies are accumulated in histograms
+    (see LATENCY_BINS) and the last records are kept in memory; every record can also be appended to a CSV trace
+    file, so the effective steps per second and the command overhead can be compared between runs, controllers and
+    cables.
+
+        Attributes:
+            filename: CSV trace file (None if the trace is only kept in memory).
+            records: Most recent TraceRecords.
+            histograms: Counts per bin (negative values, then LATENCY_BINS) of the first byte latency ('first_byte'),
+                        the completion time ('completion') and the overhead of the moves with a known expected duration
+                        ('overhead').
+            commands: Number of commands completed or timed out.
+            timeouts: Number of commands that timed out.
+            bytes_sent: Number of bytes sent.
+            steps: Number of steps moved (longest axis of each move).
+            move_time: Time spent waiting for the completion of moves (in seconds).
+            expected_time: Expected duration of the moves with a known expected duration (in seconds).
+            timed_move_time: Time spent waiting for the completion of the moves with a known expected duration (in
+                             seconds).
+    """
+    HEADER = 'sent,command,bytes,steps,expected_s,first_byte_s,completion_s,timed_out\n'
+
+    def __init__(self, filename=None, history=1000):
+        """
+        :param filename: CSV file to append every record to (None to keep the trace in memory only).
+        :param history: Number of records kept in memory.
+        """
+        self.filename = filename
+        self.records = deque(maxlen=history)
+        self.histograms = {name: [0] * (len(LATENCY_BINS) + 2) for name in ('first_byte', 'completion', 'overhead')}
+        self.commands = 0
+        self.timeouts = 0
+        self.bytes_sent = 0
+        self.steps = 0
+        self.move_time = 0.0
+        self.expected_time = 0.0
+        self.timed_move_time = 0.0
+        self._lock = threading.Lock()
+        self._file = None
+        if filename:
+            directory = os.path.dirname(filename)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            new_file = not os.path.exists(filename)
+            self._file = open(filename, 'a')
+            if new_file:
+                self._file.write(self.HEADER)
+
+    def start(self, command, steps=0, expected=0.0):
+        """
+        Creates the record of a command about to be sent.
+
+        :param command: Command string (without the terminating carriage return).
+        :param steps: Number of steps of the longest axis (0 if the command does not move the motors).
+        :param expected: Expected duration of the move (in seconds, None if unknown).
+        :return: TraceRecord of the command.
+        """
+        return TraceRecord(command, steps, expected)
+
+    def finish(self, record, timed_out=False):
+        """
+        Completes a record and adds it to the histograms and the trace file.
+
+        :param record: TraceRecord returned by start().
+        :param timed_out: True if the command did not complete before its deadline.
+        :return: Nothing.
+        """
+        if timed_out:
+            record.timed_out = True
+        else:
+            record.completed = time.time()
+        with self._lock:
+            self.records.append(record)
+            self.commands += 1
+            self.bytes_sent += record.num_bytes
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self._count('completion', record.duration())
+                if record.steps:
+                    self.steps += record.steps
+                    self.move_time += record.duration()
+                if record.steps and record.expected is not None:
+                    # Moves made before the velocities are set have no reliable expectation, they are left out
+                    self.timed_move_time += record.duration()
+                    self.expected_time += record.expected
+                    self._count('overhead', record.overhead())
+            if record.first_byte is not None:
+                self._count('first_byte', record.first_byte_latency())
+            if self._file is not None:
+                self._file.write('%.6f,"%s",%d,%d,%s,%s,%s,%d\n' % (
+                    record.sent, record.command, record.num_bytes, record.steps,
+                    '' if record.expected is None else '%.6f' % record.expected,
+                    '' if record.first_byte is None else '%.6f' % record.first_byte_latency(),
+                    '' if record.completed is None else '%.6f' % record.duration(), record.timed_out))
+                self._file.flush()
+
+    def summary(self):
+        """
+        Summarizes the trace.
+
+        :return: Dictionary with the number of commands, timeouts, bytes sent and steps moved, the effective steps per
+                 second of the moves and the mean overhead per move (in seconds, over the moves with a known expected
+                 duration).
+        """
+        with self._lock:
+            moves = sum(self.histograms['overhead'])
+            return {
+                'commands': self.commands,
+                'timeouts': self.timeouts,
+                'bytes_sent': self.bytes_sent,
+                'steps': self.steps,
+                'steps_per_second': self.steps / self.move_time if self.move_time else None,
+                'mean_overhead': (self.timed_move_time - self.expected_time) / moves if moves else None,
+            }
+
+    def report(self):
+        """
+        Formats the summary and the histograms for printing or logging.
+
+        :return: Multi-line string.
+        """
+        summary = self.summary()
+        lines = ["Serial trace: %d command(s), %d timeout(s), %d byte(s) sent, %d step(s) moved" %
+                 (summary['commands'], summary['timeouts'], summary['bytes_sent'], summary['steps'])]
+        if summary['steps_per_second'] is not None:
+            lines.append("Effective speed: %.1f steps/s" % summary['steps_per_second'])
+        if summary['mean_overhead'] is not None:
+            lines.append("Mean overhead per move: %.1f ms" % (1000 * summary['mean_overhead']))
+        labels = ['< 0 s'] + ['<= %g s' % bound for bound in LATENCY_BINS] + ['> %g s' % LATENCY_BINS[-1]]
+        with self._lock:
+            histograms = {name: list(counts) for name, counts in self.histograms.items()}
+        lines.append('%10s %10s %10s %10s' % ('latency', 'first byte', 'completion', 'overhead'))
+        for i, label in enumerate(labels):
+            if histograms['first_byte'][i] or histograms['completion'][i] or histograms['overhead'][i]:
+                lines.append('%10s %10d %10d %10d' % (label, histograms['first_byte'][i],
+                                                      histograms['completion'][i], histograms['overhead'][i]))
+        return '\n'.join(lines)
+
+    def close(self):
+        """
+        Closes the trace file.
+
+        :return: Nothing.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _count(self, name, latency):
+        """
+        Adds a latency to a histogram.
+
+        :param name: Histogram name ('first_byte', 'completion' or 'overhead').
+        :param latency: Latency (in seconds, counted in the underflow bin if negative).
+        :return: Nothing.
+        """
+        self.histograms[name][0 if latency < 0 else bisect.bisect_left(LATENCY_BINS, latency) + 1] += 1
 
 
 class ResetThread(threading.Thread):
     """
     Thread for handling resetting the motors. NS probe is moved back to its 'home' position.
     """
-    def __init__(self, parent):
+    def __init__(self, parent, full=False, controller=None):
         """
         :param parent: Parent frame invoking the LocationSelectGUI.
+        :param full: Run a full homing cycle even if the motor position is known.
+        :param controller: Port name or USB serial number of the C4 controller (None for the default controller).
         """
         self.parent = parent
+        self.full = full
+        self.controller = controller
         self.motor = None  # Placeholder variable for the motor
         super(ResetThread, self).__init__()
 
@@ -37,13 +326,14 @@ class ResetThread(threading.Thread):
 
         :return: Nothing.
         """
+        import wx  # Only needed here, so the rest of the module (and the emulator tests) run without the GUI
         # Variables
         try:
-            self.motor = MotorDriver()
-            self.motor.home_motors()
-            self.motor.destroy()
+            self.motor = MotorSession.borrow(self.controller)
+            MotorSession.submit(self.controller, MotorDriver.home_motors, full=self.full).result()
         except serial.SerialException:
             print("Error: Connection to C4 controller was not found")
+            MotorSession.invalidate(self.controller)
             return
         with wx.MessageDialog(self.parent, "Motor resetting completed.",
                               style=wx.OK | wx.ICON_INFORMATION | wx.CENTER) as dlg:
@@ -58,34 +348,63 @@ class MotorDriver:
 
         Attributes:
             port: Serial port through which motors are controlled
-            step_unit: Size of individual motor step (consult manual)
+            port_name: Name of the serial port (e.g. 'COM3').
+            step_unit: Size of individual motor step in cm (consult manual)
+            step_rate: Slowest expected motor speed (in steps per second), used to bound the wait for move completions
+            position: Absolute position of motor 1 (X) and motor 2 (Y), in steps from the home position. Updated by
+                      every move and homing cycle.
+            position_known: False if the position cannot be trusted (no saved position, unclean shutdown, lost
+                            acknowledgment), in which case the next reset runs a full homing cycle.
+            velocity: Velocity configured on each motor (steps per second), None until set.
+            acceleration: Acceleration configured on each motor (steps per second squared), None until set.
+            profiles: Named MotionProfiles selectable with use_profile().
+            use_profiles: False if use_profile() leaves the controller's settings unchanged (see PROFILES_ENV).
+            trace: SerialTrace recording the timing of every command sent.
     """
 
-    def __init__(self, step_unit_=0.00508, home=(3788, 4300)):
+    def __init__(self, step_unit_=STEP_UNIT, home=(3788, 4300), port_name=None, step_rate=250.0, timeout_margin=5.0,
+                 home_timeout=180.0, profiles=None, trace=None, use_profiles=None):
         """
         :param step_unit_: Size of individual motor step (consult C4 controller manual for more details).
         :param home: Home/Reset coordinates for the motors. NS probe returns to these coordinates.
+        :param port_name: Serial port of the C4 controller. Found automatically (see find_c4_port()) if not given.
+        :param step_rate: Slowest expected motor speed (in steps per second). A move times out if its completion has
+                          not been received within twice its expected duration plus timeout_margin.
+        :param timeout_margin: Fixed allowance added to every move deadline (in seconds).
+        :param home_timeout: Deadline for a full homing cycle of both motors (in seconds).
+        :param profiles: Dictionary of named MotionProfiles (defaults to PROFILES).
+        :param trace: SerialTrace recording the command timings (defaults to an in-memory trace, or a trace file if the
+                      C4_TRACE environment variable is set).
+        :param use_profiles: Send the settings of the motion profiles in use_profile(), None to follow the C4_PROFILES
+                             environment variable.
         """
         self.home = home
-        entered = False
-        for i in range(256):
-            try:
-                self.port = serial.Serial('COM'+str(i), timeout=1.5)
-                self.port.write('!1fp\r'.encode())  # Check if we have connected to the right COM Port/machine
-                received_str = self.port.read(2)
-                if received_str.decode() == "C4":
-                    print("Established connection with motor controller (PORT %d)" % i)
-                    self.port.flushOutput()
-                    self.port.flushInput()
-                    self.port.flush()
-                    self.step_unit = step_unit_
-                    entered = True
-                    break
-            except serial.SerialException as e:
-                pass
-                # print e.message
-        if not entered:
-            raise serial.SerialException
+        if port_name is None:
+            port_name = find_c4_port()
+        elif not probe_port(port_name):
+            raise serial.SerialException("No C4 controller answering on port %s" % port_name)
+        self.port = serial.Serial(port_name, timeout=1.5)
+        self.port_name = port_name
+        print("Established connection with motor controller (PORT %s)" % port_name)
+        self.port.flushOutput()
+        self.port.flushInput()
+        self.port.flush()
+        self.step_unit = step_unit_
+        self.step_rate = step_rate
+        self.timeout_margin = timeout_margin
+        self.home_timeout = home_timeout
+        # Position saved at the last clean shutdown, it is marked invalid on disk until this connection is closed
+        state = load_controller_state(port_name)
+        self.position_known = bool(state.get('position_valid')) and state.get('home') == list(home)
+        self.position = list(state['position']) if self.position_known else [0, 0]
+        save_controller_state(port_name, position_valid=False)
+        self.velocity = [None, None]  # Controller defaults until set
+        self.acceleration = [None, None]
+        self.profiles = dict(PROFILES if profiles is None else profiles)
+        self.use_profiles = profiles_enabled() if use_profiles is None else use_profiles
+        self.trace = trace if trace is not None else SerialTrace(os.environ.get('C4_TRACE'))
+        self.lock = threading.RLock()  # Serializes commands from threads sharing the connection (see MotorSession)
+        self._rx_buffer = b''  # Received bytes not yet matched to a reply
 
     def forward_motor_one(self, steps):
         """
@@ -95,13 +414,7 @@ class MotorDriver:
         :param steps: Number of steps to move the stepper motor by.
         :return: Nothing.
         """
-        self.port.flushInput()
-        self.port.flushOutput()
-        self.port.flush()
-        self.port.write(('!1m1r' + str(steps) + 'n\r').encode())
-        while self.port.read().decode() != 'o':
-            pass
-        self.port.flush()
+        self.move(steps, 0)
 
     def reverse_motor_one(self, steps):
         """
@@ -111,13 +424,7 @@ class MotorDriver:
         :param steps: Number of steps to move the stepper motor by.
         :return: Nothing.
         """
-        self.port.flushInput()
-        self.port.flushOutput()
-        self.port.flush()
-        self.port.write(('!1m1f' + str(steps) + 'n\r').encode())
-        while self.port.read().decode() != 'o':
-            pass
-        self.port.flush()
+        self.move(-steps, 0)
 
     def forward_motor_two(self, steps):
         """
@@ -127,13 +434,7 @@ class MotorDriver:
         :param steps: Number of steps to move the stepper motor by.
         :return: Nothing.
         """
-        self.port.flushInput()
-        self.port.flushOutput()
-        self.port.flush()
-        self.port.write(('!1m2r' + str(steps) + 'n\r').encode())
-        while self.port.read().decode() != 'o':
-            pass
-        self.port.flush()
+        self.move(0, steps)
 
     def reverse_motor_two(self, steps):
         """
@@ -143,73 +444,738 @@ class MotorDriver:
         :param steps: Number of steps to move the stepper motor by.
         :return: Nothing.
         """
-        self.port.flushInput()
-        self.port.flushOutput()
-        self.port.flush()
-        self.port.write(('!1m2f' + str(steps) + 'n\r').encode())
-        while self.port.read().decode() != 'o':
-            pass
-        self.port.flush()
+        self.move(0, -steps)
+
+    def move(self, x_steps, y_steps):
+        """
+        Moves both motors simultaneously with a single command (motor 1 along X, motor 2 along Y). Blocks thread until
+        the controller acknowledges the completion of every motor that moved.
+
+        :param x_steps: Number of steps to move motor 1 by (negative to move backward).
+        :param y_steps: Number of steps to move motor 2 by (negative to move backward).
+        :return: Nothing.
+        :raises MotorTimeoutError: If a completion was not received before the deadline.
+        """
+        command, num_motors = format_move(x_steps, y_steps)
+        if not num_motors:
+            return
+        steps = max(abs(int(x_steps)), abs(int(y_steps)))
+        with self.lock:
+            record = self._send(command, steps, self.expected_duration(steps))
+            self._wait_for_completion(command, num_motors, self.move_timeout(steps), record)
+            self.trace.finish(record)
+            self.position[0] += int(x_steps)
+            self.position[1] += int(y_steps)
+
+    def move_to(self, x_steps, y_steps):
+        """
+        Moves both motors to an absolute position. The relative move is computed from the tracked position, so
+        returning to a previously visited position is always a single move without accumulated rounding errors.
+
+        :param x_steps: Target position of motor 1 (in steps from the home position).
+        :param y_steps: Target position of motor 2 (in steps from the home position).
+        :return: Nothing.
+        """
+        with self.lock:
+            self.move(int(x_steps) - self.position[0], int(y_steps) - self.position[1])
+
+    def move_to_mm(self, x, y):
+        """
+        Moves both motors to an absolute position given in millimeters, rounded to the nearest step.
+
+        :param x: Target X coordinate (in mm from the home position).
+        :param y: Target Y coordinate (in mm from the home position).
+        :return: Nothing.
+        """
+        self.move_to(round_steps(step_ratio(x, self.step_unit) / 10, 1),
+                     round_steps(step_ratio(y, self.step_unit) / 10, 1))
+
+    def position_mm(self):
+        """
+        Returns the current absolute position in millimeters.
+
+        :return: Tuple of the X and Y coordinates (in mm from the home position).
+        """
+        return self.position[0] * 10.0 * self.step_unit, self.position[1] * 10.0 * self.step_unit
 
     # Home both motors to preset positions
-    def home_motors(self):
+    def home_motors(self, full=False):
         """
         Resets the NS probe position to its home coordinates. Blocks thread until the motors have fully reset.
+        If the position is known, the probe is moved there directly instead of running a homing cycle.
+
+        :param full: Run a full homing cycle even if the position is known.
         :return: Nothing.
         """
         # Set home of motor 1 to be 6000 steps away, home of motor 2 to be 13000 steps away
-        self.port.write(str.encode('!1wh1,r,'+str(self.home[0])+'\r'))
-        self.port.readline()
-        self.port.write(str.encode('!1wh2,r,'+str(self.home[1])+'\r'))
-        self.port.readline()
-        # print 'Home settings written (a if yes), ', port.readline()
-        self.port.flush()
-
-        # Home both motors
-        motor_home = str.encode('!1h12\r')
-        self.port.write(motor_home)
-        while self.port.read().decode() != 'o':
-            pass
-        print("Motor 1 reset.")
-        while self.port.read().decode() != 'o':
-            pass
-        print("Motor 2 reset.")
-        self.port.flush()
+        self._reset(self.home, full)
         print("Motors reset successfully.")
 
-    def set_start_point(self, offset=(3788, 4300)):
+    def set_start_point(self, offset=(3788, 4300), full=False):
         """
-        Set the NS probe position to a starting point.
+        Set the NS probe position to a starting point. If the position is known, the probe is moved there directly
+        instead of running a homing cycle.
 
         :param offset: number of steps from the home coordinates.
+        :param full: Run a full homing cycle even if the position is known.
         :return: Nothing
         """
-        self.port.write(str.encode('!1wh1,r,' + str(offset[0]) + '\r'))
-        self.port.readline()
-        self.port.write(str.encode('!1wh2,r,' + str(offset[1]) + '\r'))
-        self.port.readline()
-        # print 'Home settings written (a if yes), ', port.readline()
-        self.port.flush()
-
-        # Home both motors
-        motor_start = str.encode('!1h12\r')
-        self.port.write(motor_start)
-        while self.port.read().decode() != 'o':
-            pass
-        print("Motor 1 reset.")
-        while self.port.read().decode() != 'o':
-            pass
-        print("Motor 2 reset.")
-        self.port.flush()
+        self._reset(offset, full)
         print("Motors set to the start point successfully.")
 
-    def destroy(self):
+    def expected_duration(self, steps):
         """
-        Flush remaining data and close port.
+        Computes the expected duration of a move from the current motor settings, for the trace. Until the velocities
+        have been set, the controller's speed is unknown (step_rate is only a lower bound for the deadlines), so no
+        duration is expected.
 
+        :param steps: Number of steps of the move.
+        :return: Expected duration (in seconds), None if the velocities have not been set.
+        """
+        if not all(self.velocity):
+            return None
+        return expected_move_duration(steps, self.velocity, self.acceleration, self.step_rate)
+
+    def move_timeout(self, steps):
+        """
+        Computes the deadline for the completion of a move.
+
+        :param steps: Number of steps of the move.
+        :return: Maximum time to wait for the completion acknowledgment (in seconds).
+        """
+        return move_timeout(steps, self.velocity, self.acceleration, self.step_rate, self.timeout_margin)
+
+    def set_velocity(self, motor, velocity):
+        """
+        Sets the velocity of a motor. Nothing is sent if the motor is already set to this velocity.
+
+        :param motor: Motor number (1 or 2).
+        :param velocity: Velocity (in steps per second).
         :return: Nothing.
         """
-        self.port.flush()
+        if self.velocity[motor - 1] != velocity:
+            self._write_setting(format_setting('v', motor, velocity))
+            self.velocity[motor - 1] = velocity
+
+    def set_acceleration(self, motor, acceleration):
+        """
+        Sets the acceleration (ramp) of a motor. Nothing is sent if the motor is already set to this acceleration.
+
+        :param motor: Motor number (1 or 2).
+        :param acceleration: Acceleration (in steps per second squared).
+        :return: Nothing.
+        """
+        if self.acceleration[motor - 1] != acceleration:
+            self._write_setting(format_setting('a', motor, acceleration))
+            self.acceleration[motor - 1] = acceleration
+
+    def use_profile(self, profile):
+        """
+        Applies a motion profile to both motors. Only the settings that differ from the current ones are sent, so
+        switching between profiles before every move is cheap. Nothing is sent unless the profiles are enabled (see
+        PROFILES_ENV).
+
+        :param profile: Name of a profile in self.profiles (e.g. 'traverse' or 'settle'), or a MotionProfile.
+        :return: Nothing.
+        """
+        if not self.use_profiles:
+            return
+        if not isinstance(profile, MotionProfile):
+            profile = self.profiles[profile]
+        with self.lock:
+            for motor in (1, 2):
+                self.set_velocity(motor, profile.velocity)
+                self.set_acceleration(motor, profile.acceleration)
+
+    def _write_setting(self, command):
+        """
+        Sends a setting command and reads its acknowledgment line.
+
+        :param command: Command string without the terminating carriage return (e.g. '!1wv1,2000').
+        :return: Nothing.
+        """
+        with self.lock:
+            self._read_reply(self._send(command))
+
+    def _reset(self, offset, full):
+        """
+        Moves the motors to the given offset from their home switches, with a homing cycle only if the position is
+        unknown or a full homing is requested.
+
+        :param offset: Number of steps between the home switches and the target position of each motor.
+        :param full: Run a full homing cycle even if the position is known.
+        :return: Nothing.
+        """
+        with self.lock:
+            if full or not self.position_known:
+                self._home(offset)
+            else:
+                self.move_to(offset[0] - self.home[0], offset[1] - self.home[1])
+
+    def _home(self, offset):
+        """
+        Writes the home offsets of both motors and runs a homing cycle. Blocks until both motors are homed.
+
+        :param offset: Number of steps between the home switches and the home position of each motor.
+        :return: Nothing.
+        :raises MotorTimeoutError: If the homing cycle did not complete before the deadline.
+        """
+        with self.lock:
+            self._read_reply(self._send(format_home_offset(1, offset[0])))
+            self._read_reply(self._send(format_home_offset(2, offset[1])))
+            # print 'Home settings written (a if yes), ', port.readline()
+
+            # Home both motors
+            command = HOME_COMMAND
+            record = self._send(command)
+            deadline = time.time() + self.home_timeout
+            self._wait_for_completion(command, 1, deadline - time.time(), record)
+            print("Motor 1 reset.")
+            self._wait_for_completion(command, 1, deadline - time.time(), record)
+            print("Motor 2 reset.")
+            self.trace.finish(record)
+            self.position = [offset[0] - self.home[0], offset[1] - self.home[1]]
+            self.position_known = True
+
+    def _send(self, command, steps=0, expected=0.0):
+        """
+        Discards any stale input and sends a command to the controller.
+
+        :param command: Command string without the terminating carriage return (e.g. '!1m1r100n').
+        :param steps: Number of steps of the longest axis, for the trace (0 if the command does not move the motors).
+        :param expected: Expected duration of the move, for the trace (in seconds).
+        :return: TraceRecord of the command, to be passed to self.trace.finish() once the command has completed.
+        """
         self.port.flushInput()
-        self.port.flushOutput()
-        self.port.close()
+        self._rx_buffer = b''
+        record = self.trace.start(command, steps, expected)
+        self.port.write((command + '\r').encode())
+        return record
+
+    def _read_reply(self, record):
+        """
+        Reads the reply line of a command (e.g. 'A' for settings) and completes its trace record.
+
+        :param record: TraceRecord returned by _send().
+        :return: Reply bytes (empty if the port timed out).
+        """
+        reply = self.port.readline()
+        if reply:
+            record.first_byte = time.time()
+        self.trace.finish(record, timed_out=not reply)
+        return reply
+
+    def _wait_for_completion(self, command, count, timeout, record=None):
+        """
+        Reads the controller's replies until the given number of completion tokens ('o') has been received.
+        Reads everything available at once rather than byte by byte; bytes received after the last expected token are
+        kept for the next wait.
+
+        :param command: Command being waited on (used in the error message).
+        :param count: Number of completion tokens to wait for.
+        :param timeout: Maximum time to wait (in seconds).
+        :param record: TraceRecord of the command, the time the first reply byte is received is written to it. If the
+                       deadline is missed, the record is finished as timed out.
+        :return: Nothing.
+        :raises MotorTimeoutError: If fewer than 'count' tokens were received before the deadline.
+        """
+        deadline = time.time() + timeout
+        received = 0
+        while True:
+            if record is not None and record.first_byte is None and self._rx_buffer:
+                record.first_byte = time.time()
+            while received < count and COMPLETION_TOKEN in self._rx_buffer:
+                self._rx_buffer = self._rx_buffer.split(COMPLETION_TOKEN, 1)[1]
+                received += 1
+            if received == count:
+                return
+            if time.time() >= deadline:
+                if record is not None:
+                    self.trace.finish(record, timed_out=True)
+                self.position_known = False  # The motors may have stopped anywhere
+                raise MotorTimeoutError(command, count - received, timeout)
+            self._rx_buffer += self.port.read(self.port.in_waiting or 1)
+
+    def destroy(self):
+        """
+        Flush remaining data and close port. The position is saved so the next session can skip the homing cycle.
+
+        :return: Nothing.
+        """
+        with self.lock:
+            save_controller_state(self.port_name, position=self.position, position_valid=self.position_known,
+                                  home=list(self.home))
+            try:
+                self.port.flush()
+                self.port.flushInput()
+                self.port.flushOutput()
+            finally:
+                self.port.close()
+                self.trace.close()
+
+
+class MotionProgram:
+    """
+    Sequence of moves to absolute positions, compiled into C4 commands ahead of time and streamed to the controller.
+    Up to 'window' commands are kept outstanding on the serial line (i.e. queued in the controller's input buffer), so
+    the controller never waits on the host between moves that do not need a measurement in between. During a scan, the
+    move to the next point is sent as soon as the measurement at the current point has been taken, and the remaining
+    bookkeeping runs while the probe moves.
+
+        Attributes:
+            targets: List of absolute (motor 1, motor 2) target positions, in steps.
+            completed: Number of moves whose completion has been received.
+    """
+    def __init__(self, motor, targets, window=1):
+        """
+        :param motor: MotorDriver executing the program.
+        :param targets: Sequence of absolute (motor 1, motor 2) target positions, in steps.
+        :param window: Maximum number of commands sent ahead of their completion.
+        """
+        self.motor = motor
+        self.targets = [(int(x), int(y)) for x, y in targets]
+        self.window = max(1, window)
+        self.start = tuple(motor.position)
+        self.sent = 0
+        self.completed = 0
+        self.records = {}  # TraceRecords of the outstanding moves, by index
+        # Compiled moves: (encoded command, command, number of motors moving, timeout, x steps, y steps)
+        self.moves = []
+        x, y = self.start
+        for target_x, target_y in self.targets:
+            command, num_motors = format_move(target_x - x, target_y - y)
+            timeout = motor.move_timeout(max(abs(target_x - x), abs(target_y - y)))
+            self.moves.append(((command + '\r').encode(), command, num_motors, timeout, target_x - x, target_y - y))
+            x, y = target_x, target_y
+
+    def __len__(self):
+        return len(self.moves)
+
+    def send_upto(self, index):
+        """
+        Sends the moves up to (and including) the given index, as long as fewer than 'window' moves are outstanding.
+        The motor lock is held by the calling thread while moves are outstanding.
+
+        :param index: Index of the last move to send.
+        :return: Nothing.
+        """
+        index = min(index, len(self.moves) - 1)
+        while self.sent <= index and self.sent - self.completed < self.window:
+            if self.sent == self.completed:
+                self.motor.lock.acquire()
+                if self.sent == 0 and tuple(self.motor.position) != self.start:
+                    self.motor.move_to(*self.start)  # Moved by someone else since the program was compiled
+                # Nothing is outstanding, discard any stale input before streaming
+                self.motor.port.flushInput()
+                self.motor._rx_buffer = b''
+            encoded, command, num_motors, _, x_steps, y_steps = self.moves[self.sent]
+            if num_motors:
+                steps = max(abs(x_steps), abs(y_steps))
+                self.records[self.sent] = self.motor.trace.start(command, steps, self.motor.expected_duration(steps))
+                self.motor.port.write(encoded)
+            self.sent += 1
+
+    def wait_for(self, index):
+        """
+        Blocks until the move with the given index has completed, sending it (and any move before it) if needed.
+        The tracked motor position is updated as each move completes.
+
+        :param index: Index of the move to wait for.
+        :return: Nothing.
+        :raises MotorTimeoutError: If a completion was not received before the deadline. The lock is released and the
+                                   program cannot be continued.
+        """
+        while self.completed <= index:
+            self.send_upto(index)
+            _, command, num_motors, timeout, x_steps, y_steps = self.moves[self.completed]
+            record = self.records.pop(self.completed, None)
+            try:
+                self.motor._wait_for_completion(command, num_motors, timeout, record)
+            except MotorTimeoutError:
+                self.abort()
+                raise
+            if record is not None:
+                self.motor.trace.finish(record)
+            self.motor.position[0] += x_steps
+            self.motor.position[1] += y_steps
+            self.completed += 1
+            if self.completed == self.sent:
+                self.motor.lock.release()
+
+    def run(self):
+        """
+        Streams the whole program and blocks until every move has completed.
+
+        :return: Nothing.
+        """
+        if self.moves:
+            self.wait_for(len(self.moves) - 1)
+
+    def abort(self):
+        """
+        Stops streaming the program. Moves already sent are not cancelled on the controller.
+
+        :return: Nothing.
+        """
+        if self.sent > self.completed:
+            self.motor.lock.release()
+        self.sent = self.completed = len(self.moves)
+        self.records.clear()
+
+
+class MotorSession:
+    """
+    Process-wide registry of the connections to the C4 controllers. The scan threads, the reset thread and the manual
+    movement GUI borrow the same MotorDriver instead of reopening the port (and repeating the identification handshake)
+    for every job. Commands sent by different threads are serialized by the driver's lock.
+
+    Each controller is addressed by its port name (e.g. 'COM3') or the serial number of its USB adapter, or None for the
+    controller found by find_c4_port(). Every controller has its own connection, saved position and motion queue,
+    executed in order by a worker thread (see submit()): resets and manual moves are queued there instead of blocking
+    the GUI, and the jobs of different positioner benches run concurrently.
+    """
+    _lock = threading.Lock()
+    _motors = {}  # Port name -> MotorDriver
+    _workers = {}  # Port name -> single worker executing the controller's motion queue
+    _default = None  # Port name of the controller borrowed with controller=None
+
+    @classmethod
+    def borrow(cls, controller=None):
+        """
+        Returns the shared MotorDriver of a controller, connecting to it first if no connection is open.
+
+        :param controller: Port name or USB serial number of the controller (None for the default controller).
+        :return: The shared MotorDriver.
+        :raises serial.SerialException: If the controller was not found.
+        """
+        with cls._lock:
+            if controller is None:
+                port_name = cls._default
+                if port_name not in cls._motors or not cls._motors[port_name].port.is_open:
+                    # Ports already connected to another controller are not probed
+                    port_name = find_c4_port(exclude=[name for name, motor in cls._motors.items()
+                                                      if motor.port.is_open])
+                    cls._default = port_name
+            else:
+                port_name = resolve_c4_port(controller)
+            motor = cls._motors.get(port_name)
+            if motor is None or not motor.port.is_open:
+                motor = cls._motors[port_name] = MotorDriver(port_name=port_name)
+            return motor
+
+    @classmethod
+    def submit(cls, controller, function, *args, **kwargs):
+        """
+        Queues a job on a controller's motion queue. Jobs of the same controller are executed one at a time, in the
+        order they were submitted.
+
+        :param controller: Port name or USB serial number of the controller (None for the default controller).
+        :param function: Function called as function(motor, *args, **kwargs), e.g. MotorDriver.move_to.
+        :return: concurrent.futures.Future of the function's result.
+        :raises serial.SerialException: If the controller was not found.
+        """
+        motor = cls.borrow(controller)
+        with cls._lock:
+            worker = cls._workers.get(motor.port_name)
+            if worker is None:
+                worker = cls._workers[motor.port_name] = ThreadPoolExecutor(max_workers=1)
+        return worker.submit(function, motor, *args, **kwargs)
+
+    @classmethod
+    def controllers(cls):
+        """
+        :return: Port names of the controllers currently connected.
+        """
+        with cls._lock:
+            return [name for name, motor in cls._motors.items() if motor.port.is_open]
+
+    @classmethod
+    def invalidate(cls, controller=None):
+        """
+        Drops the connection to a controller (e.g. after a communication error), the next borrow() reconnects. The
+        motor position is no longer trusted, so the next reset runs a full homing cycle.
+
+        :param controller: Port name or USB serial number of the controller (None for the default controller).
+        :return: Nothing.
+        """
+        port_name = cls._default if controller is None else resolve_c4_port(controller)
+        cls._drop(port_name, position_known=False)
+
+    @classmethod
+    def close(cls):
+        """
+        Closes the connections to all controllers. Called automatically when the program exits.
+
+        :return: Nothing.
+        """
+        with cls._lock:
+            port_names = list(cls._motors)
+        for port_name in port_names:
+            cls._drop(port_name)
+
+    @classmethod
+    def _drop(cls, port_name, position_known=True):
+        """
+        Closes the connection to a controller, saving the motor position. Jobs still queued for it fail (the port is
+        closed).
+
+        :param port_name: Port name of the controller.
+        :param position_known: False to mark the saved position invalid.
+        :return: Nothing.
+        """
+        with cls._lock:
+            motor = cls._motors.pop(port_name, None)
+            worker = cls._workers.pop(port_name, None)
+        if worker is not None:
+            worker.shutdown(wait=False)
+        if motor is not None:
+            if not position_known:
+                motor.position_known = False
+            try:
+                motor.destroy()
+            except Exception as e:
+                # Any error closing a port (e.g. termios.error on a pty) must not stop the other controllers from being
+                # closed and their state saved, at exit in particular
+                print("Warning: connection to %s was not closed cleanly (%s: %s)" % (port_name, type(e).__name__, e))
+
+
+atexit.register(MotorSession.close)
+
+
+def move_duration(steps, velocity, acceleration=None):
+    """
+    Computes the duration of a move with a trapezoidal velocity profile (triangular if the move is too short to reach
+    full velocity).
+
+    :param steps: Number of steps of the move.
+    :param velocity: Velocity (in steps per second).
+    :param acceleration: Acceleration (in steps per second squared), None for an instantaneous start and stop.
+    :return: Duration of the move (in seconds).
+    """
+    steps = abs(steps)
+    if not acceleration:
+        return steps / float(velocity)
+    if steps >= velocity ** 2 / float(acceleration):
+        return steps / float(velocity) + velocity / float(acceleration)
+    return 2 * math.sqrt(steps / float(acceleration))
+
+
+def expected_move_duration(steps, velocity, acceleration, step_rate):
+    """
+    Computes the expected duration of a move from the slower motor's settings, or from step_rate if the velocities have
+    not been set.
+
+    :param steps: Number of steps of the move.
+    :param velocity: Velocity configured on each motor (steps per second, None if not set).
+    :param acceleration: Acceleration configured on each motor (steps per second squared, None if not set).
+    :param step_rate: Slowest expected motor speed (in steps per second), used if the velocities have not been set.
+    :return: Expected duration of the move (in seconds).
+    """
+    velocities = [v for v in velocity if v]
+    accelerations = [a for a in acceleration if a]
+    velocity = min(velocities) if len(velocities) == 2 else step_rate
+    acceleration = min(accelerations) if len(accelerations) == 2 else None
+    return move_duration(steps, velocity, acceleration)
+
+
+def move_timeout(steps, velocity, acceleration, step_rate, margin):
+    """
+    Computes the deadline for the completion of a move: twice its expected duration (see expected_move_duration())
+    plus a fixed margin.
+
+    :param steps: Number of steps of the move.
+    :param velocity: Velocity configured on each motor (steps per second, None if not set).
+    :param acceleration: Acceleration configured on each motor (steps per second squared, None if not set).
+    :param step_rate: Slowest expected motor speed (in steps per second), used if the velocities have not been set.
+    :param margin: Fixed allowance added to the deadline (in seconds).
+    :return: Maximum time to wait for the completion acknowledgment (in seconds).
+    """
+    return 2.0 * expected_move_duration(steps, velocity, acceleration, step_rate) + margin
+
+
+def format_move(x_steps, y_steps):
+    """
+    Builds the C4 command moving motor 1 and motor 2 by the given (relative) number of steps. Motors that do not move
+    are left out of the command; the controller sends one completion acknowledgment per motor in the command.
+
+    :param x_steps: Number of steps to move motor 1 by (negative to move backward).
+    :param y_steps: Number of steps to move motor 2 by (negative to move backward).
+    :return: Command string (e.g. '!1m1r100,2f50n') and the number of motors it moves.
+    """
+    axes = ['%d%s%d' % (motor, 'r' if steps > 0 else 'f', abs(steps))
+            for motor, steps in ((1, int(x_steps)), (2, int(y_steps))) if steps != 0]
+    return '!1m' + ','.join(axes) + 'n', len(axes)
+
+
+def format_home_offset(motor, steps):
+    """
+    Builds the C4 command writing the home offset of a motor (distance between its home switch and home position).
+
+    :param motor: Motor number (1 or 2).
+    :param steps: Home offset (in steps).
+    :return: Command string (e.g. '!1wh1,r,3788').
+    """
+    return '!1wh%d,r,%d' % (motor, steps)
+
+
+def profiles_enabled():
+    """
+    :return: True if the motion profiles are enabled through the C4_PROFILES environment variable.
+    """
+    return os.environ.get(PROFILES_ENV, '').strip().lower() in ('1', 'true', 'yes')
+
+
+def format_setting(setting, motor, value):
+    """
+    Builds the C4 command writing a motor setting.
+
+    :param setting: 'v' for the velocity (steps per second), 'a' for the acceleration (steps per second squared).
+    :param motor: Motor number (1 or 2).
+    :param value: Value of the setting.
+    :return: Command string (e.g. '!1wv1,2000').
+    """
+    return '!1w%s%d,%d' % (setting, motor, value)
+
+
+def load_motor_state(filename=STATE_FILE):
+    """
+    Loads the persisted motor controller state.
+
+    :param filename: Name of the state file.
+    :return: Dictionary of the saved state (empty if no state has been saved or the file is unreadable).
+    """
+    if not os.path.exists(filename):
+        return {}
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_motor_state(filename=STATE_FILE, **kwargs):
+    """
+    Updates the persisted motor controller state with the given entries.
+
+    :param filename: Name of the state file.
+    :param kwargs: State entries to update (e.g. port='COM3').
+    :return: Nothing.
+    """
+    with _state_lock:
+        state = load_motor_state(filename)
+        state.update(kwargs)
+        try:
+            with open(filename, 'w') as f:
+                json.dump(state, f)
+        except OSError as e:
+            print("Warning: motor state could not be saved (%s)" % e)
+
+
+def load_controller_state(port_name, filename=STATE_FILE):
+    """
+    Loads the persisted state of a single controller (e.g. its motor position).
+
+    :param port_name: Port name of the controller.
+    :param filename: Name of the state file.
+    :return: Dictionary of the saved state (empty if nothing has been saved for this controller).
+    """
+    return load_motor_state(filename).get('controllers', {}).get(port_name, {})
+
+
+def save_controller_state(port_name, filename=STATE_FILE, **kwargs):
+    """
+    Updates the persisted state of a single controller with the given entries.
+
+    :param port_name: Port name of the controller.
+    :param filename: Name of the state file.
+    :param kwargs: State entries to update (e.g. position=[0, 0]).
+    :return: Nothing.
+    """
+    with _state_lock:
+        controllers = load_motor_state(filename).get('controllers', {})
+        controllers.setdefault(port_name, {}).update(kwargs)
+        save_motor_state(filename, controllers=controllers)
+
+
+def probe_port(port_name, timeout=0.3):
+    """
+    Checks whether a C4 controller is answering on a serial port. The port is closed afterwards.
+
+    :param port_name: Name of the serial port (e.g. 'COM3').
+    :param timeout: Time to wait for the identification reply (in seconds).
+    :return: True if the controller identified itself as a C4, False otherwise.
+    """
+    try:
+        with serial.Serial(port_name, timeout=timeout) as port:
+            port.flushInput()
+            port.write((IDENTIFY_COMMAND + '\r').encode())  # Check if we have connected to the right COM Port/machine
+            return port.read(2) == b'C4'
+    except (serial.SerialException, OSError, ValueError):
+        return False
+
+
+def list_serial_ports():
+    """
+    Lists the serial ports to probe for a C4 controller: the port given through the C4_PORT environment variable
+    (e.g. the C4 emulator's pty), followed by the serial ports reported by the OS.
+
+    :return: List of port names.
+    """
+    port_names = [info.device for info in serial.tools.list_ports.comports()]
+    if os.environ.get('C4_PORT'):
+        port_names.insert(0, os.environ['C4_PORT'])
+    return port_names
+
+
+def resolve_c4_port(controller):
+    """
+    Finds the port name of a controller given by port name or by the serial number of its USB adapter.
+
+    :param controller: Port name (e.g. 'COM3') or USB serial number.
+    :return: Port name. Names that are not listed by the OS (e.g. the C4 emulator's pty) are returned unchanged.
+    """
+    for info in serial.tools.list_ports.comports():
+        if controller in (info.device, info.serial_number):
+            return info.device
+    return controller
+
+
+def discover_c4_ports(port_names=None, timeout=0.3):
+    """
+    Probes serial ports concurrently and returns those with a C4 controller answering.
+
+    :param port_names: Ports to probe (defaults to list_serial_ports()).
+    :param timeout: Time to wait for the identification reply on each port (in seconds).
+    :return: List of port names with a C4 controller, in the order they were given.
+    """
+    if port_names is None:
+        port_names = list_serial_ports()
+    if not port_names:
+        return []
+    with ThreadPoolExecutor(max_workers=min(len(port_names), 16)) as executor:
+        answered = list(executor.map(lambda name: probe_port(name, timeout), port_names))
+    return [name for name, ok in zip(port_names, answered) if ok]
+
+
+def find_c4_port(timeout=0.3, exclude=()):
+    """
+    Finds the serial port of the C4 controller. The port given through C4_PORT and the last port that answered are
+    tried first, the remaining ports reported by the OS are only probed (concurrently) if neither answers.
+    The port found is saved to the motor state file.
+
+    :param timeout: Time to wait for the identification reply on each port (in seconds).
+    :param exclude: Ports not to probe (e.g. ports already connected to another controller).
+    :return: Name of the port the C4 controller is connected to.
+    :raises serial.SerialException: If no C4 controller was found.
+    """
+    preferred = [os.environ.get('C4_PORT'), load_motor_state().get('port')]
+    for port_name in [name for name in preferred if name and name not in exclude]:
+        if probe_port(port_name, timeout):
+            save_motor_state(port=port_name)
+            return port_name
+    port_names = [name for name in list_serial_ports() if name not in preferred and name not in exclude]
+    found = discover_c4_ports(port_names, timeout)
+    if not found:
+        raise serial.SerialException("No C4 controller found on ports: %s" % ', '.join(port_names))
+    save_motor_state(port=found[0])
+    return found[0]
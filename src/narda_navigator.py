@@ -175,15 +175,34 @@ class NardaNavigator:
         except:
             return
 
-    def takeMeasurement(self, dwell_time, measurement, filename, pathname, comment):
+    def takeMeasurement(self, dwell_time, measurement, filename, pathname, comment, settle=None):
         """
         Takes a measurement (highest_peak or WideBand) using the NARDA program.
 
         :param dwell_time: Time the NS probe stays in position before taking a measurement.
         :param filename: Filename to save the measurement outputs as.
         :param pathname: Save directory to hold output files.
+        :param settle: SettleDetector ending the dwell once the reading is stable (dwell_time is then the longest
+                       dwell), None to always wait dwell_time.
         :return: The max value in the current measurement point.
         """
+        self.captureMeasurement(dwell_time, filename, pathname, comment, settle)
+        # Return max recorded value
+        return self.readMeasurement(filename, pathname, measurement)
+
+    def captureMeasurement(self, dwell_time, filename, pathname, comment, settle=None):
+        """
+        Takes a measurement and saves it as a text file, without waiting for the file to be written. This is the part
+        of takeMeasurement() that needs the NS probe to stay in position.
+
+        :param dwell_time: Time the NS probe stays in position before taking a measurement.
+        :param filename: Filename to save the measurement outputs as.
+        :param pathname: Save directory to hold output files.
+        :param comment: Comment saved in the output file.
+        :param settle: SettleDetector ending the dwell once the reading is stable (dwell_time is then the longest
+                       dwell), None to always wait dwell_time.
+        :return: Nothing.
+        """
         self.bringToFront()
         # If not on the data tab, switch to it
         self.selectTab('data')
@@ -194,7 +213,10 @@ class NardaNavigator:
         # Todo: figure out if we need to check max hold here too..
 
         # Wait for the measurements to settle before taking measurements
-        time.sleep(dwell_time)
+        if settle is None:
+            time.sleep(dwell_time)
+        else:
+            settle.wait(self.grabWindow, dwell_time)
 
         # Take the actual measurement after marking the highest peak
         pgui.click(pgui.center(pgui.locateOnScreen(self.refpics_path + '/highest_peak.PNG', grayscale=True)))
@@ -224,13 +246,33 @@ class NardaNavigator:
         except TypeError:
             print("New file '" + filename + ".txt'" + " has been saved.")
 
-        # Wait for file to have saved properly
-        while not os.path.isfile(pathname + '/' + filename + '.txt'):
-            pass
+    def readMeasurement(self, filename, pathname, measurement, timeout=30.0):
+        """
+        Waits for the text file of a measurement to be written, then reads its value. Does not use the NARDA program,
+        so it can run on another thread while the next measurement is taken.
 
-        # Return max recorded value
+        :param filename: Filename of the measurement outputs.
+        :param pathname: Directory/path to the text output file.
+        :param measurement: Measurement (highest_peak or WideBand).
+        :param timeout: Longest wait for the file (in seconds).
+        :return: The max value in the measurement.
+        """
+        deadline = time.time() + timeout
+        while not os.path.isfile(pathname + '/' + filename + '.txt'):
+            if time.time() > deadline:
+                raise IOError("Measurement file '%s.txt' was not saved within %g s" % (filename, timeout))
+            time.sleep(0.01)
         return self.getMaxValue(filename, pathname, measurement)
 
+    def grabWindow(self):
+        """
+        Captures an image of the NARDA program window (the same area saveBitmap() snips), without using the mouse or
+        keyboard. The image can be saved later, e.g. once the measurement turns out to be a new max value.
+
+        :return: PIL image of the window.
+        """
+        return self.ehp200_app.EHP200.capture_as_image()
+
     def saveBitmap(self, filename, pathname):
         """
         Saves a partial screenshot of the NARDA GUI, called when a new max value has been found.
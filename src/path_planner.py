@@ -0,0 +1,221 @@
+"""
+Path Planner
+
+This module orders arbitrary sets of scan points (full grids, masked grids, re-measure lists, zoom targets) to
+minimize the total travel time of the NS probe. Points are given as absolute motor positions (in steps).
+
+The travel time of a move is computed by a TravelTimeModel from the motors' velocity and acceleration. If the
+controller moves both motors simultaneously (C4 multi-axis moves), a move takes as long as its longest axis; otherwise
+the axes move one after the other and their times add up.
+
+The module contains a single class:
+    - TravelTimeModel(): travel time of moves between points.
+
+And the following functions:
+    - plan_path(): orders a set of points (nearest neighbour or sweep ordering, improved with 2-opt).
+    - path_time(): total travel time of an ordered path.
+    - nearest_neighbour_order(): greedy ordering, always moving to the closest remaining point.
+    - sweep_order(): serpentine ordering along the rows of the points, for very large point sets.
+    - two_opt(): improves an ordering by reversing segments of the path.
+"""
+
+import numpy as np
+
+
+class TravelTimeModel:
+    """
+    Travel time of moves between points, following the trapezoidal velocity profile of the motors.
+
+        Attributes:
+            velocity: Motor velocity (in steps per second).
+            acceleration: Motor acceleration (in steps per second squared), None for instantaneous starts.
+            simultaneous: True if both axes move at the same time (the move takes as long as its longest axis), False if
+                          they move one after the other.
+            overhead: Fixed time per move (e.g. command round trip and settling, in seconds).
+    """
+    def __init__(self, velocity, acceleration=None, simultaneous=True, overhead=0.0):
+        """
+        :param velocity: Motor velocity (in steps per second).
+        :param acceleration: Motor acceleration (in steps per second squared), None for instantaneous starts.
+        :param simultaneous: True if both axes move at the same time, False if they move one after the other.
+        :param overhead: Fixed time per move (in seconds).
+        """
+        self.velocity = float(velocity)
+        self.acceleration = float(acceleration) if acceleration else None
+        self.simultaneous = simultaneous
+        self.overhead = overhead
+
+    @classmethod
+    def from_motor(cls, motor, profile='settle', simultaneous=True):
+        """
+        Builds the model of a MotorDriver's motion profile. The mean overhead per move measured by the motor's serial
+        trace is included once moves have been traced.
+
+        :param motor: MotorDriver.
+        :param profile: Name of the motion profile used for the moves.
+        :param simultaneous: True if both axes move at the same time.
+        :return: TravelTimeModel.
+        """
+        settings = motor.profiles[profile]
+        overhead = motor.trace.summary()['mean_overhead'] or 0.0
+        return cls(settings.velocity, settings.acceleration, simultaneous, max(0.0, overhead))
+
+    def axis_time(self, steps):
+        """
+        Computes the duration of single-axis moves (trapezoidal velocity profile, triangular for short moves).
+
+        :param steps: Array of step counts.
+        :return: Array of durations (in seconds).
+        """
+        steps = np.abs(np.asarray(steps, dtype=float))
+        if not self.acceleration:
+            return steps / self.velocity
+        return np.where(steps >= self.velocity ** 2 / self.acceleration,
+                        steps / self.velocity + self.velocity / self.acceleration,
+                        2 * np.sqrt(steps / self.acceleration))
+
+    def __call__(self, a, b):
+        """
+        Computes the travel time between points.
+
+        :param a: Array of start points (..., 2), in steps.
+        :param b: Array of end points (..., 2), in steps (broadcast against a).
+        :return: Array of travel times (in seconds).
+        """
+        delta = np.asarray(b, dtype=float) - np.asarray(a, dtype=float)
+        tx, ty = self.axis_time(delta[..., 0]), self.axis_time(delta[..., 1])
+        times = np.maximum(tx, ty) if self.simultaneous else tx + ty
+        # No command is sent for a move of zero steps
+        return times + np.where(np.any(delta != 0, axis=-1), self.overhead, 0.0)
+
+
+def plan_path(points, model, start=None, order=None, fixed_first=False, max_points=2000):
+    """
+    Orders a set of points to minimize the total travel time. The initial ordering (nearest neighbour, or a sweep
+    ordering for more than max_points points) is improved with 2-opt for up to max_points points.
+
+    :param points: Array of points (N, 2), in steps.
+    :param model: TravelTimeModel.
+    :param start: Position the path starts from (e.g. current motor position), None if the path starts at its first
+                  point.
+    :param order: Initial ordering (indices into points). Computed if not given.
+    :param fixed_first: Keep the first point of the initial ordering first (e.g. user defined start position).
+    :param max_points: Largest number of points the quadratic algorithms are run on.
+    :return: Array of indices into points, in travel order.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    if len(points) == 0:
+        return np.zeros(0, dtype=int)
+    if order is None:
+        if fixed_first:
+            raise ValueError("fixed_first requires an initial ordering")
+        order = nearest_neighbour_order(points, model, start) if len(points) <= max_points else sweep_order(points)
+    order = np.asarray(order, dtype=int)
+    if len(points) > max_points:
+        return order
+    if fixed_first:
+        rest = two_opt(points[order[1:]], np.arange(len(order) - 1), model, points[order[0]])
+        return np.concatenate([order[:1], order[1:][rest]])
+    return order[two_opt(points[order], np.arange(len(order)), model, start)]
+
+
+def path_time(points, order, model, start=None):
+    """
+    Computes the total travel time of an ordered path.
+
+    :param points: Array of points (N, 2), in steps.
+    :param order: Indices into points, in travel order.
+    :param model: TravelTimeModel.
+    :param start: Position the path starts from, None if the path starts at its first point.
+    :return: Total travel time (in seconds).
+    """
+    path = np.asarray(points, dtype=float).reshape(-1, 2)[np.asarray(order, dtype=int)]
+    if start is not None:
+        path = np.vstack([np.asarray(start, dtype=float).reshape(1, 2), path])
+    return float(np.sum(model(path[:-1], path[1:])))
+
+
+def nearest_neighbour_order(points, model, start=None):
+    """
+    Greedy ordering: from the start position (or the first point), always moves to the closest remaining point.
+
+    :param points: Array of points (N, 2), in steps.
+    :param model: TravelTimeModel.
+    :param start: Position the path starts from, None to start at the first point.
+    :return: Array of indices into points, in travel order.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    remaining = np.ones(len(points), dtype=bool)
+    order = np.empty(len(points), dtype=int)
+    current = points[0] if start is None else np.asarray(start, dtype=float)
+    for k in range(len(points)):
+        times = np.where(remaining, model(current, points), np.inf)
+        nearest = int(np.argmin(times))
+        order[k] = nearest
+        remaining[nearest] = False
+        current = points[nearest]
+    return order
+
+
+def sweep_order(points):
+    """
+    Serpentine ordering: points are swept along each row (same motor 2 position), alternating direction between rows.
+
+    :param points: Array of points (N, 2), in steps.
+    :return: Array of indices into points, in travel order.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    rows, row_index = np.unique(points[:, 1], return_inverse=True)
+    # Reverse the motor 1 direction on every other row
+    direction = np.where(row_index % 2 == 0, 1.0, -1.0)
+    return np.lexsort((direction * points[:, 0], row_index))
+
+
+def two_opt(points, order, model, start=None, max_passes=20, min_gain=0.05):
+    """
+    Improves an ordering by reversing segments of the path as long as it shortens the total travel time. The path is
+    open (it does not return to its start). A reversal is only made if it saves at least the overhead of a move, or
+    min_gain of the median move time, so step rounding noise does not turn an orderly path (e.g. the serpentine order
+    of a grid) into an unpredictable one.
+
+    :param points: Array of points (N, 2), in steps.
+    :param order: Initial ordering (indices into points).
+    :param model: TravelTimeModel.
+    :param start: Fixed position the path starts from, None if the path starts at its first point.
+    :param max_passes: Maximum number of passes over the path.
+    :param min_gain: Smallest time saved by a reversal, as a fraction of the median move time of the initial path.
+    :return: Array of indices into points, in travel order.
+    """
+    order = np.asarray(order, dtype=int)
+    path = np.asarray(points, dtype=float).reshape(-1, 2)[order]
+    first = 0
+    if start is not None:
+        path = np.vstack([np.asarray(start, dtype=float).reshape(1, 2), path])
+        first = 1
+    n = len(path)
+    index = np.arange(n)  # Permutation of path being improved
+    if n < 3:
+        return order
+    threshold = max(model.overhead, min_gain * float(np.median(model(path[:-1], path[1:]))), 1e-9)
+    for _ in range(max_passes):
+        improved = False
+        p = path[index]
+        for i in range(first, n - 1):
+            j = np.arange(i + 1, n)
+            # Reversing p[i..j] replaces the edges (i-1, i) and (j, j+1) by (i-1, j) and (i, j+1)
+            removed = np.zeros(len(j))
+            added = np.zeros(len(j))
+            removed[:-1] = model(p[j[:-1]], p[j[:-1] + 1])
+            added[:-1] = model(p[i], p[j[:-1] + 1])
+            if i > 0:
+                removed += model(p[i - 1], p[i])
+                added += model(p[i - 1], p[j])
+            delta = added - removed
+            best = int(np.argmin(delta))
+            if delta[best] <= -threshold:
+                index[i:j[best] + 1] = index[i:j[best] + 1][::-1].copy()
+                p = path[index]
+                improved = True
+        if not improved:
+            break
+    return order[index[first:] - first]
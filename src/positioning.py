@@ -0,0 +1,71 @@
+"""
+Positioning
+
+This module converts physical coordinates and grid coordinates to absolute motor step targets with exact rational
+arithmetic. The number of motor steps per grid step is rarely a whole number (e.g. 2 cm / 0.00508 cm = 393.70...
+steps), so every target is rounded from its exact position relative to a fixed origin instead of accumulating
+rounded moves: every point lands within half a step of its nominal position, however far it is from the origin.
+
+Floating point step counts (e.g. grid step / step unit) are converted back to the exact fraction they approximate
+(see exact_steps()), so the rounding of a point does not depend on floating point error either.
+
+The module has the following functions:
+    - exact_steps(): exact fraction of motor steps approximated by a floating point step count.
+    - step_ratio(): exact number of motor steps in a distance.
+    - round_steps(): rounds multiples of a step count to whole steps (vectorized).
+    - distance_to_steps(): converts a distance to the nearest whole number of motor steps.
+"""
+
+from fractions import Fraction
+import numpy as np
+
+STEP_DENOMINATOR = 10 ** 6  # Largest denominator of the step counts recovered from floating point values
+
+
+def exact_steps(num_steps):
+    """
+    Converts a step count to the exact fraction it approximates, e.g. 393.7007874015748 to 50000/127.
+
+    :param num_steps: Number of motor steps (float, int or Fraction).
+    :return: Fraction.
+    """
+    if isinstance(num_steps, Fraction):
+        return num_steps
+    return Fraction(num_steps).limit_denominator(STEP_DENOMINATOR)
+
+
+def step_ratio(distance, step_unit):
+    """
+    Computes the exact number of motor steps in a distance, from the decimal values of the distance and step size.
+
+    :param distance: Distance (e.g. grid step distance in cm).
+    :param step_unit: Size of a motor step, in the same unit as the distance.
+    :return: Fraction of motor steps.
+    """
+    return Fraction(str(distance)) / Fraction(str(step_unit))
+
+
+def round_steps(num_steps, count):
+    """
+    Rounds multiples of a step count to whole steps (halves are rounded up), with integer arithmetic only.
+
+    :param num_steps: Number of motor steps per unit (e.g. per grid step).
+    :param count: Number of units (integer, or integer numpy array, e.g. grid columns of the points).
+    :return: Whole number of steps (int), or integer numpy array of the same shape as count.
+    """
+    steps = exact_steps(num_steps)
+    p, q = steps.numerator, steps.denominator
+    if np.ndim(count) == 0:
+        return (2 * int(count) * p + q) // (2 * q)
+    return (2 * np.asarray(count, dtype=np.int64) * p + q) // (2 * q)
+
+
+def distance_to_steps(distance, step_unit):
+    """
+    Converts a distance to the nearest whole number of motor steps.
+
+    :param distance: Distance (e.g. in cm, may be negative).
+    :param step_unit: Size of a motor step, in the same unit as the distance.
+    :return: Number of steps (int).
+    """
+    return round_steps(step_ratio(distance, step_unit), 1)
@@ -0,0 +1,229 @@
+"""
+Scan Estimate
+
+This module estimates how long a scan will take before it is run (dry runs, which do not use the positioner or the
+NARDA program), and tracks the estimated time left while it runs.
+
+A scan point takes the move from the previous point, the dwell time, and the time the UI automation of the NARDA
+program takes to save the measurement (clicks, typing, file dialogs). Moves are estimated with the TravelTimeModel of
+the motion profiles plus the overhead per move measured by the serial trace; the UI automation time per point is
+measured by every scan. Both are saved to 'motor_state.txt' at the end of a scan, so later estimates use the timing of
+this PC and positioner (see load_calibration()).
+
+The module has the following classes:
+    - ScanEstimate(): estimated duration of a scan and its breakdown.
+    - ScanProgress(): estimated time left of a running scan, corrected by the time the points actually took.
+
+And the following functions:
+    - estimate_path(): estimates a scan along a path of points.
+    - calibrated_model(): travel time model of a motion profile, with the measured overhead per move.
+    - load_calibration(): timing measured by earlier scans.
+    - save_calibration(): saves the timing measured by a scan.
+    - format_duration(): formats a duration as h:mm:ss.
+"""
+
+import time
+import numpy as np
+from src.motor_driver import PROFILES, load_motor_state, save_motor_state
+from src.path_planner import TravelTimeModel
+
+CALIBRATION_KEY = 'scan_timing'  # Entry of the timing measured by the scans in the motor state file
+DEFAULT_POINT_OVERHEAD = 7.0  # UI automation time per point (in seconds) until a scan has measured it
+SETUP_TIME = 2.0  # Wait before the first point of a scan (in seconds)
+
+
+class ScanEstimate:
+    """
+    Estimated duration of a scan and its breakdown.
+
+        Attributes:
+            points: Number of points measured.
+            steps: Total motor 1 and motor 2 steps moved.
+            move_time: Total time of the moves (in seconds).
+            dwell_time: Total dwell time (in seconds).
+            overhead_time: Total UI automation time (in seconds).
+            setup_time: Waits outside of the points (in seconds).
+            point_times: Numpy array of the estimated time of each point (move, dwell and UI automation).
+            calibrated: True if the UI automation time was measured by an earlier scan.
+    """
+    def __init__(self, points, steps, move_time, dwell_time, overhead_time, setup_time=0.0, point_times=None,
+                 calibrated=False):
+        """
+        :param points: Number of points measured.
+        :param steps: Total motor 1 and motor 2 steps moved.
+        :param move_time: Total time of the moves (in seconds).
+        :param dwell_time: Total dwell time (in seconds).
+        :param overhead_time: Total UI automation time (in seconds).
+        :param setup_time: Waits outside of the points (in seconds).
+        :param point_times: Numpy array of the estimated time of each point.
+        :param calibrated: True if the UI automation time was measured by an earlier scan.
+        """
+        self.points = points
+        self.steps = tuple(int(s) for s in steps)
+        self.move_time = move_time
+        self.dwell_time = dwell_time
+        self.overhead_time = overhead_time
+        self.setup_time = setup_time
+        self.point_times = np.zeros(points) if point_times is None else np.asarray(point_times, dtype=float)
+        self.calibrated = calibrated
+
+    def __add__(self, other):
+        """
+        Combines the estimates of consecutive scans (e.g. the zoom scans of several peaks). Estimates without points
+        (e.g. the move between two zoom scans) have no UI automation time, so they do not affect the calibrated flag.
+
+        :param other: ScanEstimate.
+        :return: ScanEstimate of both scans.
+        """
+        return ScanEstimate(self.points + other.points, np.add(self.steps, other.steps),
+                            self.move_time + other.move_time, self.dwell_time + other.dwell_time,
+                            self.overhead_time + other.overhead_time, self.setup_time + other.setup_time,
+                            np.concatenate((self.point_times, other.point_times)),
+                            (self.calibrated or not self.points) and (other.calibrated or not other.points))
+
+    def total(self):
+        """
+        :return: Estimated duration of the scan (in seconds).
+        """
+        return self.move_time + self.dwell_time + self.overhead_time + self.setup_time
+
+    def report(self):
+        """
+        Formats the estimate and its breakdown for printing or logging.
+
+        :return: Multi-line string.
+        """
+        total = self.total() or 1.0
+        lines = ["Scan estimate: %d point(s), %s (finishing around %s if started now)"
+                 % (self.points, format_duration(self.total()),
+                    time.strftime('%H:%M', time.localtime(time.time() + self.total()))),
+                 "Motor steps: %d (motor 1), %d (motor 2)" % self.steps]
+        for label, seconds in (('Moves', self.move_time), ('Dwell', self.dwell_time),
+                               ('UI automation', self.overhead_time), ('Setup', self.setup_time)):
+            lines.append("%-14s %9s  %5.1f%%" % (label + ':', format_duration(seconds), 100.0 * seconds / total))
+        if self.points:
+            lines.append("Per point: %.1f s on average" % ((total - self.setup_time) / self.points))
+        if not self.calibrated:
+            lines.append("UI automation time not measured yet, assuming %.1f s per point" % DEFAULT_POINT_OVERHEAD)
+        return '\n'.join(lines)
+
+
+class ScanProgress:
+    """
+    Estimated time left of a running scan. The estimate of the points left is scaled by the ratio between the time
+    the points measured so far took and their estimate.
+
+        Attributes:
+            point_times: Numpy array of the estimated time of each point.
+            start_time: Time the first point started (seconds since the epoch).
+    """
+    def __init__(self, point_times):
+        """
+        :param point_times: Numpy array of the estimated time of each point (see ScanEstimate).
+        """
+        self.point_times = np.asarray(point_times, dtype=float)
+        self._planned = np.cumsum(self.point_times)
+        self.start_time = time.time()
+
+    def remaining(self, done):
+        """
+        :param done: Number of points completed.
+        :return: Estimated time left (in seconds).
+        """
+        if done <= 0 or not len(self.point_times):
+            return float(self._planned[-1]) if len(self.point_times) else 0.0
+        done = min(done, len(self.point_times))
+        planned = self._planned[done - 1]
+        ratio = (time.time() - self.start_time) / planned if planned > 0 else 1.0
+        return float(self._planned[-1] - planned) * ratio
+
+    def report(self, done):
+        """
+        :param done: Number of points completed.
+        :return: Progress line with the estimated time left and finish time.
+        """
+        left = self.remaining(done)
+        return "Progress: %d/%d point(s), about %s left (finishing around %s)" % (
+            done, len(self.point_times), format_duration(left), time.strftime('%H:%M', time.localtime(time.time() +
+                                                                                                     left)))
+
+
+def estimate_path(targets, dwell_time, start=None, model=None, traverse=None, point_overhead=None, setup_time=0.0):
+    """
+    Estimates a scan along a path of points.
+
+    :param targets: Array of the absolute motor positions (N, 2) of the points, in scan order (in steps).
+    :param dwell_time: Wait time at each point before the measurement (in seconds).
+    :param start: Motor position before the scan, None to start at the first point.
+    :param model: TravelTimeModel of the moves between points (calibrated 'settle' profile if not given).
+    :param traverse: TravelTimeModel of the move to the first point (calibrated 'traverse' profile if not given).
+    :param point_overhead: UI automation time per point (in seconds), the calibrated value if not given.
+    :param setup_time: Waits outside of the points (in seconds).
+    :return: ScanEstimate.
+    """
+    calibration = load_calibration()
+    calibrated = point_overhead is not None or 'point_overhead' in calibration
+    if point_overhead is None:
+        point_overhead = calibration.get('point_overhead', DEFAULT_POINT_OVERHEAD)
+    if model is None:
+        model = calibrated_model('settle', calibration)
+    if traverse is None:
+        traverse = calibrated_model('traverse', calibration)
+    targets = np.asarray(targets, dtype=float).reshape(-1, 2)
+    previous = targets[:1] if start is None else np.asarray(start, dtype=float).reshape(1, 2)
+    path = np.vstack((previous, targets))
+    moves = np.zeros(len(targets))
+    if len(targets):
+        moves[0] = traverse(path[0], path[1])
+        moves[1:] = model(path[1:-1], path[2:])
+    point_times = moves + dwell_time + point_overhead
+    steps = np.abs(np.diff(path, axis=0)).sum(axis=0)
+    return ScanEstimate(len(targets), steps, float(moves.sum()), dwell_time * len(targets),
+                        point_overhead * len(targets), setup_time, point_times, calibrated)
+
+
+def calibrated_model(profile, calibration=None):
+    """
+    Builds the TravelTimeModel of a motion profile, with the overhead per move measured by earlier scans.
+
+    :param profile: Name of the motion profile ('settle' or 'traverse').
+    :param calibration: Dictionary of the measured timing (loaded if not given).
+    :return: TravelTimeModel.
+    """
+    if calibration is None:
+        calibration = load_calibration()
+    settings = PROFILES[profile]
+    return TravelTimeModel(settings.velocity, settings.acceleration, overhead=calibration.get('move_overhead', 0.0))
+
+
+def load_calibration():
+    """
+    :return: Dictionary of the timing measured by earlier scans: 'point_overhead' (UI automation time per point) and
+             'move_overhead' (overhead per move), in seconds. Empty if no scan has been run yet.
+    """
+    return load_motor_state().get(CALIBRATION_KEY, {})
+
+
+def save_calibration(point_overhead=None, move_overhead=None):
+    """
+    Saves the timing measured by a scan, used by later estimates.
+
+    :param point_overhead: Median UI automation time per point (in seconds), None to keep the saved value.
+    :param move_overhead: Mean overhead per move (in seconds), None to keep the saved value.
+    :return: Nothing.
+    """
+    calibration = load_calibration()
+    if point_overhead is not None:
+        calibration['point_overhead'] = round(float(point_overhead), 3)
+    if move_overhead is not None:
+        calibration['move_overhead'] = round(max(0.0, float(move_overhead)), 4)
+    save_motor_state(**{CALIBRATION_KEY: calibration})
+
+
+def format_duration(seconds):
+    """
+    :param seconds: Duration (in seconds).
+    :return: Duration formatted as h:mm:ss.
+    """
+    seconds = int(round(max(0.0, seconds)))
+    return "%d:%02d:%02d" % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
@@ -0,0 +1,228 @@
+"""
+Scan Journal
+
+This module records the progress of area scans so an interrupted scan (crash, pyautogui failsafe, power loss) can be
+resumed without losing the points already measured. Every completed point is appended to a journal file in the save
+directory as one JSON line, flushed and synced to disk before the scan moves on. The first line holds the scan
+settings (grid size, grid step, grid origin, measurement settings), the last line marks a completed scan.
+
+When a scan is resumed, the journal is reloaded: the values and the running maximum are rebuilt from its records and
+the scan continues with the points not measured yet. A new scan archives the previous journal (renamed with its date).
+
+The module contains a single class:
+    - ScanJournal(): append-only journal of the points measured by a scan.
+
+Journal format (one JSON object per line):
+    {"header": {"x_points": 5, "y_points": 7, "num_steps": 551.2, "origin": [1000, 1200], ...}}
+    {"point": 1, "row": 0, "col": 0, "x": 1000, "y": 1200, "value": 0.53, "fname": "L_ES1",
+     "started": 1538000000.1, "completed": 1538000004.2}
+    ...
+    {"failed": 1538000200.0, "error": "No completion received ..."}    (scan stopped by an error, still resumable)
+    {"complete": 1538000400.0}
+    {"point": 12, ..., "correction": true}    (points re-measured after the scan, see CorrectionThread)
+"""
+
+import json
+import os
+import time
+import numpy as np
+
+JOURNAL_NAME = 'scan_journal.jsonl'  # Name of the journal file in the save directory
+
+
+class ScanJournal:
+    """
+    Append-only journal of the points measured by a scan.
+
+        Attributes:
+            filename: Path of the journal file.
+            header: Dictionary of the scan settings.
+            records: List of the point records (dictionaries), in measurement order.
+            complete: True once the scan has completed.
+    """
+    def __init__(self, filename, header, records=None, complete=False):
+        """
+        Use ScanJournal.create() to start a journal, ScanJournal.load() to read one.
+
+        :param filename: Path of the journal file.
+        :param header: Dictionary of the scan settings.
+        :param records: List of the point records already in the file.
+        :param complete: True if the scan has completed.
+        """
+        self.filename = filename
+        self.header = header
+        self.records = records or []
+        self.complete = complete
+        self._file = None
+
+    @classmethod
+    def create(cls, filename, header):
+        """
+        Starts the journal of a new scan. An existing journal is archived (renamed with its modification date).
+
+        :param filename: Path of the journal file.
+        :param header: Dictionary of the scan settings (JSON serializable).
+        :return: ScanJournal.
+        """
+        if os.path.exists(filename):
+            stamp = time.strftime('%Y%m%d_%H%M%S', time.localtime(os.path.getmtime(filename)))
+            root, ext = os.path.splitext(filename)
+            os.rename(filename, '%s_%s%s' % (root, stamp, ext))
+        journal = cls(filename, header)
+        journal._append({'header': header})
+        return journal
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Reads a journal. A truncated last line (interrupted write) is ignored.
+
+        :param filename: Path of the journal file.
+        :return: ScanJournal, None if the file does not exist or has no header.
+        """
+        if not os.path.exists(filename):
+            return None
+        header, records, complete = None, [], False
+        with open(filename) as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if 'header' in entry:
+                    header = entry['header']
+                elif 'point' in entry:
+                    records.append(entry)
+                elif 'complete' in entry:
+                    complete = True
+        if header is None:
+            return None
+        return cls(filename, header, records, complete)
+
+    @classmethod
+    def interrupted(cls, filename):
+        """
+        Reads the journal of an interrupted scan.
+
+        :param filename: Path of the journal file.
+        :return: ScanJournal, None if there is no journal, the scan completed, or no point was measured.
+        """
+        journal = cls.load(filename)
+        if journal is None or journal.complete or not journal.records:
+            return None
+        return journal
+
+    @classmethod
+    def resume(cls, filename, header):
+        """
+        Reopens the journal of an interrupted scan with the same settings, to append the points measured next.
+
+        :param filename: Path of the journal file.
+        :param header: Dictionary of the settings of the scan being resumed (the origin and start position are taken
+                       from the journal).
+        :return: ScanJournal, None if there is no interrupted scan with the same settings.
+        """
+        journal = cls.interrupted(filename)
+        if journal is None or not journal.matches(header):
+            return None
+        return journal
+
+    def matches(self, header):
+        """
+        :param header: Dictionary of scan settings.
+        :return: True if the journal's settings are the same (the origin and start position are not compared).
+        """
+        ignored = ('origin', 'start_pos', 'created')
+        keys = (set(header) | set(self.header)) - set(ignored)
+        return all(self.header.get(key) == header.get(key) for key in keys)
+
+    def record_point(self, number, row, col, position, value, fname, started, completed, correction=False):
+        """
+        Appends a measured point to the journal, synced to disk before returning.
+
+        :param number: Point number (see generate_grid()).
+        :param row: Grid row of the point.
+        :param col: Grid column of the point.
+        :param position: Absolute motor position (in steps) of the point.
+        :param value: Measured value.
+        :param fname: Filename of the measurement files.
+        :param started: Time the probe reached the point (seconds since the epoch).
+        :param completed: Time the measurement completed (seconds since the epoch).
+        :param correction: True if the point is re-measured after the scan (replaces its earlier record).
+        :return: Nothing.
+        """
+        record = {'point': int(number), 'row': int(row), 'col': int(col), 'x': int(position[0]),
+                  'y': int(position[1]), 'value': float(value), 'fname': fname, 'started': started,
+                  'completed': completed}
+        if correction:
+            record['correction'] = True
+        self._append(record)
+        self.records.append(record)
+
+    def restore(self, values):
+        """
+        Rebuilds the values measured so far. Later records of a point (corrections) replace the earlier ones.
+
+        :param values: Numpy array of values, updated in place.
+        :return: Boolean numpy array of the points measured, highest value and its filename (-1 and '' if no point
+                 was measured).
+        """
+        measured = np.zeros(values.shape, dtype=bool)
+        latest = {}
+        for record in self.records:
+            values[record['row'], record['col']] = record['value']
+            measured[record['row'], record['col']] = True
+            latest[record['row'], record['col']] = record
+        curr_max, max_filename = -1, ''
+        for record in latest.values():
+            if record['value'] > curr_max:
+                curr_max, max_filename = record['value'], record['fname']
+        return measured, curr_max, max_filename
+
+    def record_failure(self, error):
+        """
+        Records the error that stopped the scan. The scan is not marked complete, so it can still be resumed.
+
+        :param error: Exception that stopped the scan (e.g. MotorTimeoutError).
+        :return: Nothing.
+        """
+        self._append({'failed': time.time(), 'error': str(error)})
+
+    def finish(self):
+        """
+        Marks the scan complete, so it is not offered for resuming.
+
+        :return: Nothing.
+        """
+        self._append({'complete': time.time()})
+        self.complete = True
+
+    def close(self):
+        """
+        Closes the journal file.
+
+        :return: Nothing.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _append(self, entry):
+        """
+        Appends a line to the journal file, flushed and synced to disk.
+
+        :param entry: Dictionary written as a JSON line.
+        :return: Nothing.
+        """
+        if self._file is None:
+            complete_line = True
+            if os.path.exists(self.filename) and os.path.getsize(self.filename):
+                with open(self.filename, 'rb') as journal_file:
+                    journal_file.seek(-1, os.SEEK_END)
+                    complete_line = journal_file.read(1) == b'\n'
+            self._file = open(self.filename, 'a')
+            if not complete_line:
+                self._file.write('\n')  # Terminates a line truncated by a crash
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
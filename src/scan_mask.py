@@ -0,0 +1,93 @@
+"""
+Scan Mask
+
+This module converts the region of interest of an area scan (e.g. the outline of the device, entered in the GUI) into
+the boolean array of the grid points to measure. It only depends on NumPy, so it can be tested without the GUI and the
+NARDA automation.
+
+The module has the following functions:
+    - scan_mask(): converts a region of interest into the grid points to measure.
+    - polygon_mask(): grid points inside a polygon.
+    - parse_polygon(): parses the vertices of a polygon entered as text.
+"""
+
+import numpy as np
+
+
+def scan_mask(roi, x_points, y_points, grid_step_dist):
+    """
+    Converts a region of interest into the boolean array of the grid points to measure.
+
+    :param roi: Boolean numpy array of the grid points to measure (x_points rows, y_points columns), or polygon given as
+                a sequence of (x, y) vertices in cm (see polygon_mask()). None for the whole area.
+    :param x_points: Number of grid rows.
+    :param y_points: Number of grid columns.
+    :param grid_step_dist: Distance between grid points (in cm).
+    :return: Boolean numpy array of the grid points to measure, None for the whole area.
+    :raises ValueError: If the array does not match the grid or the polygon is invalid.
+    """
+    if roi is None:
+        return None
+    roi = np.asarray(roi)
+    if roi.dtype == bool:
+        if roi.shape != (x_points, y_points):
+            raise ValueError("Scan mask of shape %s does not match the %dx%d grid" % (roi.shape, x_points, y_points))
+        return roi.copy()
+    return polygon_mask(roi, x_points, y_points, grid_step_dist)
+
+
+def polygon_mask(polygon, x_points, y_points, grid_step_dist):
+    """
+    Computes the grid points inside a polygon (e.g. the outline of the device). Coordinates are in cm from the first
+    grid point, along the GUI's distances: x along the grid rows ('X Distance', x_points), y along the grid columns
+    ('Y Distance', y_points). Points on the outline are inside.
+
+    :param polygon: Sequence of (x, y) vertices in cm, at least 3. The polygon is closed automatically.
+    :param x_points: Number of grid rows.
+    :param y_points: Number of grid columns.
+    :param grid_step_dist: Distance between grid points (in cm).
+    :return: Boolean numpy array of the grid points inside the polygon.
+    :raises ValueError: If the polygon has fewer than 3 vertices.
+    """
+    vertices = np.asarray(polygon, dtype=float).reshape(-1, 2)
+    if len(vertices) < 3:
+        raise ValueError("The region of interest polygon needs at least 3 vertices")
+    rows, cols = np.mgrid[0:x_points, 0:y_points]
+    x, y = rows * grid_step_dist, cols * grid_step_dist
+    tolerance = 1e-6 * max(grid_step_dist, 1.0)
+    inside = np.zeros(x.shape, dtype=bool)
+    on_outline = np.zeros(x.shape, dtype=bool)
+    for (x0, y0), (x1, y1) in zip(vertices, np.roll(vertices, -1, axis=0)):
+        # Even-odd rule: a point is inside if a ray cast from it along +x crosses the outline an odd number of times
+        crosses = (y0 > y) != (y1 > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_cross = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+        inside ^= crosses & (x < x_cross)
+        # Distance from each point to the edge
+        length = (x1 - x0) ** 2 + (y1 - y0) ** 2
+        t = np.clip(((x - x0) * (x1 - x0) + (y - y0) * (y1 - y0)) / max(length, tolerance ** 2), 0.0, 1.0)
+        on_outline |= np.hypot(x0 + t * (x1 - x0) - x, y0 + t * (y1 - y0) - y) <= tolerance
+    return inside | on_outline
+
+
+def parse_polygon(text):
+    """
+    Parses the vertices of a region of interest polygon entered as text, e.g. '0,0; 5,0; 5,12; 0,12'.
+
+    :param text: Vertices as 'x,y' pairs (in cm) separated by semicolons. Blank for no region of interest.
+    :return: List of (x, y) tuples, None if the text is blank.
+    :raises ValueError: If a vertex is not a pair of numbers or there are fewer than 3 vertices.
+    """
+    if not text.strip():
+        return None
+    vertices = []
+    for vertex in text.split(';'):
+        if not vertex.strip():
+            continue
+        coordinates = vertex.split(',')
+        if len(coordinates) != 2:
+            raise ValueError("Invalid polygon vertex: '%s'" % vertex.strip())
+        vertices.append((float(coordinates[0]), float(coordinates[1])))
+    if len(vertices) < 3:
+        raise ValueError("The region of interest polygon needs at least 3 vertices")
+    return vertices
@@ -0,0 +1,136 @@
+"""
+Settle Detector
+
+This module ends the dwell at a scan point as soon as the NARDA reading has stabilized, instead of always waiting the
+full dwell time. After the trace is reset, the max-hold trace rises while the readings at the point come in and stops
+changing once it has settled. The NARDA reading is only available through its window, so the detector samples images
+of the window at short intervals: the reading is stable while fewer than a tolerance fraction of the pixels differ
+from the sample taken when it became stable, and the dwell ends when it has stayed stable for a set window. The
+stable window only starts once a change has been seen after the reset, since a reading that has not changed yet may
+simply not have been redrawn (e.g. during the first sweep). The dwell time remains the upper bound.
+
+The whole window also holds widgets that change all the time (live trace, status bar), so the comparison should be
+limited to the readout or max-hold plot area: the region is set in the GUI ('Settle Region', saved with the
+configuration) as the pixel box of that area in the window image.
+
+The module contains a single class:
+    - SettleDetector(): waits for the reading to stabilize, up to the dwell time.
+
+And the following functions:
+    - changed_fraction(): fraction of the pixels that differ between two images.
+    - parse_region(): parses a region entered as text.
+"""
+
+import time
+import numpy as np
+
+
+class SettleDetector:
+    """
+    Waits for the NARDA reading to stabilize, up to the dwell time.
+
+        Attributes:
+            window: Time the reading must stay stable (in seconds).
+            interval: Time between samples (in seconds).
+            tolerance: Largest fraction of the pixels that may change while the reading is stable.
+            min_dwell: Shortest dwell (in seconds), e.g. for the first sweep of the trace.
+            region: Box (left, top, right, bottom) of the window image compared, None for the whole image.
+            dwell_times: List of the dwell times used, one per measurement.
+    """
+    def __init__(self, window=1.0, interval=0.2, tolerance=0.001, min_dwell=0.5, region=None):
+        """
+        :param window: Time the reading must stay stable (in seconds).
+        :param interval: Time between samples (in seconds).
+        :param tolerance: Largest fraction of the pixels that may change while the reading is stable.
+        :param min_dwell: Shortest dwell (in seconds).
+        :param region: Box (left, top, right, bottom) of the window image compared (e.g. the plot), None for the
+                       whole image.
+        """
+        self.window = window
+        self.interval = interval
+        self.tolerance = tolerance
+        self.min_dwell = min_dwell
+        self.region = region
+        self.dwell_times = []
+
+    def wait(self, sample, dwell_time):
+        """
+        Samples the reading until it has been stable for the window after changing at least once, or until the dwell
+        time has elapsed. A reading that never changes is waited on for the whole dwell time.
+
+        :param sample: Function returning an image of the reading (PIL image or numpy array).
+        :param dwell_time: Longest dwell (in seconds).
+        :return: Time waited (in seconds).
+        """
+        start = time.time()
+        reference = self.crop(sample())  # Sample at the start of the stable period, so slow drifts add up
+        stable_since = start
+        changed = False  # The reading has changed since the reset, so the new readings are being drawn
+        while True:
+            elapsed = time.time() - start
+            if elapsed >= dwell_time:
+                break
+            if changed and elapsed >= self.min_dwell and time.time() - stable_since >= self.window:
+                break
+            time.sleep(max(0.0, min(self.interval, dwell_time - elapsed)))
+            current = self.crop(sample())
+            if changed_fraction(reference, current) > self.tolerance:
+                reference, stable_since, changed = current, time.time(), True
+        waited = time.time() - start
+        self.dwell_times.append(waited)
+        return waited
+
+    def crop(self, image):
+        """
+        :param image: PIL image or numpy array.
+        :return: Numpy array of the compared region of the image.
+        """
+        pixels = np.asarray(image)
+        if self.region is not None:
+            left, top, right, bottom = self.region
+            pixels = pixels[top:bottom, left:right]
+        return pixels
+
+    def summary(self):
+        """
+        :return: Description of the dwell times used so far.
+        """
+        if not self.dwell_times:
+            return "Settle detection: no measurement taken"
+        return "Settle detection: mean dwell %.2f s (%.2f s - %.2f s) over %d measurement(s)" % \
+               (np.mean(self.dwell_times), min(self.dwell_times), max(self.dwell_times), len(self.dwell_times))
+
+
+def changed_fraction(a, b):
+    """
+    Computes the fraction of the pixels that differ between two images.
+
+    :param a: Numpy array of an image.
+    :param b: Numpy array of an image (same shape as a).
+    :return: Fraction of the pixels that differ (1.0 if the shapes differ, e.g. the window was resized).
+    """
+    if a.shape != b.shape:
+        return 1.0
+    diff = a != b
+    if diff.ndim == 3:
+        diff = diff.any(axis=2)  # A pixel changed if any of its channels changed
+    return float(diff.mean()) if diff.size else 0.0
+
+
+def parse_region(text):
+    """
+    Parses the region of the window image compared by the detector, entered as text, e.g. '40, 120, 640, 420'.
+
+    :param text: Pixel box 'left, top, right, bottom' of the window image. Blank for the whole image.
+    :return: Tuple (left, top, right, bottom), None if the text is blank.
+    :raises ValueError: If the text is not 4 integers or the box is empty.
+    """
+    if not text.strip():
+        return None
+    values = [value for value in text.replace(';', ',').split(',') if value.strip()]
+    if len(values) != 4:
+        raise ValueError("The settle region needs 4 values (left, top, right, bottom), got '%s'" % text.strip())
+    left, top, right, bottom = [int(value) for value in values]
+    if left < 0 or top < 0 or right <= left or bottom <= top:
+        raise ValueError("The settle region (%d, %d, %d, %d) is empty" % (left, top, right, bottom))
+    return left, top, right, bottom
@@ -0,0 +1,130 @@
+"""
+Scan Stop Policy
+
+This module contains the stopping rules of area scans. Many scans are only run to locate the highest value (e.g. for a
+follow-up zoom scan), so the scan can stop as soon as:
+    - the points not measured yet cannot plausibly exceed the highest value measured so far, or
+    - a budget of measurements or of scan time has been used up.
+
+Whether the remaining points can exceed the maximum is decided with a slope (Lipschitz) bound: the steepest change
+measured between neighbouring grid points, scaled by a safety margin, bounds how much the field can rise between a
+measured point and a point not measured yet. The slope is measured along rows and columns, so the distances are
+counted in row and column steps (Manhattan distance): a diagonal step may rise by the slope along both axes. A point
+cannot exceed the maximum if its bound, taken from the measured point that constrains it the most, stays below the
+maximum.
+
+The module contains a single class:
+    - ScanStopPolicy(): stopping rules checked by run_scan() after every measurement.
+
+And the following functions:
+    - max_slope(): steepest change between measured neighbouring grid points.
+    - upper_bounds(): highest values the points not measured yet could take.
+"""
+
+import time
+import numpy as np
+
+
+class ScanStopPolicy:
+    """
+    Stopping rules of an area scan. Every rule is optional; the scan stops as soon as one of them is met.
+
+        Attributes:
+            max_points: Largest number of measurements, None for no limit.
+            max_time: Largest scan time (in seconds, from the first measurement), None for no limit.
+            peak_bound: Stop once no point left can exceed the highest value measured (see upper_bounds()).
+            slope_margin: Safety factor applied to the steepest measured slope.
+            min_points: Number of measurements taken before the peak bound is checked.
+            reason: Description of the rule that stopped the scan, None while the scan runs.
+    """
+    def __init__(self, max_points=None, max_time=None, peak_bound=True, slope_margin=1.5, min_points=9):
+        """
+        :param max_points: Largest number of measurements, None for no limit.
+        :param max_time: Largest scan time (in seconds), None for no limit.
+        :param peak_bound: Stop once no point left can exceed the highest value measured.
+        :param slope_margin: Safety factor applied to the steepest measured slope (larger is more conservative).
+        :param min_points: Number of measurements taken before the peak bound is checked.
+        """
+        self.max_points = max_points
+        self.max_time = max_time
+        self.peak_bound = peak_bound
+        self.slope_margin = slope_margin
+        self.min_points = min_points
+        self.reason = None
+        self.start_time = None
+
+    def start(self):
+        """
+        Starts the scan time and clears the reason of a previous stop.
+
+        :return: Nothing.
+        """
+        self.start_time = time.time()
+        self.reason = None
+
+    def should_stop(self, values, measured, remaining):
+        """
+        Checks the stopping rules after a measurement.
+
+        :param values: Numpy array of the values.
+        :param measured: Boolean numpy array of the points measured so far by the scan.
+        :param remaining: Integer numpy array of the (row, col) of the points left to measure.
+        :return: True if the scan should stop (the rule met is described in self.reason).
+        """
+        if not len(remaining):
+            return False
+        count = int(measured.sum())
+        if self.max_points is not None and count >= self.max_points:
+            self.reason = "measurement budget of %d point(s) used up" % self.max_points
+        elif self.max_time is not None and self.start_time is not None and \
+                time.time() - self.start_time >= self.max_time:
+            self.reason = "time budget of %g s used up" % self.max_time
+        elif self.peak_bound and count >= self.min_points:
+            slope = max_slope(values, measured)
+            if slope is None:
+                return False
+            curr_max = np.max(values[measured])
+            if np.all(upper_bounds(values, measured, remaining, self.slope_margin * slope) < curr_max):
+                self.reason = "%d point(s) left cannot exceed the maximum of %f" % (len(remaining), curr_max)
+        return self.reason is not None
+
+
+def max_slope(values, measured):
+    """
+    Computes the steepest change between measured neighbouring grid points (along rows and columns).
+
+    :param values: Numpy array of the values.
+    :param measured: Boolean numpy array of the points measured.
+    :return: Largest absolute difference per grid step, None if no two neighbouring points were measured.
+    """
+    slopes = []
+    for axis in (0, 1):
+        pairs = np.logical_and(np.take(measured, range(1, measured.shape[axis]), axis=axis),
+                               np.take(measured, range(0, measured.shape[axis] - 1), axis=axis))
+        if pairs.any():
+            slopes.append(np.abs(np.diff(values, axis=axis))[pairs].max())
+    return max(slopes) if slopes else None
+
+
+def upper_bounds(values, measured, points, slope, chunk=256):
+    """
+    Computes the highest values the points not measured yet could take: the value of each measured point plus the
+    slope times its Manhattan distance (in row and column steps, the slope being measured along them), minimized over
+    the measured points.
+
+    :param values: Numpy array of the values.
+    :param measured: Boolean numpy array of the points measured.
+    :param points: Integer numpy array of the (row, col) of the points to bound.
+    :param slope: Largest change per grid step.
+    :param chunk: Number of points bounded at once (limits the memory used).
+    :return: Numpy array of the bounds, one per point.
+    """
+    known = np.column_stack(np.nonzero(measured)).astype(float)
+    known_values = values[measured]
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    bounds = np.empty(len(points))
+    for i in range(0, len(points), chunk):
+        block = points[i:i + chunk]
+        distances = np.abs(block[:, None, 0] - known[None, :, 0]) + np.abs(block[:, None, 1] - known[None, :, 1])
+        bounds[i:i + chunk] = np.min(known_values[None, :] + slope * distances, axis=1)
+    return bounds
@@ -0,0 +1,291 @@
+"""
+Surrogate Peak Search
+
+This module locates the hotspot of a field (its position and value) with far fewer measurements than a dense grid
+scan. A Gaussian process surrogate is fitted to the points measured so far, and the next point measured is the grid
+point with the highest expected improvement over the current maximum per second of probe time (travel from the current
+position plus the measurement itself). The search stops when no point is expected to improve the maximum noticeably,
+or when its measurement budget is used up.
+
+The search only works on grid coordinates and calls back to take measurements, so it runs the same way on the XY
+positioner (see run_peak_search() in 'area_scan.py') and offline against synthetic field maps (see search_field()).
+
+The module has the following classes:
+    - GaussianProcess(): Gaussian process regression with a squared exponential kernel, in NumPy.
+    - SurrogateSearch(): model-guided peak search over a grid.
+
+And the following functions:
+    - expected_improvement(): expected improvement of candidate points over the current maximum.
+    - search_field(): runs a search against a field map (numpy array of values), for offline tests.
+"""
+
+import math
+import time
+import numpy as np
+
+_erf = np.vectorize(math.erf, otypes=[float])
+
+
+class GaussianProcess:
+    """
+    Gaussian process regression with a squared exponential kernel. Values are normalized to zero mean and unit
+    variance before fitting. The length scale is selected among candidates by maximizing the marginal likelihood.
+
+        Attributes:
+            length_scales: Candidate length scales (in grid steps).
+            noise: Variance of the measurement noise, relative to the variance of the values.
+            length_scale: Length scale selected by the last fit.
+    """
+    def __init__(self, length_scales=(1.0, 1.5, 2.0, 3.0, 4.0, 6.0, 8.0), noise=1e-4):
+        """
+        :param length_scales: Candidate length scales (in grid steps).
+        :param noise: Variance of the measurement noise, relative to the variance of the values.
+        """
+        self.length_scales = tuple(length_scales)
+        self.noise = noise
+        self.length_scale = None
+        self._points = None
+        self._mean = 0.0
+        self._scale = 1.0
+        self._chol = None
+        self._alpha = None
+
+    def fit(self, points, values):
+        """
+        Fits the model to the measured points.
+
+        :param points: Array of points (N, 2), in grid coordinates (row, col).
+        :param values: Array of the N measured values.
+        :return: Nothing.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        values = np.asarray(values, dtype=float)
+        self._mean = values.mean()
+        self._scale = values.std() or 1.0
+        y = (values - self._mean) / self._scale
+        squared = np.sum((points[:, None, :] - points[None, :, :]) ** 2, axis=-1)
+        best = None
+        for length_scale in self.length_scales:
+            kernel = np.exp(-squared / (2 * length_scale ** 2)) + self.noise * np.eye(len(points))
+            try:
+                chol = np.linalg.cholesky(kernel)
+            except np.linalg.LinAlgError:
+                continue
+            alpha = np.linalg.solve(chol.T, np.linalg.solve(chol, y))
+            likelihood = -0.5 * y.dot(alpha) - np.sum(np.log(np.diag(chol)))
+            if best is None or likelihood > best[0]:
+                best = (likelihood, length_scale, chol, alpha)
+        if best is None:
+            raise np.linalg.LinAlgError("Gaussian process kernel is not positive definite")
+        _, self.length_scale, self._chol, self._alpha = best
+        self._points = points
+
+    def predict(self, points):
+        """
+        Predicts the values at new points.
+
+        :param points: Array of points (M, 2), in grid coordinates (row, col).
+        :return: Arrays of the predicted mean and standard deviation at each point.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        squared = np.sum((points[:, None, :] - self._points[None, :, :]) ** 2, axis=-1)
+        cross = np.exp(-squared / (2 * self.length_scale ** 2))
+        mean = cross.dot(self._alpha)
+        v = np.linalg.solve(self._chol, cross.T)
+        variance = np.maximum(1.0 - np.sum(v ** 2, axis=0), 1e-12)
+        return self._mean + self._scale * mean, self._scale * np.sqrt(variance)
+
+
+class SurrogateSearch:
+    """
+    Model-guided peak search over a grid. Starts with a coarse space-filling design, then repeatedly measures the grid
+    point with the highest expected improvement per second of probe time.
+
+        Attributes:
+            shape: Shape (rows, cols) of the grid.
+            mask: Boolean numpy array of the grid points that may be measured (e.g. a region of interest).
+            values: Numpy array of the measured values (NaN where not measured).
+            measured: Boolean numpy array of the points measured.
+            path: List of the (row, col) measured, in order.
+            max_points: Largest number of measurements.
+            tolerance: The search stops when the highest expected improvement is below this fraction of the range of
+                       the measured values.
+    """
+    def __init__(self, shape, mask=None, travel_time=None, measurement_time=1.0, initial_spacing=8, max_points=None,
+                 tolerance=1e-4, model=None):
+        """
+        :param shape: Shape (rows, cols) of the grid.
+        :param mask: Boolean numpy array of the grid points that may be measured (all points if not given).
+        :param travel_time: Function computing the travel times (in seconds) between a grid point and an array of
+                            grid points (row, col). Travel is not taken into account if not given.
+        :param measurement_time: Time taken by a measurement (in seconds), added to the travel time of every point.
+        :param initial_spacing: Largest distance between the points of the initial space-filling design (in grid
+                                steps). Hotspots much narrower than this may be missed.
+        :param max_points: Largest number of measurements (a quarter of the points, at least 10, if not given).
+        :param tolerance: Stopping threshold on the expected improvement, as a fraction of the measured value range.
+        :param model: Surrogate model with fit() and predict() methods (GaussianProcess() if not given).
+        """
+        self.shape = tuple(shape)
+        self.mask = np.ones(self.shape, dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+        self.travel_time = travel_time
+        self.measurement_time = measurement_time
+        self.initial_spacing = initial_spacing
+        if max_points is None:
+            max_points = max(10, self.mask.sum() // 4)
+        self.max_points = min(max_points, int(self.mask.sum()))
+        self.tolerance = tolerance
+        self.model = GaussianProcess() if model is None else model
+        self.values = np.full(self.shape, np.nan)
+        self.measured = np.zeros(self.shape, dtype=bool)
+        self.path = []
+        self.reason = None  # Why the search stopped
+
+    def initial_design(self):
+        """
+        Lists the points of the initial space-filling design: a coarse lattice spanning the grid, swept in serpentine
+        order. Lattice points outside the mask are replaced by the closest point inside it.
+
+        :return: List of (row, col) tuples.
+        """
+        rows, cols = [np.unique(np.round(np.linspace(0, size - 1, max(2, int(np.ceil((size - 1) /
+                                                                                  float(self.initial_spacing))) + 1)))
+                                .astype(int)) for size in self.shape]
+        inside = np.column_stack(np.nonzero(self.mask))
+        design = []
+        for i, row in enumerate(rows):
+            for col in (cols if i % 2 == 0 else cols[::-1]):
+                nearest = inside[np.argmin(np.sum((inside - (row, col)) ** 2, axis=1))]
+                if tuple(nearest) not in design:
+                    design.append(tuple(int(k) for k in nearest))
+        return design[:self.max_points]
+
+    def observe(self, row, col, value):
+        """
+        Records a measurement.
+
+        :param row: Row of the point measured.
+        :param col: Column of the point measured.
+        :param value: Measured value.
+        :return: Nothing.
+        """
+        self.values[row, col] = value
+        self.measured[row, col] = True
+        self.path.append((row, col))
+
+    def predict(self):
+        """
+        Fits the surrogate to the measurements and predicts every grid point.
+
+        :return: Numpy arrays of the predicted mean and standard deviation (grid shaped, NaN outside the mask).
+        """
+        self.model.fit(np.column_stack(np.nonzero(self.measured)), self.values[self.measured])
+        inside = np.column_stack(np.nonzero(self.mask))
+        mean, std = np.full(self.shape, np.nan), np.full(self.shape, np.nan)
+        mean[self.mask], std[self.mask] = self.model.predict(inside)
+        return mean, std
+
+    def next_point(self):
+        """
+        Selects the next point to measure: the highest expected improvement per second of probe time.
+
+        :return: (row, col) tuple, None if the search should stop (see self.reason).
+        """
+        if self.measured.sum() >= self.max_points:
+            self.reason = "measurement budget of %d point(s) used up" % self.max_points
+            return None
+        candidates = np.column_stack(np.nonzero(self.mask & ~self.measured))
+        if not len(candidates):
+            self.reason = "every point measured"
+            return None
+        mean, std = self.predict()
+        best = np.nanmax(self.values)
+        spread = best - np.nanmin(self.values)
+        improvement = expected_improvement(mean[tuple(candidates.T)], std[tuple(candidates.T)], best,
+                                           0.01 * spread)
+        if improvement.max() < self.tolerance * spread:
+            self.reason = "expected improvement below %g of the value range" % self.tolerance
+            return None
+        cost = np.full(len(candidates), float(self.measurement_time))
+        if self.travel_time is not None and self.path:
+            cost += self.travel_time(self.path[-1], candidates)
+        choice = candidates[np.argmax(improvement / np.maximum(cost, 1e-3))]
+        return int(choice[0]), int(choice[1])
+
+    def run(self, measure, logger=None):
+        """
+        Runs the search: measures the initial design, then the points selected by next_point() until it stops.
+
+        :param measure: Function taking a measurement at a grid point: measure(row, col) -> value.
+        :param logger: Logger for progress messages (optional).
+        :return: Nothing.
+        """
+        for row, col in self.initial_design():
+            self.observe(row, col, measure(row, col))
+        while True:
+            point = self.next_point()
+            if point is None:
+                break
+            self.observe(point[0], point[1], measure(*point))
+        message = "Peak search stopped after %d point(s): %s" % (len(self.path), self.reason)
+        print(message)
+        if logger is not None:
+            logger.info(message)
+
+    def peak(self):
+        """
+        :return: Row, column and value of the highest measurement.
+        """
+        row, col = np.unravel_index(np.nanargmax(self.values), self.shape)
+        return int(row), int(col), self.values[row, col]
+
+    def estimate(self):
+        """
+        Fills the points not measured with the surrogate prediction.
+
+        :return: Numpy array of the measured values, predicted where not measured (NaN outside the mask).
+        """
+        mean, _ = self.predict()
+        return np.where(self.measured, self.values, mean)
+
+
+def expected_improvement(mean, std, best, xi=0.0):
+    """
+    Computes the expected improvement of candidate points over the current maximum.
+
+    :param mean: Array of predicted means.
+    :param std: Array of predicted standard deviations.
+    :param best: Highest value measured so far.
+    :param xi: Margin required for an improvement (favours exploration).
+    :return: Array of expected improvements (the plain gain where the standard deviation is zero).
+    """
+    gain = np.asarray(mean, dtype=float) - best - xi
+    std = np.broadcast_to(np.asarray(std, dtype=float), gain.shape)
+    certain = ~(std > 0)
+    safe_std = np.where(certain, 1.0, std)  # Avoids dividing by zero, those points are overwritten below
+    z = gain / safe_std
+    cdf = 0.5 * (1.0 + _erf(z / math.sqrt(2.0)))
+    pdf = np.exp(-0.5 * z ** 2) / math.sqrt(2.0 * math.pi)
+    improvement = np.where(certain, gain, gain * cdf + safe_std * pdf)
+    return np.maximum(improvement, 0.0)
+
+
+def search_field(field, velocity=None, **kwargs):
+    """
+    Runs a peak search against a field map, e.g. a synthetic field or the values of an earlier dense scan.
+
+    :param field: Numpy array of the field values at every grid point (NaN outside the region of interest).
+    :param velocity: Probe speed (in grid steps per second) used for the travel times, None to ignore travel.
+    :param kwargs: Keyword arguments passed to the SurrogateSearch constructor.
+    :return: SurrogateSearch after the search, with the time the search took (in seconds) in its 'elapsed' attribute.
+    """
+    field = np.asarray(field, dtype=float)
+    kwargs.setdefault('mask', ~np.isnan(field))
+    travel_time = None
+    if velocity:
+        def travel_time(a, b):
+            return np.max(np.abs(np.asarray(b) - np.asarray(a)), axis=-1) / float(velocity)
+    search = SurrogateSearch(field.shape, travel_time=travel_time, **kwargs)
+    start_time = time.time()
+    search.run(lambda row, col: field[row, col])
+    search.elapsed = time.time() - start_time
+    return search
@@ -0,0 +1,99 @@
+"""
+Tests of 'motor_driver.py' against the C4 emulator of 'c4_emulator.py', connected through a pty (POSIX only). Run with
+'python -m pytest tests' from the repository root.
+"""
+
+import os
+import time
+import pytest
+
+if os.name != 'posix':
+    pytest.skip("the C4 emulator needs a pty", allow_module_level=True)
+
+from src.c4_emulator import C4Emulator  # noqa: E402
+from src.motor_driver import MotorDriver, MotorSession, MotorTimeoutError, load_controller_state, \
+    probe_port  # noqa: E402
+
+HOME = (3788, 4300)
+
+
+@pytest.fixture
+def emulator(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # The driver saves its state to 'motor_state.txt' in the working directory
+    emulator = C4Emulator(step_rate=20000, baudrate=0)
+    emulator.start()
+    yield emulator
+    emulator.stop()
+
+
+@pytest.fixture
+def motor(emulator):
+    motor = MotorDriver(port_name=emulator.port_name, home=HOME, timeout_margin=1.0)
+    yield motor
+    motor.destroy()
+
+
+def test_probe(emulator):
+    assert probe_port(emulator.port_name)
+    assert emulator.log[-1][1] == '!1fp'
+
+
+def test_two_axis_move(emulator, motor):
+    motor.move(400, -250)
+    assert emulator.log[-1][1] == '!1m1r400,2f250n'
+    assert motor.position == [400, -250]
+    assert emulator.position == [400, -250]
+    motor.move_to(100, 100)
+    assert motor.position == [100, 100]
+    assert emulator.position == [100, 100]
+
+
+def test_homing(emulator, motor):
+    motor.home_motors(full=True)
+    commands = [command for _, command in emulator.log]
+    assert commands[-3:] == ['!1wh1,r,%d' % HOME[0], '!1wh2,r,%d' % HOME[1], '!1h12']
+    assert motor.position == [0, 0]
+    assert motor.position_known
+    assert emulator.position == list(HOME)
+
+
+def test_position_saved_on_close(emulator):
+    motor = MotorDriver(port_name=emulator.port_name, home=HOME)
+    assert load_controller_state(emulator.port_name)['position_valid'] is False
+    motor.home_motors(full=True)
+    motor.move(40, 30)
+    motor.destroy()
+    state = load_controller_state(emulator.port_name)
+    assert state['position_valid'] and state['position'] == [40, 30]
+
+
+def test_lost_completion_times_out(emulator, motor):
+    emulator.drop_completions = 1.0
+    motor.position_known = True
+    with pytest.raises(MotorTimeoutError):
+        motor.move(100, 0)
+    assert not motor.position_known
+    assert motor.trace.summary()['timeouts'] == 1
+
+
+def test_motion_queues_of_two_controllers(emulator):
+    # Moves of 2000 steps take 0.4 s at 5000 steps/s: the queues of two controllers run side by side, the jobs of each
+    # controller one after the other
+    other = C4Emulator(step_rate=5000, baudrate=0)
+    other.start()
+    emulator.velocity = [5000.0, 5000.0]
+    try:
+        started = time.time()
+        first = [MotorSession.submit(port_name, MotorDriver.move, 2000, 0)
+                 for port_name in (emulator.port_name, other.port_name)]
+        second = MotorSession.submit(emulator.port_name, MotorDriver.move_to, 0, 0)
+        for future in first:
+            future.result()
+        both = time.time() - started
+        second.result()
+        assert both < 0.7
+        assert time.time() - started >= 0.8
+        assert emulator.position == [0, 0] and other.position == [2000, 0]
+    finally:
+        MotorSession.close()
+        other.stop()
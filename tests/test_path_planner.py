@@ -0,0 +1,50 @@
+"""
+Tests of the travel time ordering of 'path_planner.py'. Run with 'python -m pytest tests' from the repository root.
+"""
+
+import numpy as np
+import pytest
+from src.path_planner import TravelTimeModel, nearest_neighbour_order, path_time, plan_path, sweep_order
+from src.positioning import round_steps
+
+MODELS = [TravelTimeModel(2000, 4000), TravelTimeModel(800, 1500, overhead=0.05),
+          TravelTimeModel(1000, simultaneous=False)]
+
+
+@pytest.mark.parametrize('model', MODELS)
+@pytest.mark.parametrize('seed', range(5))
+def test_plan_path_never_slower_than_nearest_neighbour(model, seed):
+    points = np.random.RandomState(seed).randint(-5000, 5000, size=(40, 2))
+    for start in (None, (0, 0)):
+        order = plan_path(points, model, start=start)
+        assert sorted(order) == list(range(len(points)))
+        greedy = nearest_neighbour_order(points, model, start)
+        assert path_time(points, order, model, start) <= path_time(points, greedy, model, start) + 1e-9
+
+
+def test_plan_path_fixed_first():
+    points = np.random.RandomState(0).randint(0, 3000, size=(20, 2))
+    initial = np.arange(len(points))[::-1]
+    order = plan_path(points, MODELS[0], start=(0, 0), order=initial, fixed_first=True)
+    assert order[0] == initial[0]
+    assert sorted(order) == list(range(len(points)))
+
+
+@pytest.mark.parametrize('overhead', [0.0, 0.004])
+def test_plan_path_keeps_the_serpentine_of_a_grid(overhead):
+    # 2 cm grid steps are 393.70... motor steps: the rounding of the targets must not break the serpentine
+    model = TravelTimeModel(800, 1500, overhead=overhead)
+    grid = np.arange(100).reshape(10, 10)
+    grid[1::2] = grid[1::2, ::-1]
+    rows, cols = np.nonzero(grid >= 0)
+    points = np.column_stack([round_steps(393.7007874015748, cols), round_steps(393.7007874015748, rows)])
+    serpentine = np.argsort(grid[rows, cols])
+    order = plan_path(points, model, order=serpentine, fixed_first=True)
+    assert list(order) == list(serpentine)
+
+
+def test_plan_path_large_sets_use_the_sweep_order():
+    points = np.random.RandomState(1).randint(0, 100, size=(50, 2))
+    order = plan_path(points, MODELS[0], max_points=10)
+    assert list(order) == list(sweep_order(points))
+    assert len(plan_path(np.zeros((0, 2)), MODELS[0])) == 0
@@ -0,0 +1,40 @@
+"""
+Tests of the exact step arithmetic of 'positioning.py'. Run with 'python -m pytest tests' from the repository root.
+"""
+
+from fractions import Fraction
+import numpy as np
+from src.positioning import distance_to_steps, exact_steps, round_steps, step_ratio
+
+
+def test_exact_steps():
+    assert exact_steps(393.7007874015748) == Fraction(50000, 127)
+    assert step_ratio(2, 0.00508) == Fraction(50000, 127)
+    assert exact_steps(Fraction(1, 3)) == Fraction(1, 3)
+
+
+def test_cumulative_error_stays_below_half_a_step():
+    # Every point of a long serpentine is rounded from its exact position, so the error never accumulates
+    num_steps = step_ratio(2, 0.00508)
+    counts = np.arange(-10000, 10001)
+    steps = round_steps(393.7007874015748, counts)
+    errors = [abs(int(s) - k * num_steps) for s, k in zip(steps, counts)]
+    assert max(errors) <= Fraction(1, 2)
+    serpentine = np.concatenate([np.arange(50), np.arange(50)[::-1]] * 100)
+    assert np.all(round_steps(num_steps, serpentine) == round_steps(num_steps, np.arange(50))[serpentine])
+
+
+def test_halves_round_up():
+    assert round_steps(Fraction(1, 2), 1) == 1
+    assert round_steps(2.5, 1) == 3
+    assert round_steps(Fraction(1, 2), -1) == 0
+    assert round_steps(2.5, -1) == -2
+    assert list(round_steps(Fraction(1, 2), np.array([-3, -1, 1, 3]))) == [-1, 0, 1, 2]
+
+
+def test_round_steps_scalar_and_array():
+    assert isinstance(round_steps(393.7007874015748, 3), int)
+    assert round_steps(393.7007874015748, 3) == 1181
+    steps = round_steps(393.7007874015748, np.arange(4).reshape(2, 2))
+    assert steps.shape == (2, 2) and steps.dtype == np.int64
+    assert distance_to_steps(-2, 0.00508) == -394
@@ -0,0 +1,36 @@
+"""
+Tests of the region of interest masks of 'scan_mask.py'. Run with 'python -m pytest tests' from the repository root.
+"""
+
+import numpy as np
+import pytest
+from src.scan_mask import parse_polygon, polygon_mask, scan_mask
+
+
+def test_polygon_mask_non_square_grid():
+    # X Distance = 4 cm, Y Distance = 1 cm, 1 cm grid steps: 5 rows (x_points) by 2 columns (y_points)
+    mask = polygon_mask([(0, 0), (4, 0), (4, 1), (0, 1)], 5, 2, 1.0)
+    assert mask.shape == (5, 2)
+    assert mask.all()
+
+
+def test_polygon_mask_x_along_rows():
+    # Outline covering only the first 2 cm of X Distance keeps the first 3 rows, every column
+    mask = polygon_mask([(0, 0), (2, 0), (2, 1), (0, 1)], 5, 2, 1.0)
+    expected = np.zeros((5, 2), dtype=bool)
+    expected[:3] = True
+    assert (mask == expected).all()
+
+
+def test_scan_mask_polygon_matches_grid_shape():
+    assert scan_mask([(0, 0), (4, 0), (4, 1)], 5, 2, 1.0).shape == (5, 2)
+    assert scan_mask(None, 5, 2, 1.0) is None
+
+
+def test_parse_polygon():
+    assert parse_polygon(' 0,0; 4,0; 4,1 ;') == [(0.0, 0.0), (4.0, 0.0), (4.0, 1.0)]
+    assert parse_polygon('  ') is None
+    with pytest.raises(ValueError):
+        parse_polygon('0,0; 4,0')
+    with pytest.raises(ValueError):
+        parse_polygon('0,0; 4; 4,1')
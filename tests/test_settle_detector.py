@@ -0,0 +1,56 @@
+"""
+Tests of the settle detector of 'settle_detector.py'. Run with 'python -m pytest tests' from the repository root.
+"""
+
+import time
+import numpy as np
+import pytest
+from src.settle_detector import SettleDetector, changed_fraction, parse_region
+
+
+class Reading:
+    """
+    Fake window images: blank until change_after seconds, then a trace that stays drawn.
+    """
+    def __init__(self, change_after):
+        self.start = time.time()
+        self.change_after = change_after
+
+    def __call__(self):
+        image = np.zeros((20, 20))
+        if time.time() - self.start >= self.change_after:
+            image[5:15, 5:15] = 1.0
+        return image
+
+
+def detector():
+    return SettleDetector(window=0.1, interval=0.01, min_dwell=0.0)
+
+
+def test_waits_for_a_change_before_the_stable_window():
+    # The image is unchanged for longer than the stable window after the reset, the dwell must not end before the
+    # reading changes and has then been stable for the window
+    waited = detector().wait(Reading(0.3), 2.0)
+    assert 0.4 <= waited < 1.0
+
+
+def test_unchanged_reading_waits_the_dwell_time():
+    waited = detector().wait(Reading(10.0), 0.3)
+    assert waited >= 0.3
+
+
+def test_changed_fraction():
+    a = np.zeros((10, 10, 3))
+    b = a.copy()
+    b[0, :5, 1] = 1
+    assert changed_fraction(a, b) == pytest.approx(0.05)
+    assert changed_fraction(a, np.zeros((5, 5, 3))) == 1.0
+
+
+def test_parse_region():
+    assert parse_region(' ') is None
+    assert parse_region('40, 120, 640, 420') == (40, 120, 640, 420)
+    with pytest.raises(ValueError):
+        parse_region('40, 120, 640')
+    with pytest.raises(ValueError):
+        parse_region('40, 120, 10, 420')
@@ -0,0 +1,62 @@
+"""
+Tests of the early stopping rules of 'stop_policy.py'. Run with 'python -m pytest tests' from the repository root.
+"""
+
+import numpy as np
+import pytest
+from src.stop_policy import ScanStopPolicy, max_slope, upper_bounds
+
+
+def serpentine(rows, cols):
+    return [(row, col) for row in range(rows) for col in (range(cols) if row % 2 == 0 else range(cols - 1, -1, -1))]
+
+
+def scan(field, policy):
+    """
+    Measures the field in serpentine order until the policy stops the scan.
+
+    :return: Boolean numpy array of the points measured.
+    """
+    values = np.zeros(field.shape)
+    measured = np.zeros(field.shape, dtype=bool)
+    order = serpentine(*field.shape)
+    policy.start()
+    for k, (row, col) in enumerate(order):
+        values[row, col] = field[row, col]
+        measured[row, col] = True
+        if policy.should_stop(values, measured, np.array(order[k + 1:])):
+            break
+    return measured
+
+
+@pytest.mark.parametrize('peak', [(7, 0), (7, 1), (6, 11), (9, 3)])
+def test_diagonal_rise_does_not_stop_early(peak):
+    # The field rises by one per row and per column step towards the peak, so a diagonal step rises by 2, more than
+    # the measured slope times the Euclidean length of the step
+    rows, cols = np.indices((12, 12))
+    field = -(np.abs(rows - peak[0]) + np.abs(cols - peak[1])).astype(float)
+    measured = scan(field, ScanStopPolicy(slope_margin=1.0))
+    assert measured[peak]
+
+
+def test_hotspot_stops_after_the_peak():
+    rows, cols = np.indices((12, 12))
+    field = np.exp(-((rows - 3) ** 2 + (cols - 5) ** 2) / 8.0)
+    measured = scan(field, ScanStopPolicy())
+    assert measured[3, 5]
+    assert measured.sum() < field.size
+
+
+def test_budget():
+    policy = ScanStopPolicy(max_points=10)
+    measured = scan(np.zeros((5, 5)), policy)
+    assert measured.sum() == 10
+    assert policy.reason.startswith("measurement budget")
+
+
+def test_bounds():
+    values = np.array([[0.0, 1.0], [0.0, 0.0]])
+    measured = np.array([[True, True], [False, False]])
+    assert max_slope(values, measured) == 1.0
+    assert max_slope(values, np.eye(2, dtype=bool)) is None
+    assert list(upper_bounds(values, measured, [(1, 0), (1, 1)], 1.0)) == [1.0, 2.0]
@@ -0,0 +1,55 @@
+"""
+Tests of the surrogate-model peak search of 'surrogate_search.py'. Run with 'python -m pytest tests' from the repository
+root.
+"""
+
+import numpy as np
+from src.surrogate_search import expected_improvement, search_field
+
+
+def gaussian(shape, row, col, width, height=1.0):
+    rows, cols = np.indices(shape)
+    return height * np.exp(-((rows - row) ** 2 + (cols - col) ** 2) / (2.0 * width ** 2))
+
+
+def test_single_hotspot():
+    field = 0.1 + gaussian((31, 31), 19.3, 11.6, 4.0)
+    search = search_field(field)
+    row, col, value = search.peak()
+    assert abs(row - 19) <= 1 and abs(col - 12) <= 1
+    assert value >= 0.98 * field.max()
+    assert len(search.path) <= field.size // 10
+    assert search.reason.startswith("expected improvement")
+
+
+def test_two_close_peaks():
+    # The higher peak is only 6 grid steps from a slightly lower one: the search must not settle on the lower one
+    field = gaussian((31, 31), 14, 10, 3.0, 0.9) + gaussian((31, 31), 16, 16, 3.0, 1.0)
+    search = search_field(field)
+    row, col, value = search.peak()
+    true_row, true_col = np.unravel_index(np.argmax(field), field.shape)
+    assert abs(row - true_row) <= 1 and abs(col - true_col) <= 1
+    assert value >= 0.98 * field.max()
+    assert len(search.path) <= field.size // 10
+    assert search.reason.startswith("expected improvement")
+
+
+def test_flat_field_terminates():
+    search = search_field(np.ones((15, 15)))
+    assert search.reason is not None
+    assert len(search.path) <= search.max_points
+    assert search.peak()[2] == 1.0
+
+
+def test_expected_improvement_zero_variance():
+    with np.errstate(all='raise'):
+        improvement = expected_improvement(np.array([1.0, 2.0, 0.5]), np.zeros(3), 1.0)
+    assert np.allclose(improvement, [0.0, 1.0, 0.0])
+
+
+def test_expected_improvement_all_values_equal():
+    # Mean at the current maximum: only the uncertainty can bring an improvement
+    improvement = expected_improvement(np.ones(3), np.array([0.0, 0.1, 1.0]), 1.0)
+    assert np.all(np.isfinite(improvement))
+    assert improvement[0] == 0.0
+    assert np.allclose(improvement[1:], np.array([0.1, 1.0]) / np.sqrt(2 * np.pi))
@@ -15,12 +15,16 @@ Chang Hwan 'Oliver' Choi, Biomedical/Software Engineering Intern (Aug. 2018) - c
 
 import sys
 import os
-from src.area_scan import AreaScanThread, ZoomScanThread, CorrectionThread
+from src.area_scan import AreaScanThread, AdaptiveScanThread, PeakSearchThread, ZoomScanThread, CorrectionThread
+from src.scan_mask import parse_polygon
 from src.post_scan_gui import PostScanGUI
 from src.location_select_gui import LocationSelectGUI
 from src.manual_move import ManualMoveGUI
 from src.console_gui import TextRedirector, ConsoleGUI
-from src.motor_driver import ResetThread
+from src.motor_driver import STEP_UNIT, ResetThread
+from src.stop_policy import ScanStopPolicy
+from src.settle_detector import SettleDetector, parse_region
+from src.scan_journal import JOURNAL_NAME, ScanJournal
 import numpy as np
 import matplotlib.pyplot as plt
 import wx
@@ -49,13 +53,17 @@ class MainFrame(wx.Frame):
         self.run_thread = None
         self.zoom_thread = None
         self.corr_thread = None
+        self.jobs = {}  # Controller (as entered, None for the detected one) -> last job thread started on it
         self.console_frame = None
 
         self.curr_row = 0  # Grid coordinate row
         self.curr_col = 0  # Grid coordinate col
         self.values = None  # np.array storing area scan values
         self.zoom_values = None  # np.array storing zoom scan values
+        self.zoom_results = None  # List of the zoom scan values of each peak, highest first
         self.grid = None  # np.array storing 'trajectory' of scans
+        self.origin = None  # Absolute motor position (in steps) of the first point of the area scan grid
+        self.settle_region = None  # Pixel box of the NARDA window compared by the settle detection (None for all)
         self.max_fname = ''  # Name of the image file for the max measurement
         self.logger = None # Logger to create log file
 
@@ -67,6 +75,7 @@ class MainFrame(wx.Frame):
         help_id = 119
         pause_id = 120
         resume_id = 121
+        full_homing_id = 122
         self.accel_tbl = wx.AcceleratorTable([(wx.ACCEL_CTRL, ord('s'), save_id),
                                               (wx.ACCEL_CTRL, ord('r'), run_id),
                                               (wx.ACCEL_CTRL, ord('m'), manual_id),
@@ -104,15 +113,48 @@ class MainFrame(wx.Frame):
         self.pos_tctrl = wx.TextCtrl(self.scan_panel)
         self.pos_tctrl.SetValue(str(0))
 
+        self.controller_text = wx.StaticText(self.scan_panel, label="C4 Controller")
+        self.controller_text.SetFont(wx.Font(9, wx.DECORATIVE, wx.NORMAL, wx.BOLD))
+        self.controllerdesc_text = wx.StaticText(self.scan_panel,
+                                                 label="Port or USB serial number of the positioner (blank to detect)")
+        self.controller_tctrl = wx.TextCtrl(self.scan_panel)
+
+        self.roi_text = wx.StaticText(self.scan_panel, label="Region of Interest")
+        self.roi_text.SetFont(wx.Font(9, wx.DECORATIVE, wx.NORMAL, wx.BOLD))
+        self.roidesc_text = wx.StaticText(self.scan_panel,
+                                          label="Outline vertices 'x,y; x,y; ...' in cm from the first point, "
+                                                "x along X Distance (blank for all)")
+        self.roi_tctrl = wx.TextCtrl(self.scan_panel)
+
+        self.settle_region_text = wx.StaticText(self.scan_panel, label="Settle Region")
+        self.settle_region_text.SetFont(wx.Font(9, wx.DECORATIVE, wx.NORMAL, wx.BOLD))
+        self.settle_regiondesc_text = wx.StaticText(self.scan_panel,
+                                                    label="Readout area 'left,top,right,bottom' in the NARDA window "
+                                                          "(px, blank for the whole window)")
+        self.settle_region_tctrl = wx.TextCtrl(self.scan_panel)
+
         self.times_text = wx.StaticText(self.scan_panel, label="Dwell Time Settings")
         self.times_text.SetFont(wx.Font(9, wx.DECORATIVE, wx.NORMAL, wx.BOLD))
         self.dwell_time_text = wx.StaticText(self.scan_panel, label="Pre-Measurement Dwell Time (Area scan, in sec)")
         self.dwell_tctrl = wx.TextCtrl(self.scan_panel)
         self.dwell_tctrl.SetValue(str(3))
-        self.zoom_scan_dwell_time_text = wx.StaticText(self.scan_panel, label="Pre-Measurement Dwell Time (Zoom scan, in sec)")
+        self.zoom_scan_dwell_time_text = wx.StaticText(self.scan_panel,
+                                                       label="Pre-Measurement Dwell Time (Zoom scan, in sec)")
         self.zdwell_tctrl = wx.TextCtrl(self.scan_panel)
         self.zdwell_tctrl.SetValue(str(3))
 
+        self.zoom_settings_text = wx.StaticText(self.scan_panel, label="Zoom Scan Settings")
+        self.zoom_settings_text.SetFont(wx.Font(9, wx.DECORATIVE, wx.NORMAL, wx.BOLD))
+        self.zoom_peaks_text = wx.StaticText(self.scan_panel, label="Peaks:")
+        self.zoom_peaks_tctrl = wx.TextCtrl(self.scan_panel)
+        self.zoom_peaks_tctrl.SetValue(str(1))
+        self.zoom_points_text = wx.StaticText(self.scan_panel, label="Grid Points:")
+        self.zoom_points_tctrl = wx.TextCtrl(self.scan_panel)
+        self.zoom_points_tctrl.SetValue(str(5))
+        self.zoom_factor_text = wx.StaticText(self.scan_panel, label="Subdivision:")
+        self.zoom_factor_tctrl = wx.TextCtrl(self.scan_panel)
+        self.zoom_factor_tctrl.SetValue(str(4))
+
         self.span_text = wx.StaticText(self.scan_panel, label="Span Settings")
         self.span_text.SetFont(wx.Font(9, wx.DECORATIVE, wx.NORMAL, wx.BOLD))
         self.span_start_text = wx.StaticText(self.scan_panel, label="Start (MHz):")
@@ -135,6 +177,16 @@ class MainFrame(wx.Frame):
 
         self.zoom_checkbox = wx.CheckBox(self.scan_panel, label="Zoom Scan")
         self.zoom_checkbox.SetValue(False)
+        self.adaptive_checkbox = wx.CheckBox(self.scan_panel, label="Adaptive (Coarse-to-Fine)")
+        self.adaptive_checkbox.SetValue(False)
+        self.early_stop_checkbox = wx.CheckBox(self.scan_panel, label="Stop Once Peak Is Located")
+        self.early_stop_checkbox.SetValue(False)
+        self.peak_search_checkbox = wx.CheckBox(self.scan_panel, label="Peak Search (Model-Guided)")
+        self.peak_search_checkbox.SetValue(False)
+        self.settle_checkbox = wx.CheckBox(self.scan_panel, label="End Dwell Once Reading Settles")
+        self.settle_checkbox.SetValue(False)
+        self.dry_run_checkbox = wx.CheckBox(self.scan_panel, label="Dry Run (Estimate Only)")
+        self.dry_run_checkbox.SetValue(False)
 
         self.test_info_text = wx.StaticText(self.scan_panel, label="Test Information")
         self.test_info_text.SetFont(wx.Font(10, wx.DECORATIVE, wx.NORMAL, wx.BOLD))
@@ -179,9 +231,14 @@ class MainFrame(wx.Frame):
         pause_item = wx.MenuItem(helpmenu, pause_id, text="Pause", kind=wx.ITEM_NORMAL)
         helpmenu.Append(shortcuthelp_item)
         helpmenu.Append(pause_item)
+        motormenu = wx.Menu()
+        full_homing_item = wx.MenuItem(motormenu, full_homing_id, text="Full Homing", kind=wx.ITEM_NORMAL)
+        motormenu.Append(full_homing_item)
         menubar.Append(helpmenu, 'Help')
+        menubar.Append(motormenu, 'Motors')
         self.Bind(wx.EVT_MENU, self.showshortcuts, id=help_id)
         self.Bind(wx.EVT_MENU, self.pauseProg, id=pause_id)
+        self.Bind(wx.EVT_MENU, self.full_homing, id=full_homing_id)
         self.SetMenuBar(menubar)
 
         # Sizers/Layout, Static Lines, & Static Boxes
@@ -189,6 +246,7 @@ class MainFrame(wx.Frame):
         self.checkbox_sizer = wx.BoxSizer(wx.HORIZONTAL)
         self.pos_sizer = wx.BoxSizer(wx.HORIZONTAL)
         self.span_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        self.zoom_settings_sizer = wx.BoxSizer(wx.HORIZONTAL)
         self.test_info_sizer = wx.GridSizer(rows=4, cols=2, hgap=0, vgap=0)
         self.text_input_sizer = wx.BoxSizer(wx.VERTICAL)
         self.radio_input_sizer = wx.BoxSizer(wx.VERTICAL)
@@ -212,12 +270,31 @@ class MainFrame(wx.Frame):
         self.pos_sizer.Add(self.pos_text, proportion=0, flag=wx.LEFT)
         self.pos_sizer.Add(self.pos_tctrl, proportion=1, flag=wx.LEFT | wx.RIGHT | wx.EXPAND, border=5)
         self.text_input_sizer.Add(self.pos_sizer, proportion=0, flag=wx.EXPAND)
+        self.text_input_sizer.Add(self.controller_text, proportion=0, flag=wx.LEFT)
+        self.text_input_sizer.Add(self.controllerdesc_text, proportion=0, flag=wx.LEFT)
+        self.text_input_sizer.Add(self.controller_tctrl, proportion=0, flag=wx.LEFT | wx.RIGHT | wx.EXPAND, border=5)
+        self.text_input_sizer.Add(self.roi_text, proportion=0, flag=wx.LEFT)
+        self.text_input_sizer.Add(self.roidesc_text, proportion=0, flag=wx.LEFT)
+        self.text_input_sizer.Add(self.roi_tctrl, proportion=0, flag=wx.LEFT | wx.RIGHT | wx.EXPAND, border=5)
+        self.text_input_sizer.Add(self.settle_region_text, proportion=0, flag=wx.LEFT)
+        self.text_input_sizer.Add(self.settle_regiondesc_text, proportion=0, flag=wx.LEFT)
+        self.text_input_sizer.Add(self.settle_region_tctrl, proportion=0, flag=wx.LEFT | wx.RIGHT | wx.EXPAND,
+                                  border=5)
 
         self.text_input_sizer.Add(self.times_text, proportion=0, flag=wx.LEFT)
         self.text_input_sizer.Add(self.dwell_time_text, proportion=0, flag=wx.LEFT)
         self.text_input_sizer.Add(self.dwell_tctrl, proportion=0, flag=wx.LEFT)
         self.text_input_sizer.Add(self.zoom_scan_dwell_time_text, proportion=0, flag=wx.LEFT)
         self.text_input_sizer.Add(self.zdwell_tctrl, proportion=0, flag=wx.LEFT)
+        self.text_input_sizer.Add(self.zoom_settings_text, proportion=0, flag=wx.LEFT)
+        self.zoom_settings_sizer.Add(self.zoom_peaks_text, proportion=0, flag=wx.LEFT)
+        self.zoom_settings_sizer.Add(self.zoom_peaks_tctrl, proportion=1, flag=wx.LEFT | wx.RIGHT | wx.EXPAND, border=5)
+        self.zoom_settings_sizer.Add(self.zoom_points_text, proportion=0, flag=wx.LEFT)
+        self.zoom_settings_sizer.Add(self.zoom_points_tctrl, proportion=1, flag=wx.LEFT | wx.RIGHT | wx.EXPAND,
+                                     border=5)
+        self.zoom_settings_sizer.Add(self.zoom_factor_text, proportion=0, flag=wx.LEFT)
+        self.zoom_settings_sizer.Add(self.zoom_factor_tctrl, proportion=1, flag=wx.LEFT | wx.EXPAND, border=5)
+        self.text_input_sizer.Add(self.zoom_settings_sizer, proportion=0, flag=wx.EXPAND)
         self.text_input_sizer.Add(self.span_text, proportion=0, flag=wx.LEFT)
         self.span_sizer.Add(self.span_start_text, proportion=0, flag=wx.LEFT)
         self.span_sizer.Add(self.span_start_tctrl, proportion=1, flag=wx.LEFT | wx.RIGHT | wx.EXPAND, border=5)
@@ -230,6 +307,11 @@ class MainFrame(wx.Frame):
         self.saveline_sizer.Add(self.save_btn, proportion=0, flag=wx.ALIGN_RIGHT | wx.LEFT, border=5)
         self.checkbox_sizer.Add(self.auto_checkbox, proportion=0, flag=wx.ALIGN_LEFT | wx.ALL, border=5)
         self.checkbox_sizer.Add(self.zoom_checkbox, proportion=0, flag=wx.ALIGN_LEFT | wx.ALL, border=5)
+        self.checkbox_sizer.Add(self.adaptive_checkbox, proportion=0, flag=wx.ALIGN_LEFT | wx.ALL, border=5)
+        self.checkbox_sizer.Add(self.early_stop_checkbox, proportion=0, flag=wx.ALIGN_LEFT | wx.ALL, border=5)
+        self.checkbox_sizer.Add(self.peak_search_checkbox, proportion=0, flag=wx.ALIGN_LEFT | wx.ALL, border=5)
+        self.checkbox_sizer.Add(self.settle_checkbox, proportion=0, flag=wx.ALIGN_LEFT | wx.ALL, border=5)
+        self.checkbox_sizer.Add(self.dry_run_checkbox, proportion=0, flag=wx.ALIGN_LEFT | wx.ALL, border=5)
         self.text_input_sizer.Add(self.saveline_sizer, proportion=0, flag=wx.LEFT | wx.EXPAND)
         self.text_input_sizer.Add(self.checkbox_sizer, proportion=0, flag=wx.LEFT | wx.EXPAND)
         self.text_input_sizer.Add(wx.StaticLine(self.scan_panel, wx.ID_ANY, style=wx.LI_HORIZONTAL),
@@ -322,6 +404,9 @@ class MainFrame(wx.Frame):
             config['start_pos'] = self.pos_tctrl.GetValue()
             config['dwell'] = self.dwell_tctrl.GetValue()
             config['zdwell'] = self.zdwell_tctrl.GetValue()
+            config['zoom_peaks'] = self.zoom_peaks_tctrl.GetValue()
+            config['zoom_points'] = self.zoom_points_tctrl.GetValue()
+            config['zoom_factor'] = self.zoom_factor_tctrl.GetValue()
             config['start'] = self.span_start_tctrl.GetValue()
             config['stop'] = self.span_stop_tctrl.GetValue()
             config['checkbox'] = self.auto_checkbox.GetValue()
@@ -332,6 +417,14 @@ class MainFrame(wx.Frame):
             config['measurement'] = self.meas_rbox.GetSelection()
             config['dir'] = self.save_tctrl.GetValue()
             config['zoom'] = self.zoom_checkbox.GetValue()
+            config['adaptive'] = self.adaptive_checkbox.GetValue()
+            config['early_stop'] = self.early_stop_checkbox.GetValue()
+            config['peak_search'] = self.peak_search_checkbox.GetValue()
+            config['settle'] = self.settle_checkbox.GetValue()
+            config['dry_run'] = self.dry_run_checkbox.GetValue()
+            config['controller'] = self.controller_tctrl.GetValue()
+            config['roi'] = self.roi_tctrl.GetValue()
+            config['settle_region'] = self.settle_region_tctrl.GetValue()
 
             json.dump(config,open(filename,'w'))
 
@@ -355,6 +448,9 @@ class MainFrame(wx.Frame):
             self.pos_tctrl.SetValue(config['start_pos'])
             self.dwell_tctrl.SetValue(config['dwell'])
             self.zdwell_tctrl.SetValue(config['zdwell'])
+            self.zoom_peaks_tctrl.SetValue(config.get('zoom_peaks', str(1)))
+            self.zoom_points_tctrl.SetValue(config.get('zoom_points', str(5)))
+            self.zoom_factor_tctrl.SetValue(config.get('zoom_factor', str(4)))
             self.span_start_tctrl.SetValue(config['start'])
             self.span_stop_tctrl.SetValue(config['stop'])
             self.auto_checkbox.SetValue(config['checkbox'])
@@ -363,8 +459,16 @@ class MainFrame(wx.Frame):
             self.side_rbox.SetSelection(int(config['side']))
             self.rbw_rbox.SetSelection(int(config['rbw']))
             self.meas_rbox.SetSelection(int(config['measurement']))
+            self.controller_tctrl.SetValue(config.get('controller', ''))
+            self.roi_tctrl.SetValue(config.get('roi', ''))
+            self.settle_region_tctrl.SetValue(config.get('settle_region', ''))
             self.save_tctrl.SetValue(config['dir'])
             self.zoom_checkbox.SetValue(config['zoom'])
+            self.adaptive_checkbox.SetValue(config.get('adaptive', False))
+            self.early_stop_checkbox.SetValue(config.get('early_stop', False))
+            self.peak_search_checkbox.SetValue(config.get('peak_search', False))
+            self.settle_checkbox.SetValue(config.get('settle', False))
+            self.dry_run_checkbox.SetValue(config.get('dry_run', False))
 
     def run_area_scan(self, e):
         """
@@ -394,6 +498,16 @@ class MainFrame(wx.Frame):
         except ValueError:
             self.errormsg("Invalid scan parameters.\nPlease input numerical values only.")
             return
+        try:
+            roi = parse_polygon(self.roi_tctrl.GetValue())
+        except ValueError as err:
+            self.errormsg("Invalid region of interest.\n%s" % err)
+            return
+        try:
+            self.settle_region = parse_region(self.settle_region_tctrl.GetValue())
+        except ValueError as err:
+            self.errormsg("Invalid settle region.\n%s" % err)
+            return
         # Build comment for savefiles
         if self.eut_model_tctrl.GetValue() is '' or self.eut_sn_tctrl.GetValue() is '' or \
                 self.initials_tctrl.GetValue() is '' or self.test_num_tctrl.GetValue() is '':
@@ -415,17 +529,20 @@ class MainFrame(wx.Frame):
         # Finding the measurement
         meas = self.meas_rbox.GetStringSelection()
         start_pos = int(self.pos_tctrl.GetValue())
+        if not self.check_job(self.get_controller(), scan=not self.dry_run_checkbox.GetValue()):
+            return
         self.logger = Log(self.getLogFileName()).getLogger()
 
         if zoom_scan:
             # convert grid number to row and col
             try:
                 zdwell = float(self.zdwell_tctrl.GetValue())
+                num_peaks, zoom_points, zoom_factor = self.get_zoom_settings()
             except ValueError:
                 self.errormsg("Invalid scan parameters.\nPlease input numerical values only.")
                 return
             # Preparation
-            step_unit = 0.00508  # TODO: Used the default step_unit for now, fix this when unit change
+            step_unit = STEP_UNIT  # TODO: Used the default step_unit for now, fix this when unit change
             num_steps = step / step_unit
             x_points = int(np.ceil(np.around(x / step, decimals=3))) + 1
             y_points = int(np.ceil(np.around(y / step, decimals=3))) + 1
@@ -433,11 +550,46 @@ class MainFrame(wx.Frame):
             #print("y_points: ", y_points)
             self.run_thread = ZoomScanThread(self, zdwell, span_start, span_stop,savedir, comment, meas_type,
                                              meas_field, meas_side, meas_rbw, meas, num_steps, self.values, self.grid,
-                                             self.curr_row, self.curr_col, zoom_scan, start_pos, x_points, y_points)
+                                             self.curr_row, self.curr_col, zoom_scan, start_pos, x_points, y_points,
+                                             controller=self.get_controller(), zoom_points=zoom_points,
+                                             zoom_factor=zoom_factor, settle=self.get_settle_detector(),
+                                             dry_run=self.dry_run_checkbox.GetValue())
         else:
+            if self.adaptive_checkbox.GetValue() and self.peak_search_checkbox.GetValue():
+                self.errormsg("Please select either an adaptive scan or a peak search, not both.")
+                return
+            # Adaptive scans refine the grid only around the highest values of a coarse pass, peak searches measure
+            # only the points a surrogate model expects to improve the maximum
+            scan_thread = AreaScanThread
+            if self.adaptive_checkbox.GetValue():
+                scan_thread = AdaptiveScanThread
+            elif self.peak_search_checkbox.GetValue():
+                scan_thread = PeakSearchThread
+            # Scans run for the maximum location only can stop once no point left can exceed the maximum
+            stop_policy = ScanStopPolicy() if self.early_stop_checkbox.GetValue() else None
+            # Offer to resume a scan interrupted by a crash (its measured points are kept in the scan journal)
+            resume = False
+            journal = ScanJournal.interrupted(os.path.join(savedir, JOURNAL_NAME))
+            if scan_thread is AreaScanThread and journal is not None and not self.dry_run_checkbox.GetValue():
+                with wx.MessageDialog(self, "An interrupted scan (%d point(s) measured) was found in the save "
+                                            "directory.\nResume it? Select 'No' to start a new scan."
+                                      % len(journal.records), 'Resume Scan',
+                                      style=wx.YES_NO | wx.ICON_QUESTION | wx.CENTER) as dlg:
+                    resume = dlg.ShowModal() == wx.ID_YES
+            elif journal is not None and not self.dry_run_checkbox.GetValue():
+                # Adaptive scans and peak searches are not journaled, the interrupted scan is left in place
+                with wx.MessageDialog(self, "An interrupted scan (%d point(s) measured) was found in the save "
+                                            "directory.\nOnly general area scans can be resumed: run one with the "
+                                            "same settings to resume it. This scan will not be journaled."
+                                      % len(journal.records), 'Interrupted Scan',
+                                      style=wx.OK | wx.ICON_INFORMATION | wx.CENTER) as dlg:
+                    dlg.ShowModal()
             try:
-                self.run_thread = AreaScanThread(self, x, y, step, dwell, span_start, span_stop, savedir,
-                                             comment, meas_type, meas_field, meas_side, meas_rbw, meas, start_pos)
+                self.run_thread = scan_thread(self, x, y, step, dwell, span_start, span_stop, savedir,
+                                             comment, meas_type, meas_field, meas_side, meas_rbw, meas, start_pos,
+                                             controller=self.get_controller(), roi=roi, stop_policy=stop_policy,
+                                             resume=resume, settle=self.get_settle_detector(),
+                                             dry_run=self.dry_run_checkbox.GetValue())
             except:
                 self.run_thread.join()
 
@@ -450,7 +602,7 @@ class MainFrame(wx.Frame):
         sys.stderr = TextRedirector(self.console_frame.console_tctrl)  # Redirect text from stderr to the console
         print("Running general scan...")
         self.logger.info("Running general scan...")
-        self.run_thread.start()
+        self.start_job(self.run_thread)
 
     def run_post_scan(self):
         """
@@ -461,7 +613,7 @@ class MainFrame(wx.Frame):
         :return: Nothing.
         """
         # Plot the scan
-        plotvals = np.copy(self.values)
+        plotvals = np.ma.masked_invalid(self.values)  # Points outside the region of interest are left blank
         plotvals = np.rot90(plotvals)
         plt.close()
         plt.imshow(plotvals, interpolation='bilinear',
@@ -485,6 +637,7 @@ class MainFrame(wx.Frame):
         if choice == 'Zoom Scan':
             try:
                 zdwell = float(self.zdwell_tctrl.GetValue())
+                num_peaks, zoom_points, zoom_factor = self.get_zoom_settings()
             except ValueError:
                 self.errormsg("Invalid scan parameters.\nPlease input numerical values only.")
                 return
@@ -499,17 +652,22 @@ class MainFrame(wx.Frame):
             meas_rbw = self.rbw_rbox.GetStringSelection()
             # Finding the measurement
             meas = self.meas_rbox.GetStringSelection()
+            if not self.check_job(self.run_thread.controller, scan=True):
+                return
 
             self.zoom_thread = ZoomScanThread(self, zdwell, self.run_thread.span_start, self.run_thread.span_stop,
                                               savedir, self.run_thread.comment, meas_type, meas_field, meas_side,
                                               meas_rbw, meas, self.run_thread.num_steps, self.values, self.grid,
-                                              self.curr_row, self.curr_col, False, 0, 0, 0)
+                                              self.curr_row, self.curr_col, False, 0, 0, 0, self.origin,
+                                              controller=self.run_thread.controller, num_peaks=num_peaks,
+                                              zoom_points=zoom_points, zoom_factor=zoom_factor,
+                                              settle=self.get_settle_detector())
             if not self.console_frame:
                 self.console_frame = ConsoleGUI(self, "Console")
             self.console_frame.Show(True)
             sys.stdout = TextRedirector(self.console_frame.console_tctrl)  # Redirect text from stdout to the console
             sys.stderr = TextRedirector(self.console_frame.console_tctrl)  # Redirect text from stderr to the console
-            self.zoom_thread.start()
+            self.start_job(self.zoom_thread)
 
         elif choice == 'Correct Previous Value':
             loc_gui = LocationSelectGUI(self, "Location Selection", self.grid)
@@ -531,21 +689,24 @@ class MainFrame(wx.Frame):
         """
         self.curr_row = call_thread.curr_row
         self.curr_col = call_thread.curr_col
-        if type(call_thread) is AreaScanThread:
+        if isinstance(call_thread, AreaScanThread):  # Including AdaptiveScanThread
             self.values = call_thread.values
             self.grid = call_thread.grid
             self.max_fname = call_thread.max_fname
+            self.origin = call_thread.origin
         elif type(call_thread) is CorrectionThread:
             self.values = call_thread.values
+            self.max_fname = call_thread.max_fname
         elif type(call_thread) is ZoomScanThread:
             self.zoom_values = call_thread.zoom_values
+            self.zoom_results = call_thread.zoom_results
 
     def run_correction(self, target_index):
         """
         Runs the 'Correct Previous Value' option from the Post Scan GUI. Starts and runs an instance of
-        CorrectionThread to retake a measurement in the specified coordinate.
+        CorrectionThread to retake the measurements in the specified coordinates in one pass.
 
-        :param target_index: the index in the grid that the user chooses to correct.
+        :param target_index: the index in the grid that the user chooses to correct, or a list of indices.
         :return: Nothing.
         """
         savedir = self.save_tctrl.GetValue()
@@ -557,17 +718,23 @@ class MainFrame(wx.Frame):
         meas_side = self.side_rbox.GetStringSelection()
         # Finding the RBW setting
         meas_rbw = self.rbw_rbox.GetStringSelection()
+        # Finding the measurement
+        meas = self.meas_rbox.GetStringSelection()
+        if not self.check_job(self.run_thread.controller, scan=True):
+            return
         self.corr_thread = CorrectionThread(self, target_index, self.run_thread.num_steps,
                                             float(self.dwell_tctrl.GetValue()), self.run_thread.span_start,
                                             self.run_thread.span_stop, self.values, self.grid,
                                             self.curr_row, self.curr_col, savedir, self.run_thread.comment,
-                                            meas_type, meas_field, meas_side, meas_rbw, self.max_fname)
+                                            meas_type, meas_field, meas_side, meas_rbw, meas, self.max_fname,
+                                            self.origin, controller=self.run_thread.controller,
+                                            settle=self.get_settle_detector())
         if not self.console_frame:
             self.console_frame = ConsoleGUI(self, "Console")
         self.console_frame.Show(True)
         sys.stdout = TextRedirector(self.console_frame.console_tctrl)  # Redirect text from stdout to the console
         sys.stderr = TextRedirector(self.console_frame.console_tctrl)  # Redirect text from stderr to the console
-        self.corr_thread.start()
+        self.start_job(self.corr_thread)
 
     def manual_move(self, e):
         """
@@ -577,6 +744,8 @@ class MainFrame(wx.Frame):
         :param e: Event handler.
         :return: Nothing.
         """
+        if not self.check_job(self.get_controller()):
+            return
         if not self.console_frame:
             self.console_frame = ConsoleGUI(self, "Console")
         self.console_frame.Show(True)
@@ -587,24 +756,107 @@ class MainFrame(wx.Frame):
         except ValueError:
             self.errormsg("Invalid scan parameters.\nPlease input numerical values only.")
             return
-        manual = ManualMoveGUI(self, "Manual Movement", step)
+        manual = ManualMoveGUI(self, "Manual Movement", step, self.get_controller())
         manual.Show(True)
 
-    def reset_motors(self, e):
+    def reset_motors(self, e, full=False):
         """
         Resets the motors back to their default position. Starts and runs instance of ResetThread to facilitate motor
-        resets. Opens terminal console if not open already.
+        resets. Opens terminal console if not open already. The motors are moved directly to their default position if
+        their position is known, a full homing cycle is run otherwise.
 
         :param e: Event handler.
+        :param full: Run a full homing cycle even if the motor position is known.
         :return: Nothing.
         """
-        self.disablegui()
+        # The other controllers stay available while this one resets
+        if not self.check_job(self.get_controller()):
+            return
         if not self.console_frame:
             self.console_frame = ConsoleGUI(self, "Console")
         self.console_frame.Show(True)
         sys.stdout = TextRedirector(self.console_frame.console_tctrl)  # Redirect text from stdout to the console
         sys.stderr = TextRedirector(self.console_frame.console_tctrl)  # Redirect text from stderr to the console
-        ResetThread(self).start()
+        self.start_job(ResetThread(self, full, self.get_controller()))
+
+    def full_homing(self, e):
+        """
+        Resets the motors with a full homing cycle (e.g. after the controller has been power-cycled or a motor has been
+        moved by hand).
+
+        :param e: Event handler.
+        :return: Nothing.
+        """
+        self.reset_motors(e, full=True)
+
+    def get_zoom_settings(self):
+        """
+        Returns the zoom scan settings entered by the user.
+
+        :return: Number of peaks to zoom on, number of zoom grid points per side and zoom subdivision factor.
+        :raises ValueError: If a setting is not a positive integer.
+        """
+        settings = (int(self.zoom_peaks_tctrl.GetValue()), int(self.zoom_points_tctrl.GetValue()),
+                    int(self.zoom_factor_tctrl.GetValue()))
+        if min(settings) < 1:
+            raise ValueError("Zoom scan settings must be positive")
+        return settings
+
+    def get_controller(self):
+        """
+        Returns the C4 controller selected for this bench.
+
+        :return: Port name or USB serial number entered by the user, None to use the detected controller.
+        """
+        return self.controller_tctrl.GetValue().strip() or None
+
+    def job_running(self, controller):
+        """
+        :param controller: Port name or USB serial number of the C4 controller (None for the detected controller).
+        :return: True if a scan or reset is running on the controller.
+        """
+        thread = self.jobs.get(controller)
+        return thread is not None and thread.is_alive()
+
+    def check_job(self, controller, scan=False):
+        """
+        Checks that a new job can start on a controller, and tells the user why if not. Each controller runs one job at
+        a time, jobs on different controllers run concurrently. Scans are the exception: they drive the EHP200-TS
+        window with the mouse and keyboard, so only one scan runs at a time, whatever its controller.
+
+        :param controller: Port name or USB serial number of the C4 controller (None for the detected controller).
+        :param scan: True if the job measures (area scan, zoom scan or correction).
+        :return: True if the job can start.
+        """
+        if self.job_running(controller):
+            self.errormsg("A job is already running on controller '%s'.\nWait for it to finish or select another "
+                          "controller." % (controller or "detected"))
+            return False
+        if scan:
+            for other, thread in self.jobs.items():
+                if thread.is_alive() and not isinstance(thread, ResetThread):
+                    self.errormsg("A scan is already running on controller '%s'.\nThe EHP200-TS window can only be "
+                                  "used by one scan at a time." % (other or "detected"))
+                    return False
+        return True
+
+    def start_job(self, thread):
+        """
+        Starts a job thread and records it as the job of its controller.
+
+        :param thread: Scan or reset thread, with a 'controller' attribute.
+        :return: Nothing.
+        """
+        self.jobs[thread.controller] = thread
+        thread.start()
+
+    def get_settle_detector(self):
+        """
+        Returns the settle detection selected for the scans.
+
+        :return: SettleDetector if the dwell should end once the reading settles, None to always wait the dwell time.
+        """
+        return SettleDetector(region=self.settle_region) if self.settle_checkbox.GetValue() else None
 
     def enablegui(self):
         """
@@ -617,11 +869,19 @@ class MainFrame(wx.Frame):
         self.grid_tctrl.Enable(True)
         self.dwell_tctrl.Enable(True)
         self.zdwell_tctrl.Enable(True)
+        self.zoom_peaks_tctrl.Enable(True)
+        self.zoom_points_tctrl.Enable(True)
+        self.zoom_factor_tctrl.Enable(True)
         self.span_start_tctrl.Enable(True)
         self.span_stop_tctrl.Enable(True)
         self.save_tctrl.Enable(True)
         self.auto_checkbox.Enable(True)
         self.zoom_checkbox.Enable(True)
+        self.adaptive_checkbox.Enable(True)
+        self.early_stop_checkbox.Enable(True)
+        self.peak_search_checkbox.Enable(True)
+        self.settle_checkbox.Enable(True)
+        self.dry_run_checkbox.Enable(True)
         self.save_btn.Enable(True)
         self.eut_model_tctrl.Enable(True)
         self.eut_sn_tctrl.Enable(True)
@@ -631,6 +891,9 @@ class MainFrame(wx.Frame):
         self.field_rbox.Enable(True)
         self.side_rbox.Enable(True)
         self.rbw_rbox.Enable(True)
+        self.controller_tctrl.Enable(True)
+        self.roi_tctrl.Enable(True)
+        self.settle_region_tctrl.Enable(True)
         self.reset_btn.Enable(True)
         self.manual_btn.Enable(True)
         self.run_btn.Enable(True)
@@ -646,11 +909,19 @@ class MainFrame(wx.Frame):
         self.grid_tctrl.Enable(False)
         self.dwell_tctrl.Enable(False)
         self.zdwell_tctrl.Enable(False)
+        self.zoom_peaks_tctrl.Enable(False)
+        self.zoom_points_tctrl.Enable(False)
+        self.zoom_factor_tctrl.Enable(False)
         self.span_start_tctrl.Enable(False)
         self.span_stop_tctrl.Enable(False)
         self.save_tctrl.Enable(False)
         self.auto_checkbox.Enable(False)
         self.zoom_checkbox.Enable(False)
+        self.adaptive_checkbox.Enable(False)
+        self.early_stop_checkbox.Enable(False)
+        self.peak_search_checkbox.Enable(False)
+        self.settle_checkbox.Enable(False)
+        self.dry_run_checkbox.Enable(False)
         self.save_btn.Enable(False)
         self.eut_model_tctrl.Enable(False)
         self.eut_sn_tctrl.Enable(False)
@@ -660,6 +931,9 @@ class MainFrame(wx.Frame):
         self.field_rbox.Enable(False)
         self.side_rbox.Enable(False)
         self.rbw_rbox.Enable(False)
+        self.controller_tctrl.Enable(False)
+        self.roi_tctrl.Enable(False)
+        self.settle_region_tctrl.Enable(False)
         self.reset_btn.Enable(False)
         self.manual_btn.Enable(False)
         self.run_btn.Enable(False)